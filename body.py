@@ -5,6 +5,8 @@ import logging
 
 from support import Support
 from parameters import Parameters
+from screw_hole_table import ScrewHoleTable
+from module_call import ModuleCall, get_module_definition
 from solid import (
     union,
     cube,
@@ -74,7 +76,18 @@ class Body:
 
         self.screw_hole_coordinates = []
 
-        self.screw_hole_info = {}
+        self.screw_hole_table = ScrewHoleTable()
+
+        # OpenSCAD module definitions for the screw holes and screw hole bodies. Built on first use
+        self.screw_hole_module_definitions = None
+
+        # Optional x range, in the same coordinates as the switches, that generated objects must overlap
+        # to be included. Used to skip geometry that would be removed when building a single section
+        self.clip_min_x = None
+        self.clip_max_x = None
+
+        # Preview builds use square corners instead of minkowski rounding and skip the plate supports
+        self.preview = False
 
         self.case_height_base_removed = self.parameters.case_height_base_removed
         self.case_height_extra_fill = self.parameters.case_height_extra_fill
@@ -194,14 +207,27 @@ class Body:
         self.build_attr_from_dict(self.parameter_dict)
         self.update_calculated_attributes()
 
+    def set_clip_x_range(self, min_x=None, max_x=None):
+        self.clip_min_x = min_x
+        self.clip_max_x = max_x
+
+    def in_clip_x_range(self, start_x, end_x):
+        if self.clip_min_x is not None and end_x < self.clip_min_x:
+            return False
+        if self.clip_max_x is not None and start_x > self.clip_max_x:
+            return False
+
+        return True
+
     def plate(self, case_x, case_y, pre_minkowski_thickness, round_corner):
 
         # Get absolute value of min_y to get real y value
         max_y = abs(self.min_y)
 
         # Create plate and round the corners using cylcinder that was passed in
-        plate_object = cube([case_x, case_y, pre_minkowski_thickness], center=True)
-        plate_object = minkowski()(plate_object, round_corner)
+        plate_object = self.round_block(
+            [case_x, case_y, pre_minkowski_thickness], round_corner
+        )
 
         # Move plate to be centered on the switches
         # Offset the move to ensure margin differences are accounted for.
@@ -216,7 +242,7 @@ class Body:
         #     plate_object -= screw_holes
 
         # If palte supprts should be added
-        if self.plate_supports:
+        if self.plate_supports and not self.preview:
             # Get the ceiling values for the max x and y so thet we loop ove all spaces
             max_x_ceil = math.ceil(self.max_x)
             max_y_ceil = math.ceil(max_y)
@@ -260,6 +286,13 @@ class Body:
                 if max_x_diff < 0:
                     # Reduce w to be remaining x value
                     w = self.max_x - x
+
+                # Skip the whole column if it is outside of the clip range
+                if not self.in_clip_x_range(
+                    self.parameters.U(x), self.parameters.U(x + w)
+                ):
+                    continue
+
                 # For each y in the ceiling of max_y
                 for y in range(max_y_ceil):
                     # self.logger.debug('x: %f, y: %f', x, y)
@@ -296,11 +329,10 @@ class Body:
         return plate_object
 
     def case_body_block(self, case_x, case_y, round_corner):
-        # Create case wall part
-        case_block = cube([case_x, case_y, self.case_height_extra_fill], center=True)
-
-        # Round the corners of the case wall and
-        case_block = minkowski()(case_block, round_corner)
+        # Create case wall part and round the corners of the case wall
+        case_block = self.round_block(
+            [case_x, case_y, self.case_height_extra_fill], round_corner
+        )
 
         return case_block
 
@@ -310,18 +342,15 @@ class Body:
         case_wall = self.case_body_block(case_x, case_y, round_corner)
 
         # Create inner area that will be removed from case wall
-        case_inner = cube(
+        case_inner = self.round_block(
             [
                 case_x - (self.case_wall_thickness * 2),
                 case_y - (self.case_wall_thickness * 2),
                 self.case_height_extra_fill * 2,
             ],
-            center=True,
+            square_corner,
         )
 
-        # Round the corners of the case wall and case inner
-        case_inner = minkowski()(case_inner, square_corner)
-
         # Remove the innser empty space from the case wall
         case_wall -= case_inner
 
@@ -341,6 +370,20 @@ class Body:
         # Return the case wall object
         return case_wall
 
+    def round_block(self, size, corner):
+        # The minkowski sum grows the block by the corner size. Previews use a box with the same outer size
+        if self.preview:
+            return cube(
+                [
+                    size[0] + (self.plate_corner_radius * 2),
+                    size[1] + (self.plate_corner_radius * 2),
+                    size[2] + (self.plate_thickness / 2),
+                ],
+                center=True,
+            )
+
+        return minkowski()(cube(size, center=True), corner)
+
     def case(self, body_block_only=False, plate_only=False):
         # Get the margins for the plate without the ammount that the minkowski will add
         pre_minkowski_x_margin = (
@@ -424,10 +467,6 @@ class Body:
         hole_support = linear_extrude(height=2, center=True)(hole_support)
         hole_support = rotate(90, [1, 0, 0])(hole_support)
 
-        self.screw_hole_info[screw_name]["support_directions"][
-            direction
-        ] = self.screw_hole_body_support_end_x
-
         if direction == "right":
             return hole_support
         elif direction == "left":
@@ -556,47 +595,35 @@ class Body:
                 self.screw_hole_coordinates.append(custom_coords_adjusted)
 
         for coords in self.screw_hole_coordinates:
-            coords_string = str(coords[0]) + "," + str(coords[1])
-            # coords_string = ','.join(coords)
             custom_support_direction = None
             if len(coords) == 3:
                 custom_support_direction = coords[2]
-            self.screw_hole_info[coords_string] = {
-                "coordinates": [coords[0], coords[1]],
-                "x": coords[0] + self.screw_edge_x_inset,
-                "y": coords[1] + self.screw_edge_y_inset,
-                "support_directions": {
-                    "right": False,
-                    "left": False,
-                    "forward": False,
-                    "back": False,
-                },
-                "custom_support_direction": custom_support_direction,
-            }
+            self.screw_hole_table.add_screw_hole(
+                coords[0],
+                coords[1],
+                coords[0] + self.screw_edge_x_inset,
+                coords[1] + self.screw_edge_y_inset,
+                custom_support_direction,
+            )
 
-    def screw_hole_objects(self, tap=False):
+    def set_screw_hole_support_directions(self):
 
-        if len(self.screw_hole_info.keys()) == 0:
-            self.generate_screw_holes_coordinates()
+        screw_hole_table = self.screw_hole_table
 
-        screw_hole_collection = union()
-        screw_hole_body_collection = union()
-        screw_hole_body_scaled_collection = union()
-        # corner_count = 4
-        # remaining_screws = 0
+        if screw_hole_table.get_count() == 0:
+            self.generate_screw_holes_coordinates()
 
-        for coord_string in self.screw_hole_info.keys():
-            coord = self.screw_hole_info[coord_string]["coordinates"]
-            x = coord[0]
-            y = coord[1]
+        for row in range(screw_hole_table.get_count()):
+            x = screw_hole_table.x_list[row]
+            y = screw_hole_table.y_list[row]
 
-            custom_support_direction = self.screw_hole_info[coord_string][
-                "custom_support_direction"
+            custom_support_direction = screw_hole_table.custom_support_direction_list[
+                row
             ]
 
             self.logger.debug(
                 "coord: %s, self.x_screw_width: %f, self.y_screw_width: %f",
-                str(coord),
+                str([x, y]),
                 self.x_screw_width,
                 self.y_screw_width,
             )
@@ -607,11 +634,9 @@ class Body:
                 and x == self.x_screw_width / 2
             ):
                 # self.logger.debug('coord: %s', str(coord))
+                screw_hole_table.skip_list[row] = True
                 continue
 
-            hole = right(x)(forward(y)(self.screw_hole(tap=tap)))
-            screw_hole_collection += hole
-
             right_support = True
             left_support = True
             forward_support = True
@@ -661,23 +686,152 @@ class Body:
             #     right_support = True
             #     left_support = True
 
-            hole_body = self.screw_hole_body(
-                right_support=right_support,
-                left_support=left_support,
-                forward_support=forward_support,
-                back_support=back_support,
-                screw_name=coord_string,
+            # Store the distance each support extends from the center of the screw hole
+            for direction, has_support in (
+                ("right", right_support),
+                ("left", left_support),
+                ("forward", forward_support),
+                ("back", back_support),
+            ):
+                if has_support:
+                    screw_hole_table.set_support(
+                        row, direction, self.screw_hole_body_support_end_x
+                    )
+
+    def get_screw_hole_module_name(self, tap=False):
+        if tap:
+            return "screw_hole_tap"
+
+        return "screw_hole"
+
+    def get_screw_hole_body_module_name(self, support_key, scaled=False):
+        name = "screw_hole_body"
+        if scaled:
+            name += "_scaled"
+
+        for direction in support_key:
+            name += "_" + direction
+
+        return name
+
+    def get_screw_hole_module_definitions(self):
+        """
+        Get the OpenSCAD module definitions for the tapped and untapped screw holes and for one screw hole
+        body per combination of support directions in use. Every screw hole is placed with a call to one
+        of these modules so the body geometry is only written once per file
+        """
+        if self.screw_hole_module_definitions is not None:
+            return self.screw_hole_module_definitions
+
+        screw_hole_table = self.screw_hole_table
+
+        module_dict = {}
+        for tap in (False, True):
+            module_dict[self.get_screw_hole_module_name(tap)] = self.screw_hole(tap=tap)
+
+        for row in range(screw_hole_table.get_count()):
+            if screw_hole_table.skip_list[row]:
+                continue
+
+            support_key = screw_hole_table.get_support_key(row)
+            body_module_name = self.get_screw_hole_body_module_name(support_key)
+            if body_module_name in module_dict.keys():
+                continue
+
+            module_dict[body_module_name] = self.screw_hole_body(
+                right_support="right" in support_key,
+                left_support="left" in support_key,
+                forward_support="forward" in support_key,
+                back_support="back" in support_key,
+                screw_name=body_module_name,
+            )
+            module_dict[
+                self.get_screw_hole_body_module_name(support_key, scaled=True)
+            ] = scale([1.1, 1.1, 1.0])(ModuleCall(body_module_name, ""))
+
+        self.logger.debug(
+            "Screw hole modules for %d screw holes: %s",
+            screw_hole_table.get_count(),
+            str(sorted(module_dict.keys())),
+        )
+
+        # Sort the modules so identical bodies always produce identical SCAD files
+        self.screw_hole_module_definitions = "".join(
+            [
+                get_module_definition(name, module_dict[name])
+                for name in sorted(module_dict.keys())
+            ]
+        )
+
+        return self.screw_hole_module_definitions
+
+    def screw_hole_objects(self, tap=False):
+
+        self.set_screw_hole_support_directions()
+
+        screw_hole_collection = union()
+        screw_hole_body_collection = union()
+        screw_hole_body_scaled_collection = union()
+        # corner_count = 4
+        # remaining_screws = 0
+
+        x_offset = (-self.left_margin) + self.screw_edge_x_inset
+
+        screw_hole_table = self.screw_hole_table
+        module_definitions = self.get_screw_hole_module_definitions()
+
+        for row in range(screw_hole_table.get_count()):
+            if screw_hole_table.skip_list[row]:
+                continue
+
+            x = screw_hole_table.x_list[row]
+            y = screw_hole_table.y_list[row]
+
+            # Skip screw holes where the screw hole body is completely outside of the clip range
+            body_extent = max(self.screw_hole_body_radius, self.screw_diameter / 2)
+            if not self.in_clip_x_range(
+                x
+                + x_offset
+                - max(body_extent, screw_hole_table.get_support(row, "left")) * 1.1,
+                x
+                + x_offset
+                + max(body_extent, screw_hole_table.get_support(row, "right")) * 1.1,
+            ):
+                continue
+
+            support_key = screw_hole_table.get_support_key(row)
+
+            hole = right(x)(
+                forward(y)(
+                    ModuleCall(self.get_screw_hole_module_name(tap), module_definitions)
+                )
             )
-            scaled_hole_body = scale([1.1, 1.1, 1.0])(hole_body)
+            screw_hole_collection += hole
 
-            hole_body = right(x)(forward(y)(hole_body))
+            hole_body = right(x)(
+                forward(y)(
+                    ModuleCall(
+                        self.get_screw_hole_body_module_name(support_key),
+                        module_definitions,
+                    )
+                )
+            )
 
-            scaled_hole_body = right(x)(forward(y)(scaled_hole_body))
+            scaled_hole_body = right(x)(
+                forward(y)(
+                    ModuleCall(
+                        self.get_screw_hole_body_module_name(support_key, scaled=True),
+                        module_definitions,
+                    )
+                )
+            )
 
             screw_hole_body_collection += hole_body
             screw_hole_body_scaled_collection += scaled_hole_body
 
-        x_offset = (-self.left_margin) + self.screw_edge_x_inset
+        # No screw hole reaches into the clip range so there is nothing to add or remove
+        if len(screw_hole_collection.children) == 0:
+            return (None, None, None)
 
         # x_offset = (-self.left_margin)
         y_offset = (self.real_max_y + self.bottom_margin) - self.screw_edge_y_inset
@@ -1,5 +1,6 @@
 import logging
 
+from module_call import ModuleCall, get_module_definition
 from parameters import Parameters
 from solid import union, cube, cylinder, polygon, linear_extrude, rotate, scale, mirror
 
@@ -8,6 +9,10 @@ from solid.utils import right, back, forward, down, up
 
 class Cable:
 
+    # Cable parameter key -> module definitions for the cable holder parts. The holder parts only depend
+    # on the cable parameters so every layout with the same cable parameters shares them
+    module_definitions_cache = {}
+
     def __init__(self, parameters: Parameters = None):
 
         self.logger = logging.getLogger().getChild(__name__)
@@ -123,7 +128,7 @@ class Cable:
         )
 
         # Remvoe the
-        holder -= self.holder_hole(include_slot=True)
+        holder -= ModuleCall("cable_holder_hole", "")
 
         return holder
 
@@ -189,20 +194,54 @@ class Cable:
 
         return solid
 
-    def holder_main(self):
+    def get_cache_key(self):
+        return (
+            self.parameters.cable_diameter,
+            self.parameters.cable_hole_width,
+            self.parameters.cable_hole_height,
+            self.parameters.case_wall_thickness,
+        )
+
+    def get_module_definitions(self):
+        """
+        Get the OpenSCAD module definitions for the cable holder parts. The hole, clamp and main holder
+        are each built once per cable parameter set and the parts call the modules instead of rebuilding
+        the geometry
+        """
+        cache_key = self.get_cache_key()
+        if cache_key in Cable.module_definitions_cache.keys():
+            return Cable.module_definitions_cache[cache_key]
+
+        module_dict = {}
+        module_dict["cable_holder_hole"] = self.holder_hole(include_slot=True)
+        module_dict["cable_holder_clamp"] = self.clamp_block()
+        module_dict["cable_clamp_remove_block"] = self.clamp_block(
+            clamp_remove_block=True
+        )
 
-        # Get full holder
-        holder_main_body = self.holder_full()
+        # Remove the clamp remove block from the full holder to make space for the clamp
+        module_dict["cable_holder_main"] = self.holder_full() - ModuleCall(
+            "cable_clamp_remove_block", ""
+        )
 
-        # Create block that will be removed from the main holde rto make space for the clamp
-        clamp_remove_block = self.holder_clamp(clamp_remove_block=True)
+        # Sort the modules so identical cable parameters always produce identical SCAD files
+        module_definitions = "".join(
+            [
+                get_module_definition(name, module_dict[name])
+                for name in sorted(module_dict.keys())
+            ]
+        )
+        Cable.module_definitions_cache[cache_key] = module_definitions
 
-        # Remove clamp remove block from main holder
-        holder_main_body -= clamp_remove_block
+        return module_definitions
+
+    def holder_main(self):
+        return ModuleCall("cable_holder_main", self.get_module_definitions())
 
-        return holder_main_body
+    def holder_clamp(self):
+        return ModuleCall("cable_holder_clamp", self.get_module_definitions())
 
-    def holder_clamp(self, clamp_remove_block=False):
+    def clamp_block(self, clamp_remove_block=False):
         # Declare parameters used to provide spacing for the clamp in the main cable holder
         clamp_holder_gap = self.clamp_holder_gap
         clamp_holder_extra = 0.0
@@ -284,7 +323,7 @@ class Cable:
 
         # Remove a 180 degree rotated version of the cable hole with a slot from the clamp block
         clamp_block -= back(self.clamp_hole_offset)(
-            rotate(180, [0, 0, 1])(self.holder_hole(include_slot=True))
+            rotate(180, [0, 0, 1])(ModuleCall("cable_holder_hole", ""))
         )
 
         return clamp_block
@@ -111,6 +111,16 @@ class Cell:
     def get_moved(self):
         return right(self.x_start_mm)(forward(self.y_start_mm)(self.solid))
 
+    def get_x_bounds_mm(self):
+        return (self.x_start_mm, self.x_end_mm)
+
+    def get_rotated_x_bounds_mm(self, rx=0.0):
+        # x bounds of the rotated corners once the cell is moved to its rotation point at rx
+        return (
+            self.parameters.U(rx + self.get_start_x()),
+            self.parameters.U(rx + self.get_end_x()),
+        )
+
     def get_start_x(self) -> float:
         if self.rotaton == 0.0:
             return self.x
@@ -1,7 +1,14 @@
+import hashlib
 import json
 import logging
+import math
+import mmap
 from pathlib import Path
 import re
+import struct
+
+# First line of every SCAD file written by SolidPython. It holds the time the file was generated
+SCAD_HEADER_PREFIX = "// Generated by SolidPython"
 
 
 def make_output_folder(output_folder: str, layout_name: str):
@@ -58,11 +65,194 @@ def config_logger(console_logging_level, file_logging_level):
 
 
 def load_keyboard_layout(input_file_path: Path):
+    return parse_keyboard_layout(input_file_path.read_text())
+
+
+def parse_keyboard_layout(keyboard_layout: str):
     # Pattern and Replacement strings to be used when trying to turn keyboard-layout-editor raw output into valid JSON
     json_key_pattern = "([{,])([xywha1]+):"
     json_key_replace = '\\1"\\2":'
 
-    keyboard_layout = input_file_path.read_text()
     # If json comes from Keyboard Layout Editor, it needs to be modified to be valid JSON
     keyboard_layout = re.sub(json_key_pattern, json_key_replace, keyboard_layout)
     return json.loads(keyboard_layout)
+
+
+def iter_stl_triangles(stl_file_path: Path):
+    """
+    Yield the three vertices of every facet in an ASCII or binary STL file. The file is memory mapped and
+    read one facet at a time so large files are never loaded into memory at once
+    """
+    stl_file_path = Path(stl_file_path)
+    if stl_file_path.stat().st_size == 0:
+        return
+
+    with open(stl_file_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as stl_map:
+            # A binary file is exactly the header, the facet count and 50 bytes per facet
+            triangle_count = -1
+            if len(stl_map) >= 84:
+                triangle_count = struct.unpack_from("<I", stl_map, 80)[0]
+
+            if len(stl_map) == 84 + (triangle_count * 50):
+                for triangle_number in range(triangle_count):
+                    values = struct.unpack_from(
+                        "<9f", stl_map, 84 + (triangle_number * 50) + 12
+                    )
+                    yield (values[0:3], values[3:6], values[6:9])
+                return
+
+            vertex_list = []
+            for line in iter(stl_map.readline, b""):
+                line = line.strip()
+                if line.startswith(b"vertex"):
+                    vertex_list.append(
+                        tuple([float(value) for value in line.split()[1:4]])
+                    )
+                    if len(vertex_list) == 3:
+                        yield tuple(vertex_list)
+                        vertex_list = []
+
+
+def is_binary_stl(stl_file_path: Path):
+    stl_file_path = Path(stl_file_path)
+    file_size = stl_file_path.stat().st_size
+    if file_size < 84:
+        return False
+
+    with open(stl_file_path, "rb") as f:
+        f.seek(80)
+        triangle_count = struct.unpack("<I", f.read(4))[0]
+
+    return file_size == 84 + (triangle_count * 50)
+
+
+def get_triangle_normal(triangle):
+    ((x1, y1, z1), (x2, y2, z2), (x3, y3, z3)) = triangle
+    (ux, uy, uz) = (x2 - x1, y2 - y1, z2 - z1)
+    (vx, vy, vz) = (x3 - x1, y3 - y1, z3 - z1)
+    nx = (uy * vz) - (uz * vy)
+    ny = (uz * vx) - (ux * vz)
+    nz = (ux * vy) - (uy * vx)
+
+    length = math.sqrt((nx * nx) + (ny * ny) + (nz * nz))
+    if length == 0:
+        return (0.0, 0.0, 0.0)
+
+    return (nx / length, ny / length, nz / length)
+
+
+def write_binary_stl(
+    stl_file_path: Path, triangle_iter, header=b"keyboard_gen binary STL"
+):
+    """
+    Write facets from triangle_iter to a binary STL file as they arrive. The facet count is filled in once
+    every facet is written
+
+    Returns
+    -------
+    int
+        The number of facets written
+    """
+    triangle_struct = struct.Struct("<12fH")
+
+    triangle_count = 0
+    with open(stl_file_path, "wb") as f:
+        f.write(header[:80].ljust(80, b" "))
+        f.write(struct.pack("<I", 0))
+
+        for triangle in triangle_iter:
+            f.write(
+                triangle_struct.pack(
+                    *get_triangle_normal(triangle),
+                    *triangle[0],
+                    *triangle[1],
+                    *triangle[2],
+                    0,
+                )
+            )
+            triangle_count += 1
+
+        f.seek(80)
+        f.write(struct.pack("<I", triangle_count))
+
+    return triangle_count
+
+
+def write_ascii_stl(stl_file_path: Path, triangle_iter, name="keyboard_gen"):
+    triangle_count = 0
+    with open(stl_file_path, "w") as f:
+        f.write("solid %s\n" % (name))
+
+        for triangle in triangle_iter:
+            f.write("facet normal %g %g %g\n" % get_triangle_normal(triangle))
+            f.write("outer loop\n")
+            for vertex in triangle:
+                f.write("vertex %r %r %r\n" % vertex)
+            f.write("endloop\n")
+            f.write("endfacet\n")
+            triangle_count += 1
+
+        f.write("endsolid %s\n" % (name))
+
+    return triangle_count
+
+
+def write_mirrored_stl(source_stl_file_path: Path, stl_file_path: Path, mirror_x=0.0):
+    """
+    Write the mirror image of an STL file across the plane x = mirror_x. The vertex order of every facet
+    is reversed so the facets still face out of the mirrored mesh. Binary files are written as binary STL
+    and ASCII files as ASCII STL
+
+    Returns
+    -------
+    int
+        The number of facets written
+    """
+    mirror_x_2 = mirror_x * 2
+
+    triangle_iter = (
+        tuple([(mirror_x_2 - x, y, z) for x, y, z in reversed(triangle)])
+        for triangle in iter_stl_triangles(source_stl_file_path)
+    )
+
+    if is_binary_stl(source_stl_file_path):
+        return write_binary_stl(stl_file_path, triangle_iter)
+
+    return write_ascii_stl(stl_file_path, triangle_iter, name=Path(stl_file_path).stem)
+
+
+def get_stl_volume(stl_file_path: Path):
+    # Sum the signed volume of the tetrahedron from the origin to every facet. Works for ASCII and binary STL
+    volume = 0.0
+    for (x1, y1, z1), (x2, y2, z2), (x3, y3, z3) in iter_stl_triangles(stl_file_path):
+        volume += (
+            x1 * (y2 * z3 - z2 * y3)
+            - y1 * (x2 * z3 - z2 * x3)
+            + z1 * (x2 * y3 - y2 * x3)
+        )
+
+    return abs(volume) / 6.0
+
+
+def get_scad_hash(scad_file_name: Path):
+    """
+    Get a hash of the geometry in a SCAD file. The SolidPython header line is ignored since it contains
+    the time the file was generated, and included and used files are hashed by their content
+    """
+    scad_lines = []
+    for line in Path(scad_file_name).read_text().splitlines():
+        if line.startswith(SCAD_HEADER_PREFIX):
+            continue
+
+        # Included and used files are part of the geometry so hash their content instead of their name
+        for statement in ["include", "use"]:
+            if line.startswith(statement + " <") and line.endswith(">"):
+                include_file_name = (
+                    Path(scad_file_name).parent / line[len(statement) + 2 : -1]
+                )
+                line = statement + " " + get_scad_hash(include_file_name)
+
+        scad_lines.append(line)
+
+    return hashlib.sha256("\n".join(scad_lines).encode("utf-8")).hexdigest()
@@ -0,0 +1,709 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import base64
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import math
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+import time
+
+from file_io import (
+    config_logger,
+    get_scad_hash,
+    make_output_folder,
+    parse_keyboard_layout,
+)
+from parameters import Parameters
+from keyboard import Keyboard
+from geometry_metrics import GeometryMetrics
+from layout_checker import LayoutChecker
+from keyboard_stl_generator import (
+    PREVIEW_FRAGMENTS,
+    build_solid_object_dict,
+    write_scad_files,
+)
+from render_pool import RenderPool
+from stl_post_process import StlPostProcessor
+
+# Set logger level variables
+console_logging_level = logging.WARN
+file_logging_level = logging.DEBUG
+
+
+class GeneratorService:
+    """
+    Long running generator that accepts layout and parameter requests over HTTP on localhost or a unix
+    socket. Parsed layouts, generated SCAD files and rendered STL files are cached between requests
+
+    ...
+
+    Attributes
+    ----------
+    output_folder : Path
+        Folder that generated files and the render cache are written to
+
+    render_concurrency : int, default 2
+        The maximum number of OpenSCAD processes that can run at once
+
+    cache_size : int, default 32
+        The number of layouts and builds to keep in the in memory caches
+
+    metrics_history : int, default 100
+        The number of recent requests to keep metrics for
+
+    event_stream : file, default None
+        Open text stream that render progress events are written to as JSON lines
+
+    Methods
+    -------
+    generate(request)
+        Generate SCAD files for a request. Runs in the generation worker thread
+    render(scad_file_name, stl_file_name, request_metrics)
+        Render a SCAD file to STL using the render cache and the bounded render queue
+    handle_request(request)
+        Generate and optionally render a request and return the response dict
+    estimate(request)
+        Get the geometry estimate for a request without generating any files
+    check(request)
+        Get the layout violations for a request without generating any files
+    get_metrics()
+        Get a summary of the request latencies and cache statistics
+    """
+
+    def __init__(
+        self,
+        output_folder="output",
+        render_concurrency=2,
+        cache_size=32,
+        metrics_history=100,
+        event_stream=None,
+    ):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.output_folder = Path(output_folder)
+        self.render_cache_path = self.output_folder / "render_cache"
+        self.render_cache_path.mkdir(parents=True, exist_ok=True)
+
+        self.render_concurrency = render_concurrency
+        self.cache_size = cache_size
+
+        # Layout text hash -> parsed layout
+        self.layout_cache = OrderedDict()
+        # (layout hash, parameter hash) -> processed keyboard. Shared by preview and full detail builds
+        self.keyboard_cache = OrderedDict()
+        # Build key -> list of (scad_file_name, stl_file_name) tuples
+        self.build_cache = OrderedDict()
+        # SCAD content hash -> future for a render that is currently running
+        self.render_future_dict = {}
+
+        # SCAD generation is run in a single worker so the event loop stays responsive
+        self.generate_executor = ThreadPoolExecutor(max_workers=1)
+        self.render_pool = RenderPool(
+            concurrency=render_concurrency, event_stream=event_stream
+        )
+
+        self.request_count = 0
+        self.error_count = 0
+        self.cache_stats = {
+            "layout_hits": 0,
+            "layout_misses": 0,
+            "keyboard_hits": 0,
+            "keyboard_misses": 0,
+            "build_hits": 0,
+            "build_misses": 0,
+            "render_hits": 0,
+            "render_misses": 0,
+        }
+        self.request_metrics = deque(maxlen=metrics_history)
+        # Item collection queries made while building, added up over every request
+        self.collection_call_stats = {
+            "get_collection_bounds": 0,
+            "get_moved_union": 0,
+        }
+
+    @staticmethod
+    def get_hash(value):
+        if not isinstance(value, str):
+            value = json.dumps(value, sort_keys=True)
+
+        return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+    def cache_get(self, cache, key, stat_name):
+        if key in cache:
+            cache.move_to_end(key)
+            self.cache_stats[stat_name + "_hits"] += 1
+            return cache[key]
+
+        self.cache_stats[stat_name + "_misses"] += 1
+        return None
+
+    def cache_put(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def get_layout(self, layout):
+        # Layouts can be sent as raw keyboard-layout-editor text or as already parsed JSON
+        layout_hash = self.get_hash(layout)
+
+        keyboard_layout_dict = self.cache_get(self.layout_cache, layout_hash, "layout")
+        if keyboard_layout_dict is None:
+            if isinstance(layout, str):
+                keyboard_layout_dict = parse_keyboard_layout(layout)
+            else:
+                keyboard_layout_dict = layout
+
+            self.cache_put(self.layout_cache, layout_hash, keyboard_layout_dict)
+
+        return layout_hash, keyboard_layout_dict
+
+    def get_cached_keyboard(self, layout_hash, keyboard_layout_dict, parameter_dict):
+        # Parameters are validated and normalized before the cache lookup so requests that spell the same
+        # parameters differently share a processed layout
+        parameters = Parameters(parameter_dict)
+
+        # The processed layout and sections are reused between preview and full detail builds, estimates
+        # and checks so only the detail dependent geometry is built again
+        keyboard_key = (layout_hash, parameters.get_snapshot().content_hash)
+        keyboard = self.cache_get(self.keyboard_cache, keyboard_key, "keyboard")
+        if keyboard is None:
+            keyboard = Keyboard(parameters)
+            keyboard.process_keyboard_layout(keyboard_layout_dict)
+            keyboard.process_custom_shapes()
+
+            self.cache_put(self.keyboard_cache, keyboard_key, keyboard)
+
+        return keyboard
+
+    def generate(self, request):
+        start_time = time.perf_counter()
+
+        # Only use the final path component of the name so files stay in the output folder
+        name = Path(str(request.get("name", "layout"))).name or "layout"
+        parameter_dict = request.get("parameters") or {}
+
+        layout_hash, keyboard_layout_dict = self.get_layout(request["layout"])
+
+        options = {
+            "all_sections": bool(request.get("all_sections", False)),
+            "exploded": bool(request.get("exploded", False)),
+            "section": int(request.get("section", -1)),
+            "fragments": int(request.get("fragments", 8)),
+            "switch_type_in_filename": bool(
+                request.get("switch_type_in_filename", False)
+            ),
+            "preview": bool(request.get("preview", False)),
+        }
+        if options["preview"]:
+            options["fragments"] = PREVIEW_FRAGMENTS
+
+        keyboard = self.get_cached_keyboard(
+            layout_hash, keyboard_layout_dict, parameter_dict
+        )
+
+        # Builds are keyed by the layout geometry and parameters instead of the layout text, so requests
+        # that only change key legends or layout metadata share a build
+        build_hash = self.get_hash(
+            {
+                "name": name,
+                "layout": keyboard.get_layout_key(),
+                "options": options,
+            }
+        )
+
+        # Reuse SCAD files from an earlier identical request if they still exist
+        file_name_list = self.cache_get(self.build_cache, build_hash, "build")
+        if file_name_list is not None and all(
+            [scad_file_name.exists() for scad_file_name, _ in file_name_list]
+        ):
+            return file_name_list, True, time.perf_counter() - start_time, {}
+
+        # Use the parameters the keyboard was processed with since they hold the calculated dimensions
+        parameters = keyboard.parameters
+
+        keyboard.set_preview(options["preview"])
+        keyboard.set_section(-1)
+
+        # The keyboard can be shared with earlier requests so only the queries of this build are counted
+        previous_collection_call_dict = keyboard.get_collection_call_counts()
+
+        # Each build is written to its own folder so different parameters for the same name do not
+        # overwrite each other
+        scad_folder_path, stl_folder_path = make_output_folder(
+            self.output_folder / name, build_hash[:16]
+        )
+
+        solid_object_dict = build_solid_object_dict(
+            keyboard,
+            parameters,
+            all_sections=options["all_sections"],
+            exploded=options["exploded"],
+            section=options["section"],
+        )
+
+        file_name_list = write_scad_files(
+            solid_object_dict,
+            parameters,
+            name,
+            scad_folder_path,
+            stl_folder_path,
+            fragments=options["fragments"],
+            switch_type_in_filename=options["switch_type_in_filename"],
+            preview=options["preview"],
+        )
+
+        self.cache_put(self.build_cache, build_hash, file_name_list)
+
+        collection_call_dict = {
+            name: count - previous_collection_call_dict[name]
+            for name, count in keyboard.get_collection_call_counts().items()
+        }
+        for name, count in collection_call_dict.items():
+            self.collection_call_stats[name] += count
+
+        return (
+            file_name_list,
+            False,
+            time.perf_counter() - start_time,
+            collection_call_dict,
+        )
+
+    async def run_openscad(self, scad_file_name, cached_stl_file_name):
+        # Render to a temporary file so a failed render never leaves a partial file in the cache. Every
+        # render gets its own file so services sharing the output folder never write the same file
+        with tempfile.NamedTemporaryFile(
+            dir=self.render_cache_path, suffix=".tmp.stl", delete=False
+        ) as temp_stl_file:
+            temp_stl_file_name = Path(temp_stl_file.name)
+        try:
+            await self.render_pool.render(scad_file_name, temp_stl_file_name)
+            temp_stl_file_name.replace(cached_stl_file_name)
+        finally:
+            if temp_stl_file_name.exists():
+                temp_stl_file_name.unlink()
+
+    async def render(
+        self, scad_file_name, stl_file_name, request_metrics, post_processor=None
+    ):
+        scad_hash = get_scad_hash(scad_file_name)
+        cached_stl_file_name = self.render_cache_path / (scad_hash + ".stl")
+
+        if cached_stl_file_name.exists():
+            self.cache_stats["render_hits"] += 1
+            request_metrics["render_cache_hits"] += 1
+        else:
+            self.cache_stats["render_misses"] += 1
+
+            # Share a render that is already running for the same SCAD content
+            if scad_hash not in self.render_future_dict:
+                self.render_future_dict[scad_hash] = asyncio.ensure_future(
+                    self.run_openscad(scad_file_name, cached_stl_file_name)
+                )
+
+            try:
+                await self.render_future_dict[scad_hash]
+            finally:
+                self.render_future_dict.pop(scad_hash, None)
+
+            request_metrics["render_count"] += 1
+
+        shutil.copyfile(cached_stl_file_name, stl_file_name)
+
+        # Post-process the copy so the cached STL stays the same for requests with other options
+        if post_processor is not None:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, post_processor.process, stl_file_name
+            )
+
+        return None
+
+    @staticmethod
+    def get_post_processor(request):
+        merge_tolerance = request.get("merge_vertices")
+        if merge_tolerance is not None:
+            merge_tolerance = float(merge_tolerance)
+
+        binary = bool(request.get("binary_stl", False))
+        info = bool(request.get("stl_info", False))
+        vertex_count = bool(request.get("stl_vertex_count", False))
+        compress = request.get("compress")
+        if request.get("gzip", False):
+            compress = "gzip"
+
+        if not binary and merge_tolerance is None and not info and compress is None:
+            return None
+
+        return StlPostProcessor(
+            binary=binary,
+            merge_tolerance=merge_tolerance,
+            info=info,
+            compress=compress,
+            vertex_count=vertex_count,
+        )
+
+    async def handle_request(self, request):
+        start_time = time.perf_counter()
+
+        self.request_count += 1
+        request_metrics = {
+            "request_id": self.request_count,
+            "name": request.get("name", "layout"),
+            "build_cache_hit": False,
+            "generate_seconds": 0.0,
+            "render_seconds": 0.0,
+            "render_count": 0,
+            "render_cache_hits": 0,
+            "collection_calls": {},
+            "total_seconds": 0.0,
+            "error": None,
+        }
+
+        try:
+            loop = asyncio.get_running_loop()
+            (
+                file_name_list,
+                request_metrics["build_cache_hit"],
+                request_metrics["generate_seconds"],
+                request_metrics["collection_calls"],
+            ) = await loop.run_in_executor(
+                self.generate_executor, self.generate_checked, request
+            )
+
+            render = bool(request.get("render", False))
+            post_process_result_list = [None] * len(file_name_list)
+            if render:
+                render_start_time = time.perf_counter()
+                post_processor = self.get_post_processor(request)
+                post_process_result_list = await asyncio.gather(
+                    *[
+                        self.render(
+                            scad_file_name,
+                            stl_file_name,
+                            request_metrics,
+                            post_processor=post_processor,
+                        )
+                        for scad_file_name, stl_file_name in file_name_list
+                    ]
+                )
+                request_metrics["render_seconds"] = (
+                    time.perf_counter() - render_start_time
+                )
+
+            file_list = []
+            for (scad_file_name, stl_file_name), post_process_result in zip(
+                file_name_list, post_process_result_list
+            ):
+                file_info = {
+                    "scad": str(scad_file_name),
+                    "stl": str(stl_file_name) if render else None,
+                }
+                if post_process_result is not None:
+                    file_info["stl_info"] = post_process_result
+                if request.get("return_bytes", False):
+                    file_info["scad_data"] = Path(scad_file_name).read_text()
+                    if render:
+                        file_info["stl_data"] = base64.b64encode(
+                            Path(stl_file_name).read_bytes()
+                        ).decode("ascii")
+                file_list.append(file_info)
+
+            response = {"files": file_list}
+            status = 200
+        except Exception as e:
+            self.error_count += 1
+            self.logger.exception("Request %d failed", request_metrics["request_id"])
+            request_metrics["error"] = str(e)
+            response = {"error": str(e)}
+            status = 500
+
+        request_metrics["total_seconds"] = time.perf_counter() - start_time
+        self.request_metrics.append(request_metrics)
+
+        response["metrics"] = request_metrics
+
+        return status, response
+
+    def generate_checked(self, request):
+        # Parameter validation exits the program on bad input which must not stop the service
+        try:
+            return self.generate(request)
+        except SystemExit:
+            raise ValueError("Invalid layout or parameters")
+
+    def get_keyboard(self, request):
+        # Estimates and checks only need the processed layout, which is shared with the builds
+        layout_hash, keyboard_layout_dict = self.get_layout(request["layout"])
+
+        try:
+            return self.get_cached_keyboard(
+                layout_hash, keyboard_layout_dict, request.get("parameters") or {}
+            )
+        except SystemExit:
+            raise ValueError("Invalid layout or parameters")
+
+    def estimate(self, request):
+        start_time = time.perf_counter()
+
+        geometry_metrics = GeometryMetrics(
+            self.get_keyboard(request),
+            filament_density=float(request.get("filament_density", 1.24)),
+            filament_diameter=float(request.get("filament_diameter", 1.75)),
+        )
+
+        response = geometry_metrics.get_metrics()
+        response["estimate_seconds"] = time.perf_counter() - start_time
+
+        return response
+
+    def check(self, request):
+        start_time = time.perf_counter()
+
+        violation_list = LayoutChecker(self.get_keyboard(request)).get_violation_list()
+
+        return {
+            "valid": len(violation_list) == 0,
+            "violations": violation_list,
+            "check_seconds": time.perf_counter() - start_time,
+        }
+
+    @staticmethod
+    def get_percentile(sorted_values, percentile):
+        if len(sorted_values) == 0:
+            return 0.0
+
+        index = math.ceil((percentile / 100) * len(sorted_values)) - 1
+        return sorted_values[max(index, 0)]
+
+    def get_metrics(self):
+        latency_list = sorted(
+            [
+                request_metrics["total_seconds"]
+                for request_metrics in self.request_metrics
+            ]
+        )
+
+        latency = {
+            "count": len(latency_list),
+            "mean": sum(latency_list) / len(latency_list) if latency_list else 0.0,
+            "p50": self.get_percentile(latency_list, 50),
+            "p95": self.get_percentile(latency_list, 95),
+            "max": latency_list[-1] if latency_list else 0.0,
+        }
+
+        return {
+            "request_count": self.request_count,
+            "error_count": self.error_count,
+            "latency_seconds": latency,
+            "cache": dict(
+                self.cache_stats,
+                layout_size=len(self.layout_cache),
+                keyboard_size=len(self.keyboard_cache),
+                build_size=len(self.build_cache),
+            ),
+            "collection_calls": dict(self.collection_call_stats),
+            "render_queue": {
+                "concurrency": self.render_concurrency,
+                "active": self.render_pool.active_count,
+                "waiting": self.render_pool.waiting_count,
+            },
+            "recent_requests": list(self.request_metrics),
+        }
+
+    async def dispatch(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        elif method == "GET" and path == "/metrics":
+            return 200, self.get_metrics()
+        elif method == "POST" and path in ["/generate", "/estimate", "/check"]:
+            try:
+                request = json.loads(body)
+            except ValueError as e:
+                return 400, {"error": "Request body is not valid JSON: %s" % (str(e))}
+
+            if not isinstance(request, dict) or "layout" not in request:
+                return 400, {"error": 'Request must be a JSON object with a "layout"'}
+
+            # Estimates and checks process the layout, which can take a while for large layouts, so they
+            # run in the generation worker like builds. That keeps the event loop free and the worker is the
+            # only thread that touches the keyboard cache
+            if path in ["/estimate", "/check"] or request.get("check", False):
+                loop = asyncio.get_running_loop()
+                try:
+                    if path == "/estimate":
+                        return 200, await loop.run_in_executor(
+                            self.generate_executor, self.estimate, request
+                        )
+
+                    check_response = await loop.run_in_executor(
+                        self.generate_executor, self.check, request
+                    )
+                except Exception as e:
+                    self.logger.exception("Request to %s failed", path)
+                    return 500, {"error": str(e)}
+
+                if path == "/check":
+                    return 200, check_response
+
+                # Reject generate requests that fail the check before they use any render capacity
+                if not check_response["valid"]:
+                    return 422, dict(check_response, error="Layout check failed")
+
+            return await self.handle_request(request)
+
+        return 404, {"error": "Unknown endpoint %s %s" % (method, path)}
+
+    async def handle_connection(self, reader, writer):
+        status_text_dict = {
+            200: "OK",
+            400: "Bad Request",
+            404: "Not Found",
+            422: "Unprocessable Entity",
+            500: "Internal Server Error",
+        }
+
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            method, path = request_line.split(" ")[0:2]
+
+            # Read headers until the blank line
+            header_dict = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if line == "":
+                    break
+                header_name, header_value = line.split(":", 1)
+                header_dict[header_name.strip().lower()] = header_value.strip()
+
+            body = b""
+            if "content-length" in header_dict:
+                body = await reader.readexactly(int(header_dict["content-length"]))
+
+            status, response = await self.dispatch(method, path, body)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, response = 400, {"error": "Malformed request: %s" % (str(e))}
+
+        payload = json.dumps(response, default=str).encode("utf-8")
+
+        writer.write(
+            (
+                "HTTP/1.1 %d %s\r\n"
+                "Content-Type: application/json\r\n"
+                "Content-Length: %d\r\n"
+                "Connection: close\r\n\r\n"
+                % (status, status_text_dict.get(status, ""), len(payload))
+            ).encode("latin-1")
+            + payload
+        )
+
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, unix_socket=None):
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(
+                self.handle_connection, path=unix_socket
+            )
+            self.logger.info("Serving on unix socket %s", unix_socket)
+            print("Serving on unix socket", unix_socket)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            self.logger.info("Serving on http://%s:%d", host, port)
+            print("Serving on http://%s:%d" % (host, port))
+
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+
+    config_logger(console_logging_level, file_logging_level)
+
+    parser = argparse.ArgumentParser(
+        description="Run the keyboard SCAD generator as a long running local service"
+    )
+    parser.add_argument(
+        "--host",
+        help="The address to listen on. Only use a local address",
+        default="127.0.0.1",
+    )
+    parser.add_argument(
+        "--port",
+        help="The port to listen on",
+        type=int,
+        default=8765,
+    )
+    parser.add_argument(
+        "--unix-socket",
+        metavar="socket_path",
+        help="Listen on a unix socket instead of a TCP port",
+        default=None,
+    )
+    parser.add_argument(
+        "-o",
+        "--output-folder",
+        default="output",
+        help="A path to a folder to store the generated files and render cache",
+    )
+    parser.add_argument(
+        "--render-concurrency",
+        metavar="num_renders",
+        help="The maximum number of OpenSCAD renders to run at once",
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "--cache-size",
+        metavar="num_entries",
+        help="The number of layouts and builds to keep in memory",
+        type=int,
+        default=32,
+    )
+
+    parser.add_argument(
+        "--progress-file",
+        metavar="progress.jsonl",
+        help="Write render progress events as JSON lines to this file. Use - for stdout",
+        default=None,
+    )
+
+    args = parser.parse_args()
+
+    event_stream = None
+    if args.progress_file == "-":
+        event_stream = sys.stdout
+    elif args.progress_file is not None:
+        event_stream = open(args.progress_file, "a")
+
+    service = GeneratorService(
+        output_folder=args.output_folder,
+        render_concurrency=args.render_concurrency,
+        cache_size=args.cache_size,
+        event_stream=event_stream,
+    )
+
+    try:
+        asyncio.run(
+            service.serve(host=args.host, port=args.port, unix_socket=args.unix_socket)
+        )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if event_stream is not None and event_stream is not sys.stdout:
+            event_stream.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,494 @@
+import logging
+import math
+
+from body import Body
+from keyboard import Keyboard
+
+
+class GeometryMetrics:
+    """
+    Estimates the footprint, volume and filament use of every part and section of a processed keyboard from
+    the case parameters and the cutout polygons. Nothing is built or rendered so an estimate takes
+    milliseconds
+
+    The plate, case walls, bottom cover and screw hole bodies are measured directly. Switch and stabilizer
+    cutouts are measured exactly from their polygons. Overlaps between support bars, screw hole bodies and
+    the case walls are ignored and the extra wall height from tilting the case uses the average height, so
+    volumes are estimates. For the top sections only the cutouts and switch supports are split exactly. The
+    rest of the plate and case is split by the share of key area in each section
+
+    ...
+
+    Attributes
+    ----------
+    keyboard : Keyboard
+        The keyboard to estimate. process_keyboard_layout() must already have been called
+
+    filament_density : float, default 1.24
+        Filament density in g/cm^3. The default is for PLA
+
+    filament_diameter : float, default 1.75
+        Filament diameter in mm
+
+    Methods
+    -------
+    get_polygon_area(point_list)
+        Get the area of a simple polygon
+    get_union_area(polygon_list)
+        Get the area covered by a list of polygons, counting overlaps once
+    get_rounded_rectangle_area(width, height, radius)
+        Get the area of a rectangle with rounded corners
+    get_switch_cutout_area(switch)
+        Get the plate area removed by the cutout of a switch
+    get_support_frame_area(w_mm, h_mm)
+        Get the footprint of the support bar frame under a key
+    get_material(volume)
+        Get the volume, mass and filament length for a volume in mm^3
+    get_metrics()
+        Get the estimate for every part and section
+    """
+
+    # Cutout cache key -> plate area removed by the cutout
+    cutout_area_cache = {}
+
+    def __init__(
+        self, keyboard: Keyboard, filament_density=1.24, filament_diameter=1.75
+    ):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.keyboard = keyboard
+        self.parameters = keyboard.parameters
+
+        self.filament_density = filament_density
+        self.filament_diameter = filament_diameter
+
+    @staticmethod
+    def get_polygon_area(point_list):
+        # Shoelace formula over each point and the point after it
+        next_point_list = point_list[1:] + point_list[:1]
+
+        return abs(
+            sum(
+                [
+                    (x1 * y2) - (x2 * y1)
+                    for (x1, y1), (x2, y2) in zip(point_list, next_point_list)
+                ]
+            )
+            / 2
+        )
+
+    @staticmethod
+    def get_union_area(polygon_list):
+        # Split the polygons into horizontal strips at every vertex y value. Inside a strip every polygon
+        # edge is a straight line so the covered width at the middle of the strip times the strip height is
+        # the covered area of the strip
+        y_list = sorted(set([y for polygon in polygon_list for _, y in polygon]))
+
+        area = 0.0
+        for y_start, y_end in zip(y_list, y_list[1:]):
+            y_middle = (y_start + y_end) / 2
+
+            interval_list = []
+            for polygon in polygon_list:
+                crossing_list = []
+                for (x1, y1), (x2, y2) in zip(polygon, polygon[1:] + polygon[:1]):
+                    if (y1 <= y_middle) != (y2 <= y_middle):
+                        crossing_list.append(
+                            x1 + ((y_middle - y1) * (x2 - x1) / (y2 - y1))
+                        )
+
+                crossing_list.sort()
+                interval_list += list(zip(crossing_list[0::2], crossing_list[1::2]))
+
+            # Merge overlapping intervals so overlapping polygons are only counted once
+            covered_width = 0.0
+            current_start = None
+            current_end = None
+            for start_x, end_x in sorted(interval_list):
+                if current_end is None or start_x > current_end:
+                    if current_end is not None:
+                        covered_width += current_end - current_start
+                    current_start = start_x
+                    current_end = end_x
+                elif end_x > current_end:
+                    current_end = end_x
+            if current_end is not None:
+                covered_width += current_end - current_start
+
+            area += covered_width * (y_end - y_start)
+
+        return area
+
+    @staticmethod
+    def get_rounded_rectangle_area(width, height, radius):
+        return (width * height) - ((4 - math.pi) * radius * radius)
+
+    def get_switch_cutout_area(self, switch):
+        cutout_cache_key = switch.get_cutout_cache_key()
+
+        if cutout_cache_key not in GeometryMetrics.cutout_area_cache:
+            switch_config = switch.switch_config
+
+            polygon_list = [
+                [tuple(point) for point in switch_config.get_switch_poly_info()]
+            ]
+
+            # The stabilizer polygon is mirrored to the other side of the switch
+            stab_poly_points, _ = switch_config.get_stab_poly_info(
+                key_width=switch.switch_length
+            )
+            if stab_poly_points is not None:
+                polygon_list.append([tuple(point) for point in stab_poly_points])
+                polygon_list.append([(-x, y) for x, y in stab_poly_points])
+
+            GeometryMetrics.cutout_area_cache[cutout_cache_key] = self.get_union_area(
+                polygon_list
+            )
+
+        return GeometryMetrics.cutout_area_cache[cutout_cache_key]
+
+    def get_support_frame_area(self, w_mm, h_mm):
+        # Support bars are a frame around the key with the inside removed
+        inner_w = max(w_mm - (self.parameters.support_bar_width / 2), 0.0)
+        inner_h = max(h_mm - (self.parameters.support_bar_width / 2), 0.0)
+
+        return (w_mm * h_mm) - (inner_w * inner_h)
+
+    def get_custom_polygon_area(self):
+        area = 0.0
+
+        if self.parameters.custom_polygons is not None:
+            for shape in self.parameters.custom_polygons:
+                shape_type = shape.get("type")
+                if shape_type == "circle":
+                    radius = shape["r"] if "r" in shape.keys() else shape["d"] / 2
+                    shape_area = math.pi * radius * radius
+                elif shape_type == "rectangle":
+                    width = shape.get("width", shape.get("height"))
+                    height = shape.get("height", width)
+                    shape_area = width * height
+                elif shape_type == "polygon":
+                    shape_area = self.get_polygon_area(
+                        [tuple(point) for point in shape["points"]]
+                    )
+                else:
+                    continue
+
+                area += shape_area * len(shape["coordinates"])
+
+        return area
+
+    def get_key_support_area(self, switch_list):
+        area = 0.0
+        for switch in switch_list:
+            # Keys that sit exactly on one grid cell share their frame with the plate support grid
+            if (
+                self.parameters.plate_supports
+                and switch.w == 1.0
+                and switch.h == 1.0
+                and float(switch.x).is_integer()
+                and float(switch.y).is_integer()
+                and switch.rotaton == 0.0
+            ):
+                continue
+
+            area += self.get_support_frame_area(switch.w_mm, switch.h_mm)
+
+        return area
+
+    def get_grid_support_area(self):
+        if not self.parameters.plate_supports:
+            return 0.0
+
+        max_x = self.parameters.max_x
+        max_y = abs(self.parameters.min_y)
+
+        area = 0.0
+        for x in range(math.ceil(max_x)):
+            w = min(1.0, max_x - x)
+            for y in range(math.ceil(max_y)):
+                h = min(1.0, max_y - y)
+                area += self.get_support_frame_area(
+                    self.parameters.U(w), self.parameters.U(h)
+                )
+
+        # Perimeter bar around the whole key area
+        support_bar_width = self.parameters.support_bar_width
+        area += (
+            (self.parameters.real_max_x + support_bar_width)
+            * (self.parameters.real_max_y + support_bar_width)
+        ) - (self.parameters.real_max_x * self.parameters.real_max_y)
+
+        return area
+
+    def get_screw_body_list(self):
+        """
+        Get the case x coordinate and volume of every screw hole body in the bottom part
+
+        Returns
+        -------
+        list
+            List of (case_x, body_volume, tap_hole_volume) tuples
+        """
+        if self.parameters.screw_count <= 0:
+            return []
+
+        body = Body(self.parameters)
+        body.set_screw_hole_support_directions()
+        screw_hole_table = body.screw_hole_table
+
+        radius = self.parameters.screw_hole_body_radius
+        tap_radius = self.parameters.screw_tap_hole_diameter / 2
+        extra_fill = self.parameters.case_height_extra_fill
+        tilt_sin = math.sin(math.radians(self.parameters.tilt))
+
+        screw_body_list = []
+        for row in range(screw_hole_table.get_count()):
+            if screw_hole_table.skip_list[row]:
+                continue
+
+            case_x = screw_hole_table.x_list[row] + self.parameters.screw_edge_x_inset
+            case_y = screw_hole_table.y_list[row] + self.parameters.screw_edge_y_inset
+
+            # The body reaches from the floor to the bottom of the plate, which is higher at the back of
+            # a tilted case
+            body_height = max(
+                self.parameters.case_height_base_removed
+                - self.parameters.plate_thickness
+                + (case_y * tilt_sin),
+                0.0,
+            )
+
+            body_volume = math.pi * radius * radius * body_height
+
+            # Each support is a 2 mm thick wedge that narrows from the bottom of the extended body to the
+            # cylinder at the top
+            for direction in screw_hole_table.DIRECTION_LIST:
+                support_end_x = screw_hole_table.get_support(row, direction)
+                if support_end_x > radius:
+                    body_volume += (
+                        2
+                        * (support_end_x - radius)
+                        * (body_height * body_height)
+                        / (2 * extra_fill)
+                    )
+
+            tap_hole_volume = (
+                math.pi
+                * tap_radius
+                * tap_radius
+                * (body_height + self.parameters.bottom_cover_thickness)
+            )
+
+            screw_body_list.append((case_x, body_volume, tap_hole_volume))
+
+        return screw_body_list
+
+    def get_material(self, volume):
+        volume = max(volume, 0.0)
+        filament_area = math.pi * ((self.filament_diameter / 2) ** 2)
+
+        return {
+            "volume": volume,
+            "mass": (volume / 1000) * self.filament_density,
+            "filament_length": (volume / filament_area) / 1000,
+        }
+
+    def get_metrics(self):
+        """
+        Get the estimate for every part and section
+
+        Volumes are in mm^3, areas in mm^2, masses in g and filament lengths in m
+
+        Returns
+        -------
+        dict
+            Case dimensions, a material estimate for the top, plate and bottom parts and a list of material
+            estimates for the sections of each part
+        """
+        parameters = self.parameters
+        keyboard = self.keyboard
+
+        case_width = parameters.real_case_width
+        case_depth = parameters.real_case_height
+        corner_radius = parameters.plate_corner_radius
+        wall_thickness = parameters.case_wall_thickness
+        plate_thickness = parameters.plate_thickness
+
+        footprint_area = self.get_rounded_rectangle_area(
+            case_width, case_depth, corner_radius
+        )
+
+        # Cutouts and key supports for the switches in each top section
+        section_switch_list = [
+            section.get_item_list() for section in keyboard.switch_section_list
+        ]
+        rotated_switch_list = keyboard.switch_rotation_collection.get_item_list()
+
+        section_key_area_list = [
+            sum([switch.w_mm * switch.h_mm for switch in switch_list])
+            for switch_list in section_switch_list
+        ]
+        total_key_area = sum(section_key_area_list)
+        if total_key_area > 0:
+            section_share_list = [
+                key_area / total_key_area for key_area in section_key_area_list
+            ]
+        else:
+            section_share_list = [1.0 / len(section_key_area_list)] * len(
+                section_key_area_list
+            )
+
+        section_cutout_area_list = [
+            sum([self.get_switch_cutout_area(switch) for switch in switch_list])
+            for switch_list in section_switch_list
+        ]
+        rotated_cutout_area = sum(
+            [self.get_switch_cutout_area(switch) for switch in rotated_switch_list]
+        )
+
+        section_key_support_area_list = [
+            self.get_key_support_area(switch_list)
+            for switch_list in section_switch_list
+        ]
+        rotated_key_support_area = self.get_key_support_area(rotated_switch_list)
+
+        # Plate and case material that is split between the top sections by key area
+        screw_body_list = self.get_screw_body_list()
+        screw_hole_area = (
+            len(screw_body_list) * math.pi * ((parameters.screw_diameter / 2) ** 2)
+        )
+
+        shared_plate_area = (
+            footprint_area
+            - rotated_cutout_area
+            - screw_hole_area
+            - self.get_custom_polygon_area()
+        )
+        shared_support_area = self.get_grid_support_area() + rotated_key_support_area
+
+        ring_area = 0.0
+        if wall_thickness > 0:
+            ring_area = footprint_area - (
+                max(case_width - (wall_thickness * 2), 0.0)
+                * max(case_depth - (wall_thickness * 2), 0.0)
+            )
+
+        # Walls reach from the floor to the bottom of the plate. Tilting raises the back of the case so
+        # the walls are on average half the tilt rise taller
+        wall_height = max(
+            parameters.case_height_base_removed
+            - plate_thickness
+            + ((case_depth / 2) * math.sin(math.radians(parameters.tilt))),
+            0.0,
+        )
+        wall_volume = ring_area * wall_height
+        if parameters.cable_hole:
+            wall_volume -= (
+                parameters.cable_hole_width
+                * wall_thickness
+                * parameters.cable_hole_height
+            )
+
+        support_bar_height = parameters.support_bar_height
+        if parameters.simple_test:
+            section_cutout_area_list = [0.0] * len(section_cutout_area_list)
+            section_key_support_area_list = [0.0] * len(section_key_support_area_list)
+
+        section_dict = {"top": [], "plate": [], "bottom": []}
+        part_volume_dict = {"top": 0.0, "plate": 0.0}
+        plate_area = 0.0
+        support_volume = 0.0
+        for section, share in enumerate(section_share_list):
+            section_plate_area = (shared_plate_area * share) - section_cutout_area_list[
+                section
+            ]
+            section_support_volume = (
+                (shared_support_area * share) + section_key_support_area_list[section]
+            ) * support_bar_height
+
+            plate_area += section_plate_area
+            support_volume += section_support_volume
+
+            plate_volume = (
+                section_plate_area * plate_thickness
+            ) + section_support_volume
+            top_volume = plate_volume + (wall_volume * share)
+
+            part_volume_dict["plate"] += plate_volume
+            part_volume_dict["top"] += top_volume
+
+            section_dict["plate"].append(
+                dict(self.get_material(plate_volume), section=section)
+            )
+            section_dict["top"].append(
+                dict(self.get_material(top_volume), section=section)
+            )
+
+        # The bottom is split into equal width sections
+        cover_volume = footprint_area * parameters.bottom_cover_thickness
+        bottom_section_count = max(keyboard.get_bottom_section_count(), 1)
+        bottom_section_width = case_width / bottom_section_count
+
+        bottom_volume = 0.0
+        screw_body_volume = 0.0
+        for section in range(bottom_section_count):
+            start_x = bottom_section_width * section
+            end_x = start_x + bottom_section_width
+
+            section_volume = cover_volume / bottom_section_count
+            for case_x, body_volume, tap_hole_volume in screw_body_list:
+                if start_x <= case_x < end_x or (
+                    section == bottom_section_count - 1 and case_x >= end_x
+                ):
+                    section_volume += body_volume - tap_hole_volume
+                    screw_body_volume += body_volume - tap_hole_volume
+
+            bottom_volume += section_volume
+            section_dict["bottom"].append(
+                dict(self.get_material(section_volume), section=section)
+            )
+
+        self.logger.debug(
+            "Estimate: top: %f, plate: %f, bottom: %f",
+            part_volume_dict["top"],
+            part_volume_dict["plate"],
+            bottom_volume,
+        )
+
+        return {
+            "case": {
+                "width": case_width,
+                "depth": case_depth,
+                "height": parameters.case_height,
+                "tilt": parameters.tilt,
+                "footprint_area": footprint_area,
+                "top_section_count": keyboard.get_top_section_count(),
+                "bottom_section_count": keyboard.get_bottom_section_count(),
+            },
+            "parts": {
+                "top": dict(
+                    self.get_material(part_volume_dict["top"]),
+                    plate_area=plate_area,
+                    cutout_area=sum(section_cutout_area_list) + rotated_cutout_area,
+                    support_volume=support_volume,
+                    wall_volume=wall_volume,
+                ),
+                "plate": dict(
+                    self.get_material(part_volume_dict["plate"]),
+                    plate_area=plate_area,
+                    support_volume=support_volume,
+                ),
+                "bottom": dict(
+                    self.get_material(bottom_volume),
+                    cover_volume=cover_volume,
+                    screw_body_volume=screw_body_volume,
+                ),
+            },
+            "sections": section_dict,
+            "filament": {
+                "density": self.filament_density,
+                "diameter": self.filament_diameter,
+            },
+        }
@@ -1,3 +1,4 @@
+from bisect import insort
 from solid import union, polygon
 
 # import graphviz
@@ -5,6 +6,7 @@ import logging
 
 from switch import Switch
 from cell import Cell
+from neighbor_graph import NeighborGraph
 
 
 class ItemCollection:
@@ -19,6 +21,21 @@ class ItemCollection:
         self.get_collection_bounds_call_count = 0
         self.get_moved_union_call_count = 0
 
+        # Indexes kept up to date by add_item so queries do not scan the collection
+        # (rx, ry) -> [min_x, max_x, max_y, min_y] of the items
+        self.bounds_dict = {}
+        # (rx, ry) -> sorted x offsets
+        self.sorted_x_dict = {}
+        # (rx, ry, x) -> sorted y offsets
+        self.sorted_y_dict = {}
+        # (rx, ry) -> smallest y offset
+        self.min_y_dict = {}
+        # Cell value -> items with that value in the order they were added
+        self.value_dict = {}
+
+        # Neighbors of the items, shared with any collection the items were already in
+        self.neighbor_graph = None
+
         # self.dot_recurse = graphviz.Digraph()
         # self.dot = graphviz.Digraph()
 
@@ -40,20 +57,61 @@ class ItemCollection:
                 "Adding item to collection with rx = {}, ry = {}".format(rx, ry)
             )
 
+        replaced_cell = self.collection[rx][ry][x_offset].get(y_offset)
+
         self.collection[rx][ry][x_offset][y_offset] = cell
 
+        if replaced_cell is not None:
+            self.value_dict[replaced_cell.cell_value].remove(replaced_cell)
+        self.value_dict.setdefault(cell.cell_value, []).append(cell)
+
+        if replaced_cell is not None:
+            # A replaced item can shrink the bounds so they are found again from every item
+            del self.bounds_dict[(rx, ry)]
+            for x in self.get_x_list_in_rx_ry(rx, ry):
+                for y in self.get_y_list_in_rx_ry_x(x, rx, ry):
+                    self.update_bounds(self.get_item(x, y, rx, ry), rx, ry)
+            return
+
+        self.update_bounds(cell, rx, ry)
+
+        if (rx, ry, x_offset) not in self.sorted_y_dict.keys():
+            insort(self.sorted_x_dict.setdefault((rx, ry), []), x_offset)
+        insort(self.sorted_y_dict.setdefault((rx, ry, x_offset), []), y_offset)
+
+        self.min_y_dict[(rx, ry)] = min(
+            self.min_y_dict.get((rx, ry), y_offset), y_offset
+        )
+
+    def update_bounds(self, cell: Cell, rx, ry):
+        # Start from the same limits get_collection_bounds() always returned for an empty collection
+        bounds = self.bounds_dict.setdefault(
+            (rx, ry), [1000.0, -1000.0, -1000.0, 1000.0]
+        )
+
+        bounds[0] = min(bounds[0], cell.get_start_x())
+        bounds[1] = max(bounds[1], cell.get_end_x())
+        bounds[2] = max(bounds[2], cell.get_start_y())
+        bounds[3] = min(bounds[3], cell.get_end_y())
+
     def get_item(self, x_offset, y_offset, rx=0.0, ry=0.0) -> Cell:
         return self.collection[rx][ry][x_offset][y_offset]
 
-    def get_item_with_value(self, value):
+    def get_item_list(self):
+        item_list = []
         for rx in self.get_rx_list():
             for ry in self.get_ry_list_in_rx(rx):
                 for x in self.get_x_list_in_rx_ry(rx, ry):
                     for y in self.get_y_list_in_rx_ry_x(x, rx, ry):
-                        current_switch = self.get_item(x, y, rx, ry)
+                        item_list.append(self.get_item(x, y, rx, ry))
 
-                        if current_switch.cell_value == value:
-                            return current_switch
+        return item_list
+
+    def get_item_with_value(self, value):
+        # The first item added with the value
+        item_list = self.value_dict.get(value, [])
+        if len(item_list) > 0:
+            return item_list[0]
 
     def get_moved_item(self, x_offset, y_offset, rx=0.0, ry=0.0) -> Cell:
         return self.collection[rx][ry][x_offset][y_offset].get_moved()
@@ -99,68 +157,60 @@ class ItemCollection:
         return self.get_x_list_in_rx_ry(rx, ry)
 
     def get_sorted_x_list(self, rx=0.0, ry=0.0):
-        return sorted(self.get_x_list(rx, ry))
+        # The index itself is returned so it must not be changed
+        return self.sorted_x_dict.get((rx, ry), [])
 
     def get_y_list_in_x(self, x, rx=0.0, ry=0.0):
         return self.get_y_list_in_rx_ry_x(x, rx, ry)
 
     def get_sorted_y_list_in_x(self, x, rx=0.0, ry=0.0):
-        return sorted(self.get_y_list_in_x(x, rx, ry))
+        # The index itself is returned so it must not be changed
+        return self.sorted_y_dict.get((rx, ry, x), [])
 
     def get_min_x(self, rx=0.0, ry=0.0):
-        return min(self.get_x_list(rx, ry))
+        return self.sorted_x_dict[(rx, ry)][0]
 
     def get_max_x(self, rx=0.0, ry=0.0):
-        return max(self.get_x_list(rx, ry))
+        return self.sorted_x_dict[(rx, ry)][-1]
 
     def get_min_y(self, rx=0.0, ry=0.0):
-        min_y = 0
-
-        for x in self.get_x_list(rx, ry):
-            col_min_y = min(self.get_y_list_in_rx_ry_x(x, rx, ry))
-
-            if col_min_y < min_y:
-                min_y = col_min_y
-        return min_y
+        return min(0, self.min_y_dict.get((rx, ry), 0))
 
     def get_collection_bounds(self, rx=0.0, ry=0.0) -> float:
+        self.get_collection_bounds_call_count += 1
 
-        min_y = 1000.0
-        max_y = -1000.0
-        max_x = -1000.0
-        min_x = 1000.0
-
-        for x in self.get_x_list(rx, ry):
-            for y in self.get_y_list_in_x(x, rx, ry):
-                cell = self.get_item(x, y, rx, ry)
-                start_x = cell.get_start_x()
-                end_x = cell.get_end_x()
-                start_y = cell.get_start_y()
-                end_y = cell.get_end_y()
-
-                # self.logger.debug('end_x: %f, end_y: %f', end_x, end_y)
-                if start_x < min_x:
-                    min_x = start_x
-
-                if end_x > max_x:
-                    max_x = end_x
-
-                if start_y > max_y:
-                    max_y = start_y
-
-                if end_y < min_y:
-                    min_y = end_y
+        (min_x, max_x, max_y, min_y) = self.bounds_dict.get(
+            (rx, ry), [1000.0, -1000.0, -1000.0, 1000.0]
+        )
 
         self.logger.debug(
             "min_x: %f, max_x: %f, max_y: %f, min_y: %f", min_x, max_x, max_y, min_y
         )
         return (min_x, max_x, max_y, min_y)
 
-    def get_moved_union(self, rx=0.0, ry=0.0):
+    def get_moved_union(self, rx=0.0, ry=0.0, min_x=None, max_x=None):
+        self.get_moved_union_call_count += 1
+
         solid = union()
 
         for x in self.get_x_list_in_rx_ry(rx, ry):
             for y in self.get_y_list_in_rx_ry_x(x, rx, ry):
+                # Skip items that are completely outside of the requested x range
+                if min_x is not None or max_x is not None:
+                    # Rotated items are checked where they end up after the rotation
+                    if self.rotation != 0.0:
+                        start_x_mm, end_x_mm = self.get_item(
+                            x, y, rx, ry
+                        ).get_rotated_x_bounds_mm(rx)
+                    else:
+                        start_x_mm, end_x_mm = self.get_item(
+                            x, y, rx, ry
+                        ).get_x_bounds_mm()
+                    if min_x is not None and end_x_mm < min_x:
+                        continue
+                    if max_x is not None and start_x_mm > max_x:
+                        continue
+
                 temp_solid = self.get_moved_item(x, y, rx, ry)
                 solid += temp_solid
         return solid
@@ -168,6 +218,16 @@ class ItemCollection:
     def set_collection_neighbors(self, neighbor_group="local"):
 
         self.logger.debug("Set %s neighbors", neighbor_group)
+
+        # Items keep the graph of the first collection their neighbors were set in
+        for item in self.get_item_list():
+            if item.neighbor_graph is None:
+                if self.neighbor_graph is None:
+                    self.neighbor_graph = NeighborGraph()
+                item.set_neighbor_graph(self.neighbor_graph)
+            elif self.neighbor_graph is None:
+                self.neighbor_graph = item.neighbor_graph
+
         for rx in self.get_rx_list():
             for ry in self.get_ry_list_in_rx(rx):
                 for x in self.get_x_list_in_rx_ry(rx, ry):
@@ -291,7 +351,6 @@ class ItemCollection:
                     neighbor_group=neighbor_group,
                     perp_offset=perp_offset,
                 )
-                closest_neighbor.update_all_neighbors_set(neighbor_group=neighbor_group)
             else:
                 # self.logger.debug('set switch %s no neighbor %s', str(item), direction)
                 closest_neighbor = None
@@ -301,8 +360,6 @@ class ItemCollection:
                     neighbor_group=neighbor_group,
                 )
 
-        item.update_all_neighbors_set(neighbor_group=neighbor_group)
-
         all_neighbors_set = item.get_all_neighbors_set(neighbor_group=neighbor_group)
 
         # pos = '%f,%f!' % (item.center_x, item.center_y)
@@ -409,16 +466,13 @@ class ItemCollection:
                         item: Switch
                         item = self.get_item(x, y, rx, ry)
 
-                        local_neighbor = item.get_neighbor(
+                        if not item.has_neighbor(
                             neighbor_name, neighbor_group="local"
-                        )
-                        global_neighbor = item.get_neighbor(
-                            neighbor_name, neighbor_group="global"
-                        )
-
-                        if local_neighbor is None and global_neighbor is not None:
+                        ) and item.has_neighbor(neighbor_name, neighbor_group="global"):
                             return True
 
+        return False
+
     def has_global_right_neighbor_section(self):
         return self.has_global_neighbor_section(neighbor_name="right")
 
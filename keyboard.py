@@ -1,3 +1,5 @@
+import hashlib
+import json
 import math
 import logging
 from solid import union, cube, rotate
@@ -15,10 +17,18 @@ from pcb import PCB
 from parameters import Parameters
 from cable import Cable
 from shape_cutout import ShapeCutout
+from section_outline import SectionOutline
+from section_boundary import SectionBoundaryIndex
 
 
 class Keyboard:
 
+    # Parts that can be built for each section
+    PART_NAME_LIST = ["top", "bottom", "all", "plate"]
+
+    # Steps per layout unit of the grid that layout positions, sizes and angles are snapped to
+    LAYOUT_GRID = 1000
+
     def __init__(self, parameters: Parameters = Parameters()):
 
         self.parameters = parameters
@@ -33,6 +43,12 @@ class Keyboard:
 
         self.desired_section_number = -1
 
+        # Preview builds use low detail geometry with the same layout and sections
+        self.preview = False
+
+        # Extra distance added around the kept section material when deciding which objects to emit
+        self.section_clip_margin = self.parameters.switch_spacing / 2
+
         self.cable_hole_up_offset = self.parameters.cable_hole_up_offset
         self.cable_hole_down_offset = self.parameters.cable_hole_down_offset
 
@@ -66,14 +82,23 @@ class Keyboard:
         self.rotate_support_collection = union()
         self.rotate_support_cutout_collection = union()
 
-        self.custom_polygon_cutout_collection = union()
+        # Clip x range -> custom polygon cutouts in the range, or None if no cutout is in the range
+        self.custom_polygon_layer_dict = {}
 
         self.switch_section_list = [ItemCollection()]
         self.support_section_list = [ItemCollection()]
         self.support_cutout_section_list = [ItemCollection()]
 
+        # Boundaries between the sections, found when the keyboard is split
+        self.section_boundary_index = None
+
         self.cable = Cable(parameters)
 
+    def snap_to_grid(self, value):
+        # Every layout value is a whole number of grid steps so the same position always gets the same
+        # float, no matter how many offsets were added up to reach it
+        return round(float(value) * self.LAYOUT_GRID) / self.LAYOUT_GRID
+
     def process_keyboard_layout(self, keyboard_layout_dict):
         y = 0.0
         rotation = 0.0
@@ -97,16 +122,16 @@ class Keyboard:
                             modifier_type = key
 
                             if modifier_type in self.modifier_include_list:
-                                size = float(col[key])
+                                size = self.snap_to_grid(col[key])
                                 if modifier_type == "w":
                                     w = size
                                 if modifier_type == "h":
                                     h = size
                                 if modifier_type == "x":
-                                    x += size
+                                    x = self.snap_to_grid(x + size)
                                     # r_x_offset = size
                                 if modifier_type == "y":
-                                    y += size
+                                    y = self.snap_to_grid(y + size)
                                     # r_y_offset = size
                                 if modifier_type == "r":
                                     rotation = size
@@ -184,20 +209,23 @@ class Keyboard:
                                 rotation, x_offset, y_offset, support_cutout, rx, ry
                             )
 
-                        x += w
+                        x = self.snap_to_grid(x + w)
                         w = 1.0
                         h = 1.0
 
                     elif ignore_next:
                         ignore_next = False
 
-                y += 1
+                y = self.snap_to_grid(y + 1)
 
         self.switch_collection.set_collection_neighbors("global")
 
         # create sections of the keyboard for usin in splitting for printing
         self.split_keyboard()
 
+        # Set the case dimensions so the section counts are known before any part is built
+        self.update_dimensions()
+
     def process_custom_shapes(self):
 
         if self.parameters.custom_polygons is not None:
@@ -214,36 +242,108 @@ class Keyboard:
                     )
                     self.custom_polygon_collection.add_item(x, y, custom_shape)
 
-    def get_assembly(self, top=False, bottom=False, all=True, plate_only=False):
-
-        # Init top_assembly and bottom_assembly objects
-        top_assembly = union()
-        bottom_assembly = union()
+        self.custom_polygon_layer_dict = {}
+
+    def get_layout_description(self):
+        """
+        Get the geometry of the processed layout as JSON values. Every key is listed as [rotation, rx, ry,
+        x, y, w, h] in LAYOUT_GRID steps and sorted, so legends, layout metadata and the order keys are
+        listed in do not change the description. The user parameters are added as their content hash
+        """
+        key_list = []
+        for rotation, item_collection in [(0.0, self.switch_collection)] + list(
+            self.switch_rotation_collection.get_collection_dict().items()
+        ):
+            for rx in item_collection.get_rx_list():
+                for ry in item_collection.get_ry_list_in_rx(rx):
+                    for x in item_collection.get_x_list_in_rx_ry(rx, ry):
+                        for y in item_collection.get_y_list_in_rx_ry_x(x, rx, ry):
+                            item = item_collection.get_item(x, y, rx, ry)
+                            value_list = [rotation, rx, ry, x, y, item.w, item.h]
+
+                            key_list.append(
+                                [
+                                    round(value * self.LAYOUT_GRID)
+                                    for value in value_list
+                                ]
+                            )
 
-        # Get the x and y bounds of the switches
-        (min_x, max_x, max_y, min_y) = self.switch_collection.get_collection_bounds()
+        return {
+            "keys": sorted(key_list),
+            "parameters": self.parameters.get_snapshot().content_hash,
+        }
+
+    def get_layout_key(self):
+        """
+        Get a hash of the layout description that can be used as a cache key for anything built from the
+        processed layout, so relabeling keys or editing the layout metadata keeps the key
+        """
+        layout_description = json.dumps(
+            self.get_layout_description(), sort_keys=True, separators=(",", ":")
+        )
 
-        # Add all switch and support collection objects to switch and support attributes
-        support_collection = self.support_collection
-        switch_collection = self.switch_collection
-        support_cutout_collection = self.support_cutout_collection
+        return hashlib.sha256(layout_description.encode("utf-8")).hexdigest()
+
+    def get_custom_polygon_layer(self, clip_min_x, clip_max_x):
+        """
+        Get the custom polygon cutouts that reach into the clip range moved to the plate height. The cutouts
+        are culled once for each clip range and shared by every assembly. The plate height is applied on
+        every call so a keyboard reused with other case heights places them correctly. Returns None if no
+        cutout is in the range so assemblies do not get an empty union
+        """
+        clip_key = (clip_min_x, clip_max_x)
+        if clip_key not in self.custom_polygon_layer_dict.keys():
+            self.custom_polygon_layer_dict[clip_key] = self.get_custom_polygon_cutouts(
+                clip_min_x, clip_max_x
+            )
 
-        if self.desired_section_number > -1:
-            support_collection = self.support_section_list[self.desired_section_number]
-            switch_collection = self.switch_section_list[self.desired_section_number]
-            support_cutout_collection = self.support_cutout_section_list[
-                self.desired_section_number
-            ]
+        custom_polygon_cutouts = self.custom_polygon_layer_dict[clip_key]
+        if custom_polygon_cutouts is None:
+            return None
 
-        self.switch_supports += support_collection.get_moved_union()
-        self.switch_cutouts += switch_collection.get_moved_union()
-        self.switch_support_cutouts += support_cutout_collection.get_moved_union()
+        return up(
+            self.parameters.case_height_base_removed
+            - (self.parameters.plate_thickness / 2)
+        )(custom_polygon_cutouts)
 
+    def get_custom_polygon_cutouts(self, clip_min_x, clip_max_x):
+        # The custom polygon cutouts in the clip range before they are moved to the plate height
+        custom_polygon_cutouts = None
         if self.parameters.custom_polygons is not None:
-            self.custom_polygon_cutout_collection = (
-                self.custom_polygon_collection.get_moved_union()
+            # Custom polygon coordinates include the left margin
+            custom_polygon_min_x = None
+            custom_polygon_max_x = None
+            if clip_min_x is not None:
+                custom_polygon_min_x = clip_min_x + self.parameters.left_margin
+            if clip_max_x is not None:
+                custom_polygon_max_x = clip_max_x + self.parameters.left_margin
+
+            custom_polygon_cutouts = self.custom_polygon_collection.get_moved_union(
+                min_x=custom_polygon_min_x, max_x=custom_polygon_max_x
             )
 
+            if len(custom_polygon_cutouts.children) == 0:
+                custom_polygon_cutouts = None
+
+        return custom_polygon_cutouts
+
+    def get_assembly(self, top=False, bottom=False, all=True, plate_only=False):
+
+        if top:
+            part_name = "top"
+        elif plate_only:
+            part_name = "plate"
+        elif bottom:
+            part_name = "bottom"
+        else:
+            part_name = "all"
+
+        return self.get_assembly_dict([part_name])[part_name]
+
+    def update_dimensions(self):
+        # Get the x and y bounds of the switches
+        (min_x, max_x, max_y, min_y) = self.switch_collection.get_collection_bounds()
+
         (rotated_min_x, rotated_max_x, rotated_max_y, rotated_min_y) = (
             self.switch_rotation_collection.get_real_collection_bounds()
         )
@@ -265,147 +365,107 @@ class Keyboard:
         if rotated_max_y > max_y:
             max_y = rotated_max_y
 
-        # Union together all rotated switch cutouts
-        for rotation in self.switch_rotation_collection.get_rotation_list():
-            self.switch_cutouts += (
-                self.switch_rotation_collection.get_rotated_moved_union(rotation)
-            )
-            self.switch_supports += (
-                self.support_rotation_collection.get_rotated_moved_union(rotation)
-            )
-            self.switch_support_cutouts += (
-                self.support_cutout_rotation_collection.get_rotated_moved_union(
-                    rotation
-                )
-            )
-
-        # Set body dimensions
         self.parameters.set_dimensions(max_x, min_y, min_x, max_y)
 
-        # Init body object
-        self.body = Body(self.parameters)
-
-        # Init PCB object
-        # if self.parameters.custom_pcb == True:
-        self.pcb = PCB(self.parameters)
-        pcb_model = self.pcb.get_model()
+    def move_to_case_origin(self, solid_object):
+        # Move an object built in switch coordinates so that the bottom left of the case sits at 0, 0, 0
+        return up(
+            self.parameters.case_height_base_removed
+            - (self.parameters.plate_thickness / 2)
+        )(
+            forward(self.parameters.real_max_y + self.parameters.bottom_margin)(
+                right(self.parameters.left_margin)(solid_object)
+            )
+        )
 
-        # Add case to top_assembly
-        top_assembly += self.body.case(plate_only=plate_only)
+    def get_assembly_dict(self, part_name_list=None):
+        """
+        Build the requested parts for the current section from a single evaluation of the layout. Objects
+        that are shared between parts, like the switch cutouts, screw holes and the section remove blocks,
+        are built once and referenced by every part that uses them
 
-        if not self.parameters.simple_test:
-            # Remove switch suport cutouts
-            top_assembly -= self.switch_support_cutouts
+        Parameters
+        ----------
+        part_name_list : list, default None
+            Names of the parts to build. Any of "top", "plate", "bottom" and "all". Builds all parts if None
 
-            # Add switch supports and remove switch cutouts
-            top_assembly += self.switch_supports
-            top_assembly -= self.switch_cutouts
+        Returns
+        -------
+        dict
+            Part name -> SolidPython object. The "all" part is the union of the top and bottom parts
+        """
 
-        # Generate screw hole related objects
-        screw_hole_collection = None
-        screw_hole_body_collection = None
-        screw_hole_body_scaled_collection = None
-        if self.parameters.screw_count > 0:
-            (
-                screw_hole_collection,
-                screw_hole_body_collection,
-                screw_hole_body_scaled_collection,
-            ) = self.body.screw_hole_objects(tap=bottom)
+        if part_name_list is None:
+            part_name_list = self.PART_NAME_LIST
 
-            # Remove screw holes from top top_assembly
-            top_assembly -= screw_hole_collection
+        build_top = any([name in part_name_list for name in ["top", "plate", "all"]])
+        build_bottom = any([name in part_name_list for name in ["bottom", "all"]])
 
-            bottom_assembly = screw_hole_body_collection
-            bottom_assembly -= screw_hole_collection
-
-        body_block = self.body.case(body_block_only=True)
+        # Add all switch and support collection objects to switch and support attributes
+        support_collection = self.support_collection
+        switch_collection = self.switch_collection
+        support_cutout_collection = self.support_cutout_collection
 
-        # Remove items marked as not part of desired section
         if self.desired_section_number > -1:
-            top_assembly -= self.get_top_section_remove_block(
-                self.desired_section_number
-            )
-            # TODO
-            bottom_section_inclusion = self.get_bottom_section_remove_block(
+            support_collection = self.support_section_list[self.desired_section_number]
+            switch_collection = self.switch_section_list[self.desired_section_number]
+            support_cutout_collection = self.support_cutout_section_list[
                 self.desired_section_number
-            )
-            # bottom_assembly -= self.get_bottom_section_remove_block(self.desired_section_number)
+            ]
 
-        self.custom_polygon_cutout_collection = up(
-            self.parameters.case_height_base_removed
-            - (self.parameters.plate_thickness / 2)
-        )(self.custom_polygon_cutout_collection)
-        # Move top_assembly so that the bottom left sits at 0, 0, 0
-        top_assembly = up(
-            self.parameters.case_height_base_removed
-            - (self.parameters.plate_thickness / 2)
-        )(
-            forward(self.parameters.real_max_y + self.parameters.bottom_margin)(
-                right(self.parameters.left_margin)(top_assembly)
-            )
-        )
+        if build_top:
+            self.switch_supports = support_collection.get_moved_union()
+            self.switch_cutouts = switch_collection.get_moved_union()
+            self.switch_support_cutouts = support_cutout_collection.get_moved_union()
 
-        top_assembly += up(
-            self.parameters.case_height_base_removed
-        )(  # ) - (self.parameters.plate_thickness / 2)) (
-            right(0)(pcb_model)
-        )
+        # Set body dimensions
+        self.update_dimensions()
 
-        bottom_assembly = up(
-            self.parameters.case_height_base_removed
-            - (self.parameters.plate_thickness / 2)
-        )(
-            forward(self.parameters.real_max_y + self.parameters.bottom_margin)(
-                right(self.parameters.left_margin)(bottom_assembly)
-            )
-        )
+        # Init body object
+        self.body = Body(self.parameters)
+        self.body.preview = self.preview
 
-        if screw_hole_collection is not None:
-            screw_hole_collection = up(
-                self.parameters.case_height_base_removed
-                - (self.parameters.plate_thickness / 2)
-            )(
-                forward(self.parameters.real_max_y + self.parameters.bottom_margin)(
-                    right(self.parameters.left_margin)(screw_hole_collection)
+        # When building a single section only emit objects that overlap the material kept for the section.
+        # The top and bottom parts keep different x ranges so each gets its own clip range
+        section_outline = None
+        top_clip_x_range = (None, None)
+        bottom_clip_x_range = (None, None)
+        if self.desired_section_number > -1:
+            section_outline = self.get_top_section_outline(self.desired_section_number)
+
+            # Screw hole supports are needed to find where the bottom section is split
+            if self.parameters.screw_count > 0:
+                self.body.set_screw_hole_support_directions()
+
+            if build_top:
+                top_clip_x_range = self.get_section_clip_x_range(
+                    self.desired_section_number, section_outline, top=True
                 )
-            )
-            screw_hole_body_collection = up(
-                self.parameters.case_height_base_removed
-                - (self.parameters.plate_thickness / 2)
-            )(
-                forward(self.parameters.real_max_y + self.parameters.bottom_margin)(
-                    right(self.parameters.left_margin)(screw_hole_body_collection)
+            if build_bottom:
+                bottom_clip_x_range = self.get_section_clip_x_range(
+                    self.desired_section_number, section_outline, bottom=True
                 )
-            )
-            screw_hole_body_scaled_collection = up(
-                self.parameters.case_height_base_removed
-                - (self.parameters.plate_thickness / 2)
-            )(
-                forward(self.parameters.real_max_y + self.parameters.bottom_margin)(
-                    right(self.parameters.left_margin)(
-                        screw_hole_body_scaled_collection
+
+        if build_top:
+            # Rotated keys are not split into sections. Only add the rotated keys whose rotated bounds reach
+            # into the material kept for the section
+            (clip_min_x, clip_max_x) = top_clip_x_range
+            for rotation in self.switch_rotation_collection.get_rotation_list():
+                self.switch_cutouts += (
+                    self.switch_rotation_collection.get_rotated_moved_union(
+                        rotation, min_x=clip_min_x, max_x=clip_max_x
                     )
                 )
-            )
-
-        body_block = up(
-            self.parameters.case_height_base_removed
-            - (self.parameters.plate_thickness / 2)
-        )(
-            forward(self.parameters.real_max_y + self.parameters.bottom_margin)(
-                right(self.parameters.left_margin)(body_block)
-            )
-        )
-
-        if self.desired_section_number > -1:
-            bottom_section_inclusion = up(
-                self.parameters.case_height_base_removed
-                - (self.parameters.plate_thickness / 2)
-            )(
-                forward(self.parameters.real_max_y + self.parameters.bottom_margin)(
-                    right(self.parameters.left_margin)(bottom_section_inclusion)
+                self.switch_supports += (
+                    self.support_rotation_collection.get_rotated_moved_union(
+                        rotation, min_x=clip_min_x, max_x=clip_max_x
+                    )
+                )
+                self.switch_support_cutouts += (
+                    self.support_cutout_rotation_collection.get_rotated_moved_union(
+                        rotation, min_x=clip_min_x, max_x=clip_max_x
+                    )
                 )
-            )
 
         # Create block that will remove material to make case bottom flat
         bottom_diff_plate_width = (
@@ -432,10 +492,8 @@ class Keyboard:
             )
         )
 
-        # Remove space for a cable to pass through the body
-        top_assembly -= self.cable.get_cable_hole()
-
         # Interesect objects with a test block to handle testing specific parts of a model
+        test_block = None
         if self.parameters.test_block:
             test_block_x = (
                 self.parameters.test_block_x_end - self.parameters.test_block_x_start
@@ -462,34 +520,178 @@ class Keyboard:
                 ]
             )(cube([test_block_x, test_block_y, test_block_z]))
 
-            top_assembly *= test_block
-            bottom_assembly *= test_block
-            screw_hole_collection *= test_block
-            screw_hole_body_collection *= test_block
-            screw_hole_body_scaled_collection *= test_block
-            body_block *= test_block
+        def finish(solid_object):
+            # Apply the test block and tilt that every part of the case shares
+            if test_block is not None:
+                solid_object *= test_block
+            if self.parameters.tilt > 0.0:
+                solid_object = rotate(self.parameters.tilt, [1, 0, 0])(solid_object)
+            return solid_object
+
+        assembly_dict = {}
+
+        if build_top:
+            assembly_dict.update(
+                self.get_top_assembly_dict(
+                    part_name_list,
+                    top_clip_x_range,
+                    section_outline,
+                    bottom_diff_plate,
+                    test_block,
+                    finish,
+                )
+            )
+
+        if build_bottom:
+            assembly_dict["bottom"] = self.get_bottom_assembly(
+                bottom_clip_x_range, bottom_diff_plate, finish
+            )
+
+        if "all" in part_name_list:
+            assembly_dict["all"] = assembly_dict["top"] + assembly_dict["bottom"]
+
+        return {name: assembly_dict[name] for name in part_name_list}
 
-        # Remove thw custom cutouts before tilting
-        top_assembly -= self.custom_polygon_cutout_collection
+    def get_top_assembly_dict(
+        self,
+        part_name_list,
+        clip_x_range,
+        section_outline,
+        bottom_diff_plate,
+        test_block,
+        finish,
+    ):
+        (clip_min_x, clip_max_x) = clip_x_range
+        self.body.set_clip_x_range(clip_min_x, clip_max_x)
+
+        custom_polygon_layer = self.get_custom_polygon_layer(clip_min_x, clip_max_x)
+
+        # Init PCB object
+        # if self.parameters.custom_pcb == True:
+        self.pcb = PCB(self.parameters)
+        pcb_model = self.pcb.get_model()
+
+        # Generate screw hole related objects. The same holes are used for the top and the plate
+        screw_hole_collection = None
+        screw_hole_body_scaled_collection = None
+        if self.parameters.screw_count > 0:
+            (
+                screw_hole_collection,
+                _,
+                screw_hole_body_scaled_collection,
+            ) = self.body.screw_hole_objects(tap=False)
+
+        if screw_hole_body_scaled_collection is not None:
+            screw_hole_body_scaled_collection = finish(
+                self.move_to_case_origin(screw_hole_body_scaled_collection)
+            )
+
+        section_remove_block = None
+        if self.desired_section_number > -1:
+            section_remove_block = self.get_top_section_remove_block(
+                self.desired_section_number, section_outline
+            )
+
+            # A section that covers the whole board has nothing to remove
+            if len(section_remove_block.children) == 0:
+                section_remove_block = None
+
+        top_assembly_dict = {}
+        for part_name in ["top", "plate"]:
+            # The all part is made from the top part
+            if part_name not in part_name_list and not (
+                part_name == "top" and "all" in part_name_list
+            ):
+                continue
+
+            # Add case to top_assembly
+            top_assembly = self.body.case(plate_only=part_name == "plate")
+
+            if not self.parameters.simple_test:
+                # Previews do not have switch supports
+                if not self.preview:
+                    # Remove switch suport cutouts
+                    top_assembly -= self.switch_support_cutouts
+
+                    # Add switch supports
+                    top_assembly += self.switch_supports
+
+                # Remove switch cutouts
+                top_assembly -= self.switch_cutouts
 
-        # Tile the body if desired
-        if self.parameters.tilt > 0.0:
-            top_assembly = rotate(self.parameters.tilt, [1, 0, 0])(top_assembly)
-            bottom_assembly = rotate(self.parameters.tilt, [1, 0, 0])(bottom_assembly)
             if screw_hole_collection is not None:
-                screw_hole_collection = rotate(self.parameters.tilt, [1, 0, 0])(
-                    screw_hole_collection
-                )
-                screw_hole_body_collection = rotate(self.parameters.tilt, [1, 0, 0])(
-                    screw_hole_body_collection
+                # Remove screw holes from top top_assembly
+                top_assembly -= screw_hole_collection
+
+            # Remove items marked as not part of desired section
+            if section_remove_block is not None:
+                top_assembly -= section_remove_block
+
+            # Move top_assembly so that the bottom left sits at 0, 0, 0
+            top_assembly = self.move_to_case_origin(top_assembly)
+
+            if self.pcb.custom_pcb:
+                top_assembly += up(
+                    self.parameters.case_height_base_removed
+                )(  # ) - (self.parameters.plate_thickness / 2)) (
+                    right(0)(pcb_model)
                 )
-                screw_hole_body_scaled_collection = rotate(
-                    self.parameters.tilt, [1, 0, 0]
-                )(screw_hole_body_scaled_collection)
-            body_block = rotate(self.parameters.tilt, [1, 0, 0])(body_block)
+
+            # Remove space for a cable to pass through the body
+            if self.parameters.cable_hole:
+                top_assembly -= self.cable.get_cable_hole()
+
+            if test_block is not None:
+                top_assembly *= test_block
+
+            # Remove thw custom cutouts before tilting
+            if custom_polygon_layer is not None:
+                top_assembly -= custom_polygon_layer
+
+            # Tile the body if desired
+            if self.parameters.tilt > 0.0:
+                top_assembly = rotate(self.parameters.tilt, [1, 0, 0])(top_assembly)
+
+            # Remove bottom block to make bottom of case flat
+            top_assembly -= bottom_diff_plate
+
+            if screw_hole_body_scaled_collection is not None:
+                top_assembly -= screw_hole_body_scaled_collection
+
+            top_assembly_dict[part_name] = top_assembly
+
+        return top_assembly_dict
+
+    def get_bottom_assembly(self, clip_x_range, bottom_diff_plate, finish):
+        (clip_min_x, clip_max_x) = clip_x_range
+        self.body.set_clip_x_range(clip_min_x, clip_max_x)
+
+        bottom_assembly = union()
+
+        # Generate screw hole related objects. The bottom uses tapped holes
+        screw_hole_collection = None
+        if self.parameters.screw_count > 0:
+            (
+                screw_hole_collection,
+                screw_hole_body_collection,
+                _,
+            ) = self.body.screw_hole_objects(tap=True)
+
+        if screw_hole_collection is not None:
+            bottom_assembly = screw_hole_body_collection
+            bottom_assembly -= screw_hole_collection
+
+            screw_hole_collection = finish(
+                self.move_to_case_origin(screw_hole_collection)
+            )
+
+        body_block = finish(
+            self.move_to_case_origin(self.body.case(body_block_only=True))
+        )
+
+        bottom_assembly = finish(self.move_to_case_origin(bottom_assembly))
 
         # Remove bottom block to make bottom of case flat
-        top_assembly -= bottom_diff_plate
         bottom_assembly -= down(self.parameters.bottom_cover_thickness)(
             bottom_diff_plate
         )
@@ -497,49 +699,19 @@ class Keyboard:
         # bottom_assembly += self.body.bottom_cover()
         # bottom_assembly += body_block
         bottom_assembly += self.body.bottom_cover() * body_block
+
+        # Remove items marked as not part of desired section
         if self.desired_section_number > -1:
+            # TODO
+            bottom_section_inclusion = self.move_to_case_origin(
+                self.get_bottom_section_remove_block(self.desired_section_number)
+            )
             bottom_assembly *= bottom_section_inclusion
 
         if screw_hole_collection is not None:
             bottom_assembly -= screw_hole_collection
 
-        # # TEST ####
-        # # Union together all rotated supports
-        # rotation = list(self.support_rotation_collection.get_rotation_list())[0]
-        # # top_assembly = self.support_rotation_collection.get_union(rotation)
-        # # top_assembly -= self.switch_rotation_collection.get_union(rotation)
-        # rx_list = list(self.support_rotation_collection.get_rx_list(rotation))
-        # # self.logger.debug('rotation %f, rx_list: %s', rotation, str(rx_list))
-        # ry_list = list(self.support_rotation_collection.get_ry_list_in_rx(rotation, rx_list[0]))
-        # rx = rx_list[0]
-        # ry = ry_list[0]
-        # self.logger.debug('rotation %f, rx_list: %s, ry_list: %s', rotation, str(rx_list), str(ry_list))
-        # top_assembly = self.support_rotation_collection.get_rotated_union(rotation)
-        # top_assembly -= self.switch_rotation_collection.get_rotated_union(rotation)
-        # rotation_max_x = self.switch_rotation_collection.get_max_x(rotation, rx, ry)
-        # (rotation_min_x, rotation_max_x, rotation_max_y, rotation_min_y) =
-        # self.switch_rotation_collection.get_real_collection_bounds()
-        # self.logger.debug('rotation %f, rotation_min_x: %f, rotation_max_x: %f,
-        # rotation_max_y: %f, rotation_min_y: %f', rotation, rotation_min_x,
-        # rotation_max_x, rotation_max_y, rotation_min_y)
-        # # top_assembly = self.support_rotation_collection.get_rotated_moved_union(rotation)
-        # # top_assembly -= self.switch_rotation_collection.get_rotated_moved_union(rotation)
-
-        # top_assembly = self.switch_rotation_collection.draw_rotated_items(rotation)
-
-        # return top_assembly
-        # ############
-
-        if top or plate_only:
-            if screw_hole_body_scaled_collection is not None:
-                return top_assembly - screw_hole_body_scaled_collection
-            else:
-                return top_assembly
-        elif bottom:
-            return bottom_assembly
-        else:
-            top_assembly += bottom_assembly
-            return top_assembly
+        return bottom_assembly
 
     # def get_cable_hole(self):
 
@@ -656,7 +828,21 @@ class Keyboard:
             # self.logger.debug('Set Item neighbors for section %d', idx)
             section.set_collection_neighbors()
 
-    def get_top_section_remove_block(self, section_number):
+        self.section_boundary_index = SectionBoundaryIndex(self.switch_section_list)
+
+    def get_top_section_remove_block(self, section_number, section_outline=None):
+
+        if section_outline is None:
+            section_outline = self.get_top_section_outline(section_number)
+
+        remove_block_height = self.parameters.case_height_base_removed * 4
+        remove_block_z_offset = remove_block_height / 2
+
+        return section_outline.get_solid(
+            remove_block_height, z_offset=remove_block_z_offset
+        )
+
+    def get_top_section_outline(self, section_number):
         # this_function_name = sys._getframe().f_code.co_name
 
         section = self.switch_section_list[section_number]
@@ -699,14 +885,18 @@ class Keyboard:
         #     if abs(min_y) < self.build_y:
         #         include_top_border = True
 
-        remove_block = union()
+        # Separator bars are collected as rectangles and merged into staircase outlines so the remove
+        # block is a single extrusion instead of a union of one cube per key
+        remove_block_outline = SectionOutline()
 
-        remove_block_height = self.parameters.case_height_base_removed * 4
-        remove_block_z_offset = remove_block_height / 2
         remove_block_length = self.parameters.real_max_x
 
-        # section_has_right_global_neighbor = section.has_global_right_neighbor_section()
-        section_has_left_global_neighbor = section.has_global_left_neighbor_section()
+        # section_has_right_global_neighbor = self.section_boundary_index.has_neighbor_section(
+        #     section_number, "right"
+        # )
+        section_has_left_global_neighbor = (
+            self.section_boundary_index.has_neighbor_section(section_number, "left")
+        )
 
         # Draw non border edges
         for rx in section.get_rx_list():
@@ -829,18 +1019,11 @@ class Keyboard:
                                 self.logger.debug("right_x_offset: %f", right_x_offset)
 
                             if not include_right_border:
-                                remove_block += down(remove_block_z_offset)(
-                                    right(right_x_offset)(
-                                        forward(y_offset)(
-                                            cube(
-                                                [
-                                                    remove_block_length,
-                                                    bar_height,
-                                                    remove_block_height,
-                                                ]
-                                            )
-                                        )
-                                    )
+                                remove_block_outline.add_bar(
+                                    right_x_offset,
+                                    y_offset,
+                                    remove_block_length,
+                                    bar_height,
                                 )
 
                         # If switch has no local left neighbor
@@ -878,18 +1061,11 @@ class Keyboard:
 
                             if not include_left_border:
                                 # self.logger.debug('4: switch %s, left_x_offset %f', str(item), left_x_offset)
-                                remove_block += down(remove_block_z_offset)(
-                                    right(left_x_offset)(
-                                        forward(y_offset)(
-                                            cube(
-                                                [
-                                                    remove_block_length,
-                                                    bar_height,
-                                                    remove_block_height,
-                                                ]
-                                            )
-                                        )
-                                    )
+                                remove_block_outline.add_bar(
+                                    left_x_offset,
+                                    y_offset,
+                                    remove_block_length,
+                                    bar_height,
                                 )
                                 # remove_block += down(self.support_bar_height * 3) ( right(left_x_offset)
                                 # ( forward(self.parameters.U(item.y - item.h) ) ( cube([self.support_bar_width / 2,
@@ -915,7 +1091,13 @@ class Keyboard:
                         # ( cube([self.support_bar_width / 2, self.parameters.U(item.h), self.support_bar_height * 10])
                         # ) ) )
 
-        return remove_block
+        self.logger.debug(
+            "Section %d remove block bars: %d",
+            section_number,
+            remove_block_outline.get_bar_count(),
+        )
+
+        return remove_block_outline
 
     def get_bottom_section_remove_block(self, section_number):
 
@@ -926,16 +1108,7 @@ class Keyboard:
         self.logger.debug("real_case_width: %f", self.parameters.real_case_width)
         self.logger.debug("real_case_height: %f", self.parameters.real_case_height)
 
-        section_size = (
-            self.parameters.real_case_width / self.parameters.bottom_section_count
-        )
-
-        self.logger.debug("section_size: %f", section_size)
-
-        start_x = section_size * section_number
-        end_x = start_x + section_size
-
-        (start_x, end_x) = self.get_screw_support_interference_offset(start_x, end_x)
+        (start_x, end_x) = self.get_bottom_section_x_range(section_number)
 
         x_offset = start_x - self.parameters.right_margin
         y_offset = (
@@ -959,18 +1132,98 @@ class Keyboard:
             back(y_offset)(down(z_offset)(cube([width, height, thickness])))
         )
 
+    def get_bottom_section_x_range(self, section_number):
+
+        section_size = (
+            self.parameters.real_case_width / self.parameters.bottom_section_count
+        )
+
+        self.logger.debug("section_size: %f", section_size)
+
+        start_x = section_size * section_number
+        end_x = start_x + section_size
+
+        return self.get_screw_support_interference_offset(start_x, end_x)
+
+    def get_section_clip_x_range(
+        self, section_number, section_outline, top=False, bottom=False, all=True
+    ):
+        """
+        Get the x range, in switch coordinates, of the material that is kept when building a section part.
+        Any generated object that does not overlap this range is removed by the section remove blocks so it
+        does not need to be emitted at all
+
+        Returns
+        -------
+        tuple
+            (min_x, max_x) with None for a side that should not be clipped
+        """
+
+        # Bounds of the whole case in switch coordinates
+        case_min_x = -self.parameters.left_margin
+        case_max_x = self.parameters.real_max_x + self.parameters.right_margin
+        case_max_y = self.parameters.top_margin
+        case_min_y = -(self.parameters.real_max_y + self.parameters.bottom_margin)
+
+        top_x_range = section_outline.get_uncovered_x_bounds(
+            case_min_x, case_max_x, case_min_y, case_max_y
+        )
+
+        # The bottom section inclusion block is offset by the right margin before being moved with the
+        # rest of the case
+        (bottom_start_x, bottom_end_x) = self.get_bottom_section_x_range(section_number)
+        bottom_x_range = (
+            bottom_start_x - self.parameters.right_margin,
+            bottom_end_x - self.parameters.right_margin,
+        )
+
+        if bottom:
+            x_range_list = [bottom_x_range]
+        elif top:
+            x_range_list = [top_x_range]
+        else:
+            x_range_list = [top_x_range, bottom_x_range]
+
+        x_range_list = [x_range for x_range in x_range_list if x_range is not None]
+
+        if len(x_range_list) == 0:
+            return (case_min_x, case_min_x)
+
+        min_x = min([x_range[0] for x_range in x_range_list])
+        max_x = max([x_range[1] for x_range in x_range_list])
+
+        # Leave the side unclipped if the kept material reaches the case edge
+        if min_x <= case_min_x:
+            min_x = None
+        else:
+            min_x -= self.section_clip_margin
+
+        if max_x >= case_max_x:
+            max_x = None
+        else:
+            max_x += self.section_clip_margin
+
+        self.logger.debug(
+            "Section %d clip range: min_x: %s, max_x: %s",
+            section_number,
+            str(min_x),
+            str(max_x),
+        )
+
+        return (min_x, max_x)
+
     def get_screw_support_interference_offset(self, start_x, end_x):
 
-        for coord_string in self.body.screw_hole_info.keys():
-            screw_hole_info = self.body.screw_hole_info[coord_string]
+        screw_hole_table = self.body.screw_hole_table
 
-            screw_x = screw_hole_info["x"]
-            # screw_y = screw_hole_info['y']
+        for row in range(screw_hole_table.get_count()):
+            screw_x = screw_hole_table.inset_x_list[row]
+            # screw_y = screw_hole_table.inset_y_list[row]
 
-            # self.logger.debug('coord_string: %s, screw_x: %f, screw_y: %f', coord_string, screw_x, screw_y)
+            # self.logger.debug('row: %d, screw_x: %f, screw_y: %f', row, screw_x, screw_y)
 
-            screw_hole_min_x = screw_x - screw_hole_info["support_directions"]["left"]
-            screw_hole_max_x = screw_x + screw_hole_info["support_directions"]["right"]
+            screw_hole_min_x = screw_x - screw_hole_table.get_support(row, "left")
+            screw_hole_max_x = screw_x + screw_hole_table.get_support(row, "right")
 
             # self.logger.debug('screw_hole_min_x: %f, screw_hole_max_x: %f', screw_hole_min_x, screw_hole_max_x)
 
@@ -1000,9 +1253,78 @@ class Keyboard:
 
         return (start_x, end_x)
 
+    def set_switch_config(self, switch_config):
+        """
+        Swap the switch cutouts for every switch to match switch_config. The layout, sections, supports
+        and case do not depend on the switch or stabilizer type so they are reused as is
+        """
+        self.switch_config = switch_config
+        self.switch_type = switch_config.switch_type
+        self.stabilizer_type = switch_config.stabilizer_type
+
+        # Section collections hold the same Switch objects so they are updated here as well
+        for switch in (
+            self.switch_collection.get_item_list()
+            + self.switch_rotation_collection.get_item_list()
+        ):
+            switch.set_switch_config(switch_config)
+
+    def set_preview(self, preview):
+        """
+        Switch between low detail preview geometry and full detail geometry. Previews use bounding box
+        switch cutouts, square case corners and no supports. The layout and sections are reused as is so
+        this must be called after process_keyboard_layout()
+        """
+        self.preview = preview
+
+        for switch in (
+            self.switch_collection.get_item_list()
+            + self.switch_rotation_collection.get_item_list()
+        ):
+            switch.set_preview(preview)
+
     def set_section(self, section_number):
         self.desired_section_number = section_number
 
+    def get_collection_call_counts(self):
+        """
+        Get the number of bounds and union queries made on every item collection of the keyboard so far
+        """
+        item_collection_list = (
+            [
+                self.switch_collection,
+                self.support_collection,
+                self.support_cutout_collection,
+                self.custom_polygon_collection,
+            ]
+            + self.switch_section_list
+            + self.support_section_list
+            + self.support_cutout_section_list
+        )
+        for rotation_collection in [
+            self.switch_rotation_collection,
+            self.support_rotation_collection,
+            self.support_cutout_rotation_collection,
+        ]:
+            item_collection_list += list(
+                rotation_collection.get_collection_dict().values()
+            )
+
+        return {
+            "get_collection_bounds": sum(
+                [
+                    item_collection.get_collection_bounds_call_count
+                    for item_collection in item_collection_list
+                ]
+            ),
+            "get_moved_union": sum(
+                [
+                    item_collection.get_moved_union_call_count
+                    for item_collection in item_collection_list
+                ]
+            ),
+        }
+
     def get_top_section_count(self):
         return len(self.switch_section_list)
 
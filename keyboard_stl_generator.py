@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 
 import argparse
-from asyncio import subprocess
+import asyncio
 import json
+import sys
 
 from file_io import config_logger, load_keyboard_layout, make_output_folder
 
@@ -11,14 +12,18 @@ from pathlib import Path
 import logging
 
 # import time
-from solid import union
-
-from solid.utils import right, up
 
 
 from parameters import Parameters
 from keyboard import Keyboard
 from cable import Cable
+from geometry_metrics import GeometryMetrics
+from layout_checker import LayoutChecker
+from mirror_symmetry import MirrorSymmetry
+from module_call import ModuleCall, get_module_definition
+from render_pool import RenderPool
+from stl_post_process import StlPostProcessor
+from three_mf_writer import ThreeMfWriter
 from solid import scad_render_to_file
 
 # Set logger level variables
@@ -26,7 +31,23 @@ console_logging_level = logging.WARN
 file_logging_level = logging.DEBUG
 
 
-logger = config_logger(console_logging_level, file_logging_level)
+logger = logging.getLogger().getChild(__name__)
+
+# Parts that do not include any switch cutouts and are the same for every switch and stabilizer type
+SHARED_PART_NAME_LIST = ["bottom"]
+
+# Parts that the all part is made from
+ALL_PART_INCLUDE_LIST = ["top", "bottom"]
+
+# Parts packaged into the 3MF file. The plate and all parts repeat the geometry of the top and bottom and
+# the cable holder all part repeats the main and clamp parts
+PRINT_PART_NAME_LIST = ["top", "bottom", "cable_holder_main", "cable_holder_clamp"]
+
+# Curve fragments used for preview files
+PREVIEW_FRAGMENTS = 4
+
+# Offset in mm between neighboring sections in the exploded view
+EXPLODED_SECTION_OFFSET = [10, 0, 5]
 
 
 # Helper for parser to wnsure filename argument has to correct extension
@@ -45,7 +66,7 @@ def CheckExt(choices):
     return Act
 
 
-def main():
+def build_parser():
 
     parser = argparse.ArgumentParser(
         description="Build custom keyboard SCAD file using keyboard layout editor format"
@@ -95,6 +116,14 @@ def main():
         default=False,
         action="store_true",
     )
+    parser.add_argument(
+        "--mirror-sections",
+        help="With -a or -e, build and render only one half of a board whose left and right halves are mirror "
+        "images. The sections of the other half are written as SCAD files that mirror the first half and "
+        "their STL files are made by mirroring the rendered meshes",
+        default=False,
+        action="store_true",
+    )
     parser.add_argument(
         "-f",
         "--fragments",
@@ -103,6 +132,14 @@ def main():
         type=int,
         default=8,
     )
+    parser.add_argument(
+        "--preview",
+        help="Generate low detail files for fast previews. Switch cutouts are boxes, case corners are square, "
+        "supports are left out and curves use %d fragments. Files get a _preview postfix so they do not "
+        "replace full detail files" % (PREVIEW_FRAGMENTS),
+        default=False,
+        action="store_true",
+    )
     parser.add_argument(
         "-r",
         "--render",
@@ -110,160 +147,393 @@ def main():
         default=False,
         action="store_true",
     )
+    parser.add_argument(
+        "--render-concurrency",
+        metavar="num_renders",
+        help="The maximum number of OpenSCAD renders to run at once. Defaults to the CPU count",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--progress-file",
+        metavar="progress.jsonl",
+        help="Write render progress events as JSON lines to this file. Use - for stdout",
+        default=None,
+    )
+    parser.add_argument(
+        "--cache-sections",
+        help="With -r, render the section parts through the render cache of the output folder so a section "
+        "part with the same SCAD file as an earlier render reuses its mesh instead of running OpenSCAD again",
+        default=False,
+        action="store_true",
+    )
     parser.add_argument(
         "--switch-type-in-filename",
         help="Add the switch type name and stabilizer type name to the filname",
         default=False,
         action="store_true",
     )
-
-    # Parse command line arguments
-    args = parser.parse_args()
-    logger.debug(vars(args))
-
-    # Create Path object from input file argument
-    input_file_path = Path(args.input_file)
-    layout_name = input_file_path.stem
-    scad_folder_path, stl_folder_path = make_output_folder(
-        args.output_folder, layout_name
+    parser.add_argument(
+        "--variant-matrix",
+        help="Build every switch type and stabilizer type combination. Parts that do not depend on the "
+        "switch type are only built once",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--switch-types",
+        metavar="switch_type",
+        help="The switch types to build with --variant-matrix. Defaults to all switch types",
+        nargs="+",
+        default=None,
+    )
+    parser.add_argument(
+        "--stabilizer-types",
+        metavar="stabilizer_type",
+        help="The stabilizer types to build with --variant-matrix. Defaults to all stabilizer types",
+        nargs="+",
+        default=None,
+    )
+    parser.add_argument(
+        "--check",
+        help="Check the layout and parameters for overlapping keys, screw hole collisions, custom polygons "
+        "outside the plate, PCB size problems and unsupported stabilizer sizes instead of generating SCAD "
+        "files. Exits with an error if any are found",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--estimate",
+        help="Print an estimate of the volume, mass and filament length of each part and section as JSON "
+        "instead of generating SCAD files",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--filament-density",
+        metavar="g_per_cm3",
+        help="The filament density used by --estimate. Defaults to 1.24 for PLA",
+        type=float,
+        default=1.24,
+    )
+    parser.add_argument(
+        "--filament-diameter",
+        metavar="mm",
+        help="The filament diameter used by --estimate",
+        type=float,
+        default=1.75,
+    )
+    parser.add_argument(
+        "--binary-stl",
+        help="Convert the rendered STL files to binary STL files. Requires -r",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--merge-vertices",
+        metavar="mm",
+        help="Snap the vertices of the rendered STL files to a grid of this size so duplicate vertices are "
+        "merged and collapsed facets are removed. Requires -r",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--stl-info",
+        help="Write a JSON file next to each rendered STL file with the facet count, bounding box and "
+        "volume of the mesh. Requires -r",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stl-vertex-count",
+        help="Add the unique vertex count to the --stl-info JSON file. Holds every unique vertex of the mesh "
+        "in memory. Requires --stl-info",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--gzip",
+        help="Write a gzip compressed copy of each rendered STL file. Requires -r",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--3mf",
+        dest="three_mf",
+        help="Package the rendered top and bottom parts and the cable holder main and clamp parts into a "
+        "single 3MF file with the parts of each section placed on their own build plates. Requires -r",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--bed-size",
+        metavar="mm",
+        help="The x and y size of the build plate used to place parts with --3mf",
+        nargs=2,
+        type=float,
+        default=[220.0, 220.0],
     )
-    logger.debug("scad_folder_path: %s", scad_folder_path)
-    logger.debug("stl_folder_path: %s", stl_folder_path)
 
-    # define output file extensions
-    scad_postfix = ".scad"
-    stl_postfix = ".stl"
+    return parser
 
-    # Open JSON layout file
-    logger.debug("Open layout file %s", input_file_path)
-    keyboard_layout_dict = load_keyboard_layout(input_file_path)
-    logger.debug("keyboard_layout_dict: %s", str(keyboard_layout_dict))
 
-    # Read parameter file
-    parameter_dict = {}
-    if args.parameter_file is not None:
-        with open(args.parameter_file) as f:
-            parameter_dict = json.load(f)
-    # Set parameters from imput file
-    parameters = Parameters(parameter_dict)
+def iter_solid_object_dict(
+    keyboard: Keyboard,
+    parameters: Parameters,
+    all_sections=False,
+    exploded=False,
+    section=-1,
+    shared_parts=True,
+    mirror_section_dict=None,
+):
+    """
+    Generate the SolidPython solid objects that need to be rendered to SCAD and to STL if desired
 
-    # Create Keyboard instance
-    keyboard = Keyboard(parameters)
+    Yields a dictionary with a single section key as soon as the parts for that section are built so
+    they can be written and rendered while the following sections are being generated. If shared_parts
+    is False the parts that do not depend on the switch type are skipped. The parts of the sections in
+    mirror_section_dict are not built since they are mirrored from another section
+    """
 
-    # Process the keyboard layout object
-    keyboard.process_keyboard_layout(keyboard_layout_dict)
-    keyboard.process_custom_shapes()
+    if mirror_section_dict is None:
+        mirror_section_dict = {}
 
-    logger.debug("kerf: %f", keyboard.kerf)
+    def get_section_part_name_list(section):
+        # Add top assembly, all assembly and plate to section dict
+        part_name_list = ["top", "all", "plate"]
 
-    # Dictionary of SolidPython solid objects that need to be rendered to SCAD and to STL if desired
-    solid_object_dict = {}
+        # If there is a bottom section for the current section add it to section dict
+        if shared_parts and section < keyboard.get_bottom_section_count():
+            part_name_list.append("bottom")
+
+        return part_name_list
 
-    # Create objects for each of the generated sections
-    if args.all_sections:
-        # Iterate over all sections generated and add all sections to solid_object_dict
+    # Create objects for each of the generated sections. The exploded view reuses the section files
+    if all_sections or exploded:
+        # Iterate over all sections generated and yield each section as it is built
         for section in range(keyboard.get_top_section_count()):
+            # Mirrored sections are written as files that mirror the parts of their source section
+            if section in mirror_section_dict.keys():
+                yield {
+                    section: {
+                        part_name: None
+                        for part_name in get_section_part_name_list(section)
+                    }
+                }
+                continue
+
             # Set current section for generator
             keyboard.set_section(section)
 
-            # Create dict for section
-            solid_object_dict[section] = {}
+            # Build every part for the section from one evaluation
+            yield {
+                section: keyboard.get_assembly_dict(get_section_part_name_list(section))
+            }
 
-            # Add top assembly, plate, and all assembly to section dict
-            solid_object_dict[section]["top"] = keyboard.get_assembly(top=True)
-            solid_object_dict[section]["all"] = keyboard.get_assembly(all=True)
-            solid_object_dict[section]["plate"] = keyboard.get_assembly(plate_only=True)
+        # The exploded parts are wrapper files that place the section modules, so there is no geometry
+        # to build for them
+        if exploded:
+            part_name_list = ["top", "plate"]
+            if shared_parts:
+                part_name_list.append("bottom")
 
-            # If there is a bottom section for the current section add it to section dict
-            if section < keyboard.get_bottom_section_count():
-                solid_object_dict[section]["bottom"] = keyboard.get_assembly(
-                    bottom=True
-                )
-
-    # Create exploded object
-    elif args.exploded:
-        solid_object_dict[-1] = {}
-        solid_object_dict[-1]["top"] = union()
-        solid_object_dict[-1]["plate"] = union()
-        solid_object_dict[-1]["bottom"] = union()
-        for section in range(keyboard.get_top_section_count()):
-            keyboard.set_section(section)
-            solid_object_dict[-1]["top"] += up(5 * section)(
-                right(10 * section)(keyboard.get_assembly(top=True))
-            )
-            solid_object_dict[-1]["plate"] += up(5 * section)(
-                right(10 * section)(keyboard.get_assembly(plate_only=True))
-            )
-            if section < keyboard.get_bottom_section_count():
-                solid_object_dict[-1]["bottom"] += up(5 * section)(
-                    right(10 * section)(keyboard.get_assembly(bottom=True))
-                )
+            yield {"exploded": {part_name: None for part_name in part_name_list}}
 
     # Create objects for a specified section
-    elif args.section > -1:
+    elif section > -1:
         # Set desired section to create
-        keyboard.set_section(args.section)
+        keyboard.set_section(section)
 
-        # Create dict for section
-        solid_object_dict[args.section] = {}
-
-        # Add top assembly, plate, and all assembly to section dict
-        solid_object_dict[args.section]["top"] = keyboard.get_assembly(top=True)
-        solid_object_dict[args.section]["all"] = keyboard.get_assembly(all=True)
-        solid_object_dict[args.section]["plate"] = keyboard.get_assembly(
-            plate_only=True
-        )
-
-        # If there is a bottom section for the current section add it to section dict
-        if args.section < keyboard.get_bottom_section_count():
-            solid_object_dict[args.section]["bottom"] = keyboard.get_assembly(
-                bottom=True
-            )
+        # Build every part for the section from one evaluation
+        yield {section: keyboard.get_assembly_dict(get_section_part_name_list(section))}
 
     # Create an objects that are not split into sections. No other options were specified
     else:
         logger.debug("Create whole object. No other options specified")
-        solid_object_dict["all"] = {}
-        solid_object_dict["all"]["top"] = keyboard.get_assembly(top=True)
-        solid_object_dict["all"]["bottom"] = keyboard.get_assembly(bottom=True)
-        solid_object_dict["all"]["all"] = keyboard.get_assembly(all=True)
-        solid_object_dict["all"]["plate"] = keyboard.get_assembly(plate_only=True)
+        part_name_list = ["top", "bottom", "all", "plate"]
+        if not shared_parts:
+            part_name_list.remove("bottom")
+
+        yield {"all": keyboard.get_assembly_dict(part_name_list)}
+
+    if not shared_parts:
+        return
 
     # Add global items that are not dependant on the sctions or parts of the item to build
-    solid_object_dict["global"] = {}
+    global_dict = {}
 
     # Generate a strain relief piece for the cable hole
     if parameters.cable_hole:
         cable = Cable(parameters)
-        solid_object_dict["global"]["cable_holder_main"] = cable.holder_main()
-        solid_object_dict["global"]["cable_holder_clamp"] = cable.holder_clamp()
-        solid_object_dict["global"]["cable_holder_all"] = cable.holder_all()
+        global_dict["cable_holder_main"] = cable.holder_main()
+        global_dict["cable_holder_clamp"] = cable.holder_clamp()
+        global_dict["cable_holder_all"] = cable.holder_all()
 
-    print(parameters)
-    print(
-        "Case Height: %f, Case Width: %f\n"
-        % (parameters.real_case_height, parameters.real_case_width)
-    )
+    yield {"global": global_dict}
 
-    logger.info(
-        "Case Height: %f, Case Width: %f",
-        parameters.real_case_height,
-        parameters.real_case_width,
-    )
-    logger.info("Sections In Top: %d", keyboard.get_top_section_count())
-    logger.info("Sections In Bottom: %d", keyboard.get_bottom_section_count())
 
-    ############################################################
-    # Render SCAD and STL files
-    ############################################################
-    subprocess_dict = {}
+def build_solid_object_dict(
+    keyboard: Keyboard,
+    parameters: Parameters,
+    all_sections=False,
+    exploded=False,
+    section=-1,
+):
+
+    # Dictionary of SolidPython solid objects that need to be rendered to SCAD and to STL if desired
+    solid_object_dict = {}
+
+    for section_dict in iter_solid_object_dict(
+        keyboard,
+        parameters,
+        all_sections=all_sections,
+        exploded=exploded,
+        section=section,
+    ):
+        solid_object_dict.update(section_dict)
+
+    return solid_object_dict
+
+
+def get_variant_list(
+    parameters: Parameters, switch_type_list=None, stab_type_list=None
+):
+    """
+    Get the list of (switch_type, stabilizer_type) tuples to build. Types that are not passed in default
+    to every known type
+    """
+    switch_config = parameters.switch_config
+
+    if parameters.custom_shape:
+        # The custom shape replaces the switch cutout so only one switch variant exists
+        switch_type_list = [parameters.switch_type]
+    elif switch_type_list is None:
+        switch_type_list = [
+            switch_type
+            for switch_type in switch_config.switch_type_function_dict.keys()
+            if switch_type != "custom"
+        ]
+
+    if stab_type_list is None:
+        stab_type_list = list(switch_config.stab_type_function_dict.keys())
+
+    return [
+        (switch_type, stab_type)
+        for switch_type in switch_type_list
+        for stab_type in stab_type_list
+    ]
+
+
+def iter_variant_solid_object_dict(
+    keyboard: Keyboard,
+    parameters: Parameters,
+    variant_list,
+    all_sections=False,
+    exploded=False,
+    section=-1,
+    mirror_section_dict=None,
+):
+    """
+    Generate the solid objects for every switch and stabilizer variant in variant_list
+
+    The layout, sections, case and screw holes are only processed once. For each variant only the
+    switch cutouts are swapped. Parts that do not depend on the switch type are only built for the
+    first variant
+
+    Yields (section_dict, switch_type_in_filename) tuples. Shared parts are yielded with
+    switch_type_in_filename set to False so one copy is written and rendered for the whole matrix
+    """
+    for variant_index, (switch_type, stab_type) in enumerate(variant_list):
+        logger.info("Build variant switch: %s, stabilizer: %s", switch_type, stab_type)
+
+        parameters.set_switch_variant(switch_type, stab_type)
+        keyboard.set_switch_config(parameters.switch_config)
+
+        for section_dict in iter_solid_object_dict(
+            keyboard,
+            parameters,
+            all_sections=all_sections,
+            exploded=exploded,
+            section=section,
+            shared_parts=variant_index == 0,
+            mirror_section_dict=mirror_section_dict,
+        ):
+            shared_dict = {}
+            variant_dict = {}
+            for section_key, part_dict in section_dict.items():
+                for part_name, solid_object in part_dict.items():
+                    if section_key == "global" or part_name in SHARED_PART_NAME_LIST:
+                        shared_dict.setdefault(section_key, {})[
+                            part_name
+                        ] = solid_object
+                    else:
+                        variant_dict.setdefault(section_key, {})[
+                            part_name
+                        ] = solid_object
+
+            # Shared parts are written first so the all part of each variant can include them
+            if len(shared_dict) > 0:
+                yield (shared_dict, False)
+            if len(variant_dict) > 0:
+                yield (variant_dict, True)
+
+
+def get_section_module_name(section, part_name):
+    return "section_%d_%s" % (section, part_name)
+
+
+def write_scad_files(
+    solid_object_dict,
+    parameters: Parameters,
+    layout_name,
+    scad_folder_path: Path,
+    stl_folder_path: Path,
+    fragments=8,
+    switch_type_in_filename=False,
+    written_file_dict=None,
+    preview=False,
+    mirror_section_dict=None,
+    mirror_x=0.0,
+):
+    """
+    Render every object in solid_object_dict to a SCAD file
+
+    The all part is written as a file that includes the top and bottom files of the same section instead
+    of repeating their geometry. The parts of numbered sections are written as a module that the file
+    calls, so the parts of the exploded section are wrapper files that use the section files and place
+    the modules side by side. written_file_dict maps (section, part_name) to the SCAD file written for
+    it and can be shared between calls so parts written by an earlier call can be included. The parts of
+    the sections in mirror_section_dict use the file of the same part of their source section and mirror
+    its module across the plane x = mirror_x. Preview files get a _preview postfix
+
+    Returns
+    -------
+    list
+        List of (scad_file_name, stl_file_name) tuples for every SCAD file written
+    """
+
+    # define output file extensions
+    scad_postfix = ".scad"
+    stl_postfix = ".stl"
+
+    file_name_list = []
+
+    if written_file_dict is None:
+        written_file_dict = {}
+
+    if mirror_section_dict is None:
+        mirror_section_dict = {}
 
     switch_type_for_filename = ""
     stab_type_for_filename = ""
 
+    preview_postfix = ""
+    if preview:
+        preview_postfix = "_preview"
+
     for section in solid_object_dict.keys():
 
-        if args.switch_type_in_filename:
+        if switch_type_in_filename:
             switch_type_for_filename = "_" + parameters.switch_type
             stab_type_for_filename = "_" + parameters.stabilizer_type
 
@@ -278,10 +548,15 @@ def main():
         if isinstance(section, int) and section > -1:
             section_postfix = "_section_%d" % (section)
 
-        if args.exploded:
+        if isinstance(section, str) and section == "exploded":
             section_postfix = "_exploded"
 
-        for part_name in solid_object_dict[section].keys():
+        # Write the all part last so the files it includes already exist
+        part_name_list = sorted(
+            solid_object_dict[section].keys(), key=lambda name: name == "all"
+        )
+
+        for part_name in part_name_list:
             part_name_formatted = "_" + part_name
 
             scad_file_name = scad_folder_path / (
@@ -290,6 +565,7 @@ def main():
                 + part_name_formatted
                 + switch_type_for_filename
                 + stab_type_for_filename
+                + preview_postfix
                 + scad_postfix
             )
             stl_file_name = stl_folder_path / (
@@ -298,63 +574,429 @@ def main():
                 + part_name_formatted
                 + switch_type_for_filename
                 + stab_type_for_filename
+                + preview_postfix
                 + stl_postfix
             )
 
+            # The exploded view places the section modules of the part with an offset for each section
+            if isinstance(section, str) and section == "exploded":
+                section_file_list = []
+                for key, section_file_name in written_file_dict.items():
+                    (file_section, file_part_name) = key
+                    if isinstance(file_section, int) and file_section > -1:
+                        if file_part_name == part_name:
+                            section_file_list.append((file_section, section_file_name))
+                section_file_list.sort()
+
+                logger.info("Generate scad exploded file with name %s", scad_file_name)
+                # The section files are in the same folder so only the file name is used
+                with open(scad_file_name, "w") as f:
+                    f.write(f"$fn = {fragments};\n")
+                    for _, section_file_name in section_file_list:
+                        f.write("use <%s>\n" % (Path(section_file_name).name))
+                    for file_section, _ in section_file_list:
+                        module_name = get_section_module_name(file_section, part_name)
+                        offset = [
+                            value * file_section for value in EXPLODED_SECTION_OFFSET
+                        ]
+                        f.write("translate(%s) %s();\n" % (offset, module_name))
+                print("Generated scad file with name", scad_file_name)
+
+                file_name_list.append((scad_file_name, stl_file_name))
+                written_file_dict[(section, part_name)] = scad_file_name
+                continue
+
+            # Mirrored section parts wrap the module of the same part of the source section in a mirror
+            if section in mirror_section_dict.keys() and part_name != "all":
+                source_file_name = written_file_dict[
+                    (mirror_section_dict[section], part_name)
+                ]
+                source_module_name = get_section_module_name(
+                    mirror_section_dict[section], part_name
+                )
+                module_name = get_section_module_name(section, part_name)
+
+                logger.info("Generate scad mirror file with name %s", scad_file_name)
+                # The source file is in the same folder so only the file name is used
+                with open(scad_file_name, "w") as f:
+                    f.write(f"$fn = {fragments};\n")
+                    f.write("use <%s>\n" % (Path(source_file_name).name))
+                    f.write(
+                        "module %s() { translate([%s, 0, 0]) mirror([1, 0, 0]) %s(); }\n"
+                        % (module_name, mirror_x * 2, source_module_name)
+                    )
+                    f.write("%s();\n" % (module_name))
+                print("Generated scad file with name", scad_file_name)
+
+                file_name_list.append((scad_file_name, stl_file_name))
+                written_file_dict[(section, part_name)] = scad_file_name
+                continue
+
+            include_file_name_list = []
+            if part_name == "all":
+                include_file_name_list = [
+                    written_file_dict[(section, include_part_name)]
+                    for include_part_name in ALL_PART_INCLUDE_LIST
+                    if (section, include_part_name) in written_file_dict.keys()
+                ]
+
+            if len(include_file_name_list) > 0:
+                logger.info("Generate scad include file with name %s", scad_file_name)
+                # The included files are in the same folder so only the file name is used
+                with open(scad_file_name, "w") as f:
+                    f.write(f"$fn = {fragments};\n")
+                    for include_file_name in include_file_name_list:
+                        f.write("include <%s>\n" % (Path(include_file_name).name))
+                print("Generated scad file with name", scad_file_name)
+
+                file_name_list.append((scad_file_name, stl_file_name))
+
             # Set fragments to be used when creating curves
-            if solid_object_dict[section][part_name] is not None:
+            elif solid_object_dict[section][part_name] is not None:
                 logger.info("Generate scad file with name %s", scad_file_name)
+                solid_object = solid_object_dict[section][part_name]
+
+                # Section parts are wrapped in a module so the exploded view can use them
+                if isinstance(section, int) and section > -1:
+                    module_name = get_section_module_name(section, part_name)
+                    solid_object = ModuleCall(
+                        module_name, get_module_definition(module_name, solid_object)
+                    )
+
                 # Generate SCAD file from assembly
                 scad_render_to_file(
-                    solid_object_dict[section][part_name],
+                    solid_object,
                     scad_file_name,
-                    file_header=f"$fn = {args.fragments};",
+                    file_header=f"$fn = {fragments};",
                 )
                 print("Generated scad file with name", scad_file_name)
 
-                # Render STL if option is chosen
-                if args.render:
-                    logger.debug("Render STL from SCAD")
-                    logger.info(
-                        "Generate stl file with name %s from %s",
-                        stl_file_name,
-                        scad_file_name,
-                    )
+                file_name_list.append((scad_file_name, stl_file_name))
+
+            written_file_dict[(section, part_name)] = scad_file_name
+
+    return file_name_list
+
+
+async def generate_and_render(generate, render_pool: RenderPool, cache_file_set=None):
+    """
+    Run generate in a worker thread and submit every SCAD file to render_pool as soon as it is written.
+    SCAD files in cache_file_set are rendered through the render cache of render_pool. Files written with
+    a mirror source are not rendered. Their STL file is mirrored from the STL of the source file once it
+    is rendered
+
+    Returns
+    -------
+    int
+        The number of renders that failed
+    """
+    loop = asyncio.get_running_loop()
+    render_task_list = []
+    # STL file name -> task that writes it
+    render_task_dict = {}
+
+    def render_done(render_task):
+        if not render_task.cancelled() and render_task.exception() is None:
+            print("Render Complete: file:", render_task.result())
+
+    def submit(scad_file_name, stl_file_name, mirror_source=None):
+        if mirror_source is not None:
+            (source_stl_file_name, mirror_x) = mirror_source
+            render_task = render_pool.submit_mirror(
+                render_task_dict[source_stl_file_name],
+                scad_file_name,
+                stl_file_name,
+                mirror_x,
+            )
+        else:
+            cache = cache_file_set is not None and scad_file_name in cache_file_set
+            render_task = render_pool.submit(scad_file_name, stl_file_name, cache=cache)
+        render_task.add_done_callback(render_done)
+        render_task_list.append(render_task)
+        render_task_dict[stl_file_name] = render_task
+
+    def file_written(scad_file_name, stl_file_name, mirror_source=None):
+        # Called from the generation thread so the render is handed over to the event loop thread. The
+        # source of a mirrored file is always written first so its render task already exists
+        loop.call_soon_threadsafe(submit, scad_file_name, stl_file_name, mirror_source)
+
+    await loop.run_in_executor(None, generate, file_written)
+
+    # All submit callbacks are queued before the executor result so every render is in the list now
+    result_list = await asyncio.gather(*render_task_list, return_exceptions=True)
+
+    failed_count = 0
+    for result in result_list:
+        if isinstance(result, Exception):
+            logger.error(result)
+            failed_count += 1
+
+    return failed_count
+
+
+def main():
+
+    config_logger(console_logging_level, file_logging_level)
+
+    parser = build_parser()
+
+    # Parse command line arguments
+    args = parser.parse_args()
+    logger.debug(vars(args))
+
+    # Create Path object from input file argument
+    input_file_path = Path(args.input_file)
+    layout_name = input_file_path.stem
+    scad_folder_path, stl_folder_path = make_output_folder(
+        args.output_folder, layout_name
+    )
+    logger.debug("scad_folder_path: %s", scad_folder_path)
+    logger.debug("stl_folder_path: %s", stl_folder_path)
+
+    # Open JSON layout file
+    logger.debug("Open layout file %s", input_file_path)
+    keyboard_layout_dict = load_keyboard_layout(input_file_path)
+    logger.debug("keyboard_layout_dict: %s", str(keyboard_layout_dict))
+
+    # Read parameter file
+    parameter_dict = {}
+    if args.parameter_file is not None:
+        with open(args.parameter_file) as f:
+            parameter_dict = json.load(f)
+    # Set parameters from imput file
+    parameters = Parameters(parameter_dict)
+
+    # Create Keyboard instance
+    keyboard = Keyboard(parameters)
+
+    # Process the keyboard layout object
+    keyboard.process_keyboard_layout(keyboard_layout_dict)
+    keyboard.process_custom_shapes()
+
+    fragments = args.fragments
+    if args.preview:
+        keyboard.set_preview(True)
+        fragments = PREVIEW_FRAGMENTS
+
+    # Report layout problems without generating any SCAD files
+    if args.check:
+        violation_list = LayoutChecker(keyboard).get_violation_list()
+        for violation in violation_list:
+            print("ERROR:", LayoutChecker.format_violation(violation))
+
+        if len(violation_list) > 0:
+            logger.error("Layout check found %d problems", len(violation_list))
+            exit(1)
+
+        print("Layout check passed")
+        return
+
+    # Print the geometry estimate without generating any SCAD files
+    if args.estimate:
+        geometry_metrics = GeometryMetrics(
+            keyboard,
+            filament_density=args.filament_density,
+            filament_diameter=args.filament_diameter,
+        )
+        print(json.dumps(geometry_metrics.get_metrics(), indent=2))
+        return
+
+    logger.debug("kerf: %f", keyboard.kerf)
+
+    print(parameters)
+    print(
+        "Case Height: %f, Case Width: %f\n"
+        % (parameters.real_case_height, parameters.real_case_width)
+    )
+
+    logger.info(
+        "Case Height: %f, Case Width: %f",
+        parameters.real_case_height,
+        parameters.real_case_width,
+    )
+    logger.info("Sections In Top: %d", keyboard.get_top_section_count())
+    logger.info("Sections In Bottom: %d", keyboard.get_bottom_section_count())
+
+    # Sections that are mirror images of a section on the other half of the board
+    mirror_section_dict = {}
+    mirror_x = 0.0
+    if args.mirror_sections and (args.all_sections or args.exploded):
+        # Every variant has its own switch cutouts so each variant has to be symmetric
+        mirror_symmetry_list = []
+        if args.variant_matrix:
+            for switch_type, stab_type in get_variant_list(
+                parameters, args.switch_types, args.stabilizer_types
+            ):
+                parameters.set_switch_variant(switch_type, stab_type)
+                keyboard.set_switch_config(parameters.switch_config)
+                mirror_symmetry_list.append(MirrorSymmetry(keyboard))
+        else:
+            mirror_symmetry_list.append(MirrorSymmetry(keyboard))
+
+        asymmetry_list = []
+        for mirror_symmetry in mirror_symmetry_list:
+            asymmetry_list += [
+                asymmetry
+                for asymmetry in mirror_symmetry.asymmetry_list
+                if asymmetry not in asymmetry_list
+            ]
+
+        if len(asymmetry_list) > 0:
+            print(
+                "Layout is not mirror symmetric, all sections are built. Asymmetric: %s"
+                % (", ".join(asymmetry_list))
+            )
+        else:
+            mirror_section_dict = mirror_symmetry_list[0].get_mirror_section_dict()
+            mirror_x = mirror_symmetry_list[0].mirror_x
+
+        for section, source_section in sorted(mirror_section_dict.items()):
+            print("Section %d is mirrored from section %d" % (section, source_section))
 
-                    openscad_command_list = [
-                        "openscad",
-                        "-o",
-                        "%s" % (stl_file_name),
-                        "%s" % (scad_file_name),
+    ############################################################
+    # Render SCAD and STL files
+    ############################################################
+    # List of (stl_file_name, section) tuples for every part that is printed on its own
+    print_part_list = []
+    # SCAD files rendered through the render cache. Global parts that do not depend on the layout, like the
+    # cable holder, and the section parts with --cache-sections
+    cache_scad_file_set = set()
+
+    def generate(file_written_callback=None):
+        if args.variant_matrix:
+            section_dict_iter = iter_variant_solid_object_dict(
+                keyboard,
+                parameters,
+                get_variant_list(parameters, args.switch_types, args.stabilizer_types),
+                all_sections=args.all_sections,
+                exploded=args.exploded,
+                section=args.section,
+                mirror_section_dict=mirror_section_dict,
+            )
+        else:
+            section_dict_iter = (
+                (section_dict, args.switch_type_in_filename)
+                for section_dict in iter_solid_object_dict(
+                    keyboard,
+                    parameters,
+                    all_sections=args.all_sections,
+                    exploded=args.exploded,
+                    section=args.section,
+                    mirror_section_dict=mirror_section_dict,
+                )
+            )
+
+        written_file_dict = {}
+        # SCAD file name -> STL file name so mirrored parts can find the STL of their source part
+        stl_file_dict = {}
+
+        # Write the SCAD files for each section as soon as the section is built
+        for section_dict, switch_type_in_filename in section_dict_iter:
+            file_name_list = write_scad_files(
+                section_dict,
+                parameters,
+                layout_name,
+                scad_folder_path,
+                stl_folder_path,
+                fragments=fragments,
+                switch_type_in_filename=switch_type_in_filename,
+                written_file_dict=written_file_dict,
+                preview=args.preview,
+                mirror_section_dict=mirror_section_dict,
+                mirror_x=mirror_x,
+            )
+
+            # Remember the section of every printable part so the 3MF file can group them by section. The
+            # exploded parts repeat the geometry of the section parts
+            scad_part_dict = {
+                scad_file_name: key for key, scad_file_name in written_file_dict.items()
+            }
+            for scad_file_name, stl_file_name in file_name_list:
+                (section, part_name) = scad_part_dict[scad_file_name]
+                if part_name in PRINT_PART_NAME_LIST and section != "exploded":
+                    print_part_list.append((stl_file_name, section))
+                if section == "global" or (
+                    args.cache_sections and isinstance(section, int) and section > -1
+                ):
+                    cache_scad_file_set.add(scad_file_name)
+
+                stl_file_dict[scad_file_name] = stl_file_name
+                mirror_source = None
+                if section in mirror_section_dict.keys():
+                    source_scad_file_name = written_file_dict[
+                        (mirror_section_dict[section], part_name)
                     ]
-                    subprocess_dict[stl_file_name] = subprocess.Popen(
-                        openscad_command_list
-                    )
+                    mirror_source = (stl_file_dict[source_scad_file_name], mirror_x)
 
-    ################################################################
-    #  Wait for render processes to complete
-    ################################################################
+                if file_written_callback is not None:
+                    file_written_callback(scad_file_name, stl_file_name, mirror_source)
+
+    # Render STL if option is chosen
     if args.render:
-        logger.debug(subprocess_dict)
-        running = True
-        while running:
-            running = False
-            for stl_file_name in subprocess_dict.keys():
-                p = subprocess_dict[stl_file_name]
-                if p is not None:
-                    # running = True
-                    rcode = None
-                    try:
-                        rcode = p.wait(0.1)
-                    except subprocess.TimeoutExpired as err:
-                        logger.error(err)
-                        running = True
-                    if rcode is not None:
-                        logger.info("Render Complete: file: %s", stl_file_name)
-                        print("Render Complete: file:", stl_file_name)
-                        subprocess_dict[stl_file_name] = None
-            # time.sleep(1)
+        event_stream = None
+        if args.progress_file == "-":
+            event_stream = sys.stdout
+        elif args.progress_file is not None:
+            event_stream = open(args.progress_file, "w")
+
+        # Only post process the rendered STL files if any of the post processing options are set
+        post_processor = None
+        if (
+            args.binary_stl
+            or args.merge_vertices is not None
+            or args.stl_info
+            or args.gzip
+        ):
+            post_processor = StlPostProcessor(
+                binary=args.binary_stl,
+                merge_tolerance=args.merge_vertices,
+                info=args.stl_info,
+                compress="gzip" if args.gzip else None,
+                vertex_count=args.stl_vertex_count,
+            )
+
+        try:
+            # Global parts are rendered once into a cache that every layout in the output folder shares
+            render_pool = RenderPool(
+                concurrency=args.render_concurrency,
+                event_stream=event_stream,
+                post_processor=post_processor,
+                render_cache_path=Path(args.output_folder) / "render_cache",
+            )
+            failed_count = asyncio.run(
+                generate_and_render(
+                    generate, render_pool, cache_file_set=cache_scad_file_set
+                )
+            )
+        finally:
+            if event_stream is not None and event_stream is not sys.stdout:
+                event_stream.close()
+
+        if failed_count > 0:
+            logger.error("%d renders failed", failed_count)
+            print("%d renders failed" % (failed_count))
+            exit(1)
+
+        # Package the printable parts once every render is done
+        if args.three_mf:
+            preview_postfix = "_preview" if args.preview else ""
+            three_mf_file_name = stl_folder_path / (
+                layout_name + preview_postfix + ".3mf"
+            )
+            three_mf_writer = ThreeMfWriter(bed_size=args.bed_size)
+            for stl_file_name, section in print_part_list:
+                three_mf_writer.add_stl(stl_file_name, group=section)
+            part_info_list = three_mf_writer.write(three_mf_file_name)
+
+            plate_count = len(set([part_info["plate"] for part_info in part_info_list]))
+            print(
+                "Generated 3mf file with name %s: %d parts on %d plates"
+                % (three_mf_file_name, len(part_info_list), plate_count)
+            )
+    else:
+        generate()
 
+    logger.info("Item collection queries: %s", keyboard.get_collection_call_counts())
     logger.info("Generation Complete")
 
 
@@ -0,0 +1,538 @@
+import logging
+import math
+
+from body import Body
+from geometry_metrics import GeometryMetrics
+from keyboard import Keyboard
+
+
+class LayoutChecker:
+    """
+    Finds layout and parameter problems that would otherwise only show up after rendering. Keys, switch
+    cutouts, screw holes, custom polygons and the PCB are tested with plain polygon math so a full check
+    takes milliseconds
+
+    Keys and cutouts are placed in a grid of switch_spacing sized cells so only items that share a cell are
+    compared
+
+    ...
+
+    Attributes
+    ----------
+    keyboard : Keyboard
+        The keyboard to check. process_keyboard_layout() and process_custom_shapes() must already have been
+        called
+
+    Methods
+    -------
+    get_violation_list()
+        Run every check and get a list of the violations that were found
+    format_violation(violation)
+        Get a one line description of a violation
+    """
+
+    # Distance in mm or area in mm^2 that shapes can overlap before it counts as a collision
+    TOLERANCE = 0.001
+
+    def __init__(self, keyboard: Keyboard):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.keyboard = keyboard
+        self.parameters = keyboard.parameters
+
+        # Offset from switch coordinates to case coordinates
+        self.case_offset_x = self.parameters.left_margin
+        self.case_offset_y = self.parameters.real_max_y + self.parameters.bottom_margin
+
+        self.key_info_list = self.get_key_info_list()
+
+    @staticmethod
+    def get_bounds(point_list):
+        x_list = [x for x, _ in point_list]
+        y_list = [y for _, y in point_list]
+
+        return (min(x_list), min(y_list), max(x_list), max(y_list))
+
+    @staticmethod
+    def bounds_overlap(bounds_a, bounds_b, tolerance=0.0):
+        return (
+            bounds_a[0] < bounds_b[2] - tolerance
+            and bounds_b[0] < bounds_a[2] - tolerance
+            and bounds_a[1] < bounds_b[3] - tolerance
+            and bounds_b[1] < bounds_a[3] - tolerance
+        )
+
+    @staticmethod
+    def point_in_polygon(x, y, point_list):
+        inside = False
+        for (x1, y1), (x2, y2) in zip(point_list, point_list[1:] + point_list[:1]):
+            if (y1 > y) != (y2 > y):
+                if x < x1 + ((y - y1) * (x2 - x1) / (y2 - y1)):
+                    inside = not inside
+
+        return inside
+
+    @staticmethod
+    def polygons_overlap(polygon_a, polygon_b):
+        # Shapes that only touch along an edge have no shared area so they do not collide
+        shared_area = (
+            GeometryMetrics.get_polygon_area(polygon_a)
+            + GeometryMetrics.get_polygon_area(polygon_b)
+            - GeometryMetrics.get_union_area([polygon_a, polygon_b])
+        )
+
+        return shared_area > LayoutChecker.TOLERANCE
+
+    @staticmethod
+    def circle_overlaps_polygon(center_x, center_y, radius, point_list):
+        if LayoutChecker.point_in_polygon(center_x, center_y, point_list):
+            return True
+
+        for (x1, y1), (x2, y2) in zip(point_list, point_list[1:] + point_list[:1]):
+            # Distance from the center to the closest point on the edge
+            dx = x2 - x1
+            dy = y2 - y1
+            length_squared = (dx * dx) + (dy * dy)
+            t = 0.0
+            if length_squared > 0:
+                t = max(
+                    0.0,
+                    min(
+                        1.0,
+                        (((center_x - x1) * dx) + ((center_y - y1) * dy))
+                        / length_squared,
+                    ),
+                )
+            distance = math.hypot(
+                center_x - (x1 + (t * dx)), center_y - (y1 + (t * dy))
+            )
+            if distance < radius - LayoutChecker.TOLERANCE:
+                return True
+
+        return False
+
+    def get_grid_cell_list(self, bounds):
+        cell_size = self.parameters.switch_spacing
+
+        return [
+            (cell_x, cell_y)
+            for cell_x in range(
+                math.floor(bounds[0] / cell_size), math.floor(bounds[2] / cell_size) + 1
+            )
+            for cell_y in range(
+                math.floor(bounds[1] / cell_size), math.floor(bounds[3] / cell_size) + 1
+            )
+        ]
+
+    def get_candidate_pair_list(self, bounds_list):
+        # Grid cell -> indexes of the items whose bounds touch the cell
+        grid_dict = {}
+        for index, bounds in enumerate(bounds_list):
+            for grid_cell in self.get_grid_cell_list(bounds):
+                grid_dict.setdefault(grid_cell, []).append(index)
+
+        pair_set = set()
+        for index_list in grid_dict.values():
+            for position, index_a in enumerate(index_list):
+                for index_b in index_list[position + 1 :]:
+                    pair_set.add((min(index_a, index_b), max(index_a, index_b)))
+
+        return sorted(
+            [
+                (index_a, index_b)
+                for index_a, index_b in pair_set
+                if self.bounds_overlap(
+                    bounds_list[index_a], bounds_list[index_b], self.TOLERANCE
+                )
+            ]
+        )
+
+    def transform_point_list(self, point_list, rotation=0.0, rx=0.0, ry=0.0):
+        # Rotated keys are rotated around the origin and then moved to the rotation point like the rotation
+        # collection does. The result is moved to case coordinates
+        angle = math.radians(-rotation)
+        cos_angle = math.cos(angle)
+        sin_angle = math.sin(angle)
+        offset_x = self.parameters.U(rx) + self.case_offset_x
+        offset_y = -self.parameters.U(ry) + self.case_offset_y
+
+        return [
+            (
+                (x * cos_angle) - (y * sin_angle) + offset_x,
+                (x * sin_angle) + (y * cos_angle) + offset_y,
+            )
+            for x, y in point_list
+        ]
+
+    def get_cutout_polygon_list(self, switch):
+        switch_config = switch.switch_config
+
+        polygon_list = [
+            [tuple(point) for point in switch_config.get_switch_poly_info()]
+        ]
+
+        stab_poly_points, _ = switch_config.get_stab_poly_info(
+            key_width=switch.switch_length
+        )
+        if stab_poly_points is not None:
+            polygon_list.append([tuple(point) for point in stab_poly_points])
+            polygon_list.append([(-x, y) for x, y in stab_poly_points])
+
+        # Match the 180 degree turn, the extra turn for vertical keys and the move to the key center in
+        # Switch.switch_cutout()
+        center_x = switch.x_start_mm + (switch.w_mm / 2)
+        center_y = switch.y_start_mm - (switch.h_mm / 2)
+
+        moved_polygon_list = []
+        for polygon in polygon_list:
+            polygon = [(-x, -y) for x, y in polygon]
+            if switch.vertical:
+                polygon = [(y, -x) for x, y in polygon]
+
+            moved_polygon_list.append(
+                [(x + center_x, y + center_y) for x, y in polygon]
+            )
+
+        return moved_polygon_list
+
+    def get_key_info_list(self):
+        """
+        Get the outline and cutout polygons of every key in case coordinates
+
+        Returns
+        -------
+        list
+            List of dicts with the key legend, layout coordinates, outline and cutout polygons
+        """
+        item_list = [
+            (switch, 0.0, 0.0, 0.0)
+            for switch in self.keyboard.switch_collection.get_item_list()
+        ]
+
+        rotation_collection = self.keyboard.switch_rotation_collection
+        for rotation in rotation_collection.get_rotation_list():
+            collection = rotation_collection.rotation_collection[rotation]
+            for rx in collection.get_rx_list():
+                for ry in collection.get_ry_list_in_rx(rx):
+                    for x in collection.get_x_list_in_rx_ry(rx, ry):
+                        for y in collection.get_y_list_in_rx_ry_x(x, rx, ry):
+                            item_list.append(
+                                (collection.get_item(x, y, rx, ry), rotation, rx, ry)
+                            )
+
+        key_info_list = []
+        for switch, rotation, rx, ry in item_list:
+            outline = [
+                (switch.x_start_mm, switch.y_start_mm),
+                (switch.x_end_mm, switch.y_start_mm),
+                (switch.x_end_mm, switch.y_start_mm - switch.h_mm),
+                (switch.x_start_mm, switch.y_start_mm - switch.h_mm),
+            ]
+
+            key_info_list.append(
+                {
+                    "switch": switch,
+                    "legend": switch.cell_value,
+                    "x": switch.x + rx,
+                    "y": -switch.y + ry,
+                    "rotation": rotation,
+                    "outline": self.transform_point_list(outline, rotation, rx, ry),
+                    "cutout_list": [
+                        self.transform_point_list(polygon, rotation, rx, ry)
+                        for polygon in self.get_cutout_polygon_list(switch)
+                    ],
+                }
+            )
+
+        return key_info_list
+
+    def get_key_name(self, key_info):
+        return "'%s' (x: %g, y: %g)" % (
+            key_info["legend"],
+            key_info["x"],
+            key_info["y"],
+        )
+
+    def check_key_overlap(self):
+        violation_list = []
+
+        outline_list = [key_info["outline"] for key_info in self.key_info_list]
+        for index_a, index_b in self.get_candidate_pair_list(
+            [self.get_bounds(outline) for outline in outline_list]
+        ):
+            if self.polygons_overlap(outline_list[index_a], outline_list[index_b]):
+                key_a = self.key_info_list[index_a]
+                key_b = self.key_info_list[index_b]
+                violation_list.append(
+                    {
+                        "check": "key_overlap",
+                        "message": "Keys %s and %s overlap"
+                        % (self.get_key_name(key_a), self.get_key_name(key_b)),
+                        "keys": [key_a["legend"], key_b["legend"]],
+                        "x": key_a["x"],
+                        "y": key_a["y"],
+                    }
+                )
+
+        return violation_list
+
+    def check_cutout_overlap(self):
+        violation_list = []
+
+        # Each cutout polygon is indexed on its own so a stabilizer that reaches into the next key is found
+        polygon_list = []
+        key_index_list = []
+        for key_index, key_info in enumerate(self.key_info_list):
+            for polygon in key_info["cutout_list"]:
+                polygon_list.append(polygon)
+                key_index_list.append(key_index)
+
+        key_pair_set = set()
+        for index_a, index_b in self.get_candidate_pair_list(
+            [self.get_bounds(polygon) for polygon in polygon_list]
+        ):
+            key_pair = (key_index_list[index_a], key_index_list[index_b])
+            if key_pair[0] == key_pair[1] or key_pair in key_pair_set:
+                continue
+
+            if self.polygons_overlap(polygon_list[index_a], polygon_list[index_b]):
+                key_pair_set.add(key_pair)
+
+                key_a = self.key_info_list[key_pair[0]]
+                key_b = self.key_info_list[key_pair[1]]
+                violation_list.append(
+                    {
+                        "check": "cutout_overlap",
+                        "message": "Switch cutouts for keys %s and %s overlap"
+                        % (self.get_key_name(key_a), self.get_key_name(key_b)),
+                        "keys": [key_a["legend"], key_b["legend"]],
+                        "x": key_a["x"],
+                        "y": key_a["y"],
+                    }
+                )
+
+        return violation_list
+
+    def check_stabilizers(self):
+        violation_list = []
+
+        for key_info in self.key_info_list:
+            switch = key_info["switch"]
+            if switch.switch_length < 2.0:
+                continue
+
+            stab_poly_points, _ = switch.switch_config.get_stab_poly_info(
+                key_width=switch.switch_length
+            )
+            if stab_poly_points is None:
+                violation_list.append(
+                    {
+                        "check": "unknown_stabilizer_spacing",
+                        "message": "Key %s is %gu but %s stabilizers have no spacing for that size"
+                        % (
+                            self.get_key_name(key_info),
+                            switch.switch_length,
+                            switch.switch_config.stabilizer_type,
+                        ),
+                        "keys": [key_info["legend"]],
+                        "x": key_info["x"],
+                        "y": key_info["y"],
+                    }
+                )
+
+        return violation_list
+
+    def check_screw_holes(self):
+        violation_list = []
+
+        if self.parameters.screw_count <= 0:
+            return violation_list
+
+        body = Body(self.parameters)
+        body.set_screw_hole_support_directions()
+        screw_hole_table = body.screw_hole_table
+        radius = self.parameters.screw_hole_body_radius
+
+        # Cutout polygon index for the grid lookup
+        polygon_list = []
+        key_index_list = []
+        for key_index, key_info in enumerate(self.key_info_list):
+            for polygon in key_info["cutout_list"]:
+                polygon_list.append(polygon)
+                key_index_list.append(key_index)
+
+        grid_dict = {}
+        for index, polygon in enumerate(polygon_list):
+            for grid_cell in self.get_grid_cell_list(self.get_bounds(polygon)):
+                grid_dict.setdefault(grid_cell, []).append(index)
+
+        for row in range(screw_hole_table.get_count()):
+            if screw_hole_table.skip_list[row]:
+                continue
+
+            case_x = screw_hole_table.x_list[row] + self.parameters.screw_edge_x_inset
+            case_y = screw_hole_table.y_list[row] + self.parameters.screw_edge_y_inset
+
+            screw_bounds = (
+                case_x - radius,
+                case_y - radius,
+                case_x + radius,
+                case_y + radius,
+            )
+
+            index_set = set()
+            for grid_cell in self.get_grid_cell_list(screw_bounds):
+                index_set.update(grid_dict.get(grid_cell, []))
+
+            key_index_set = set()
+            for index in sorted(index_set):
+                if key_index_list[index] in key_index_set:
+                    continue
+
+                if self.circle_overlaps_polygon(
+                    case_x, case_y, radius, polygon_list[index]
+                ):
+                    key_index_set.add(key_index_list[index])
+
+            for key_index in sorted(key_index_set):
+                key_info = self.key_info_list[key_index]
+                violation_list.append(
+                    {
+                        "check": "screw_hole_collision",
+                        "message": "Screw hole body with radius %g mm at x: %g mm, y: %g mm collides with the "
+                        "switch or stabilizer cutout of key %s"
+                        % (radius, case_x, case_y, self.get_key_name(key_info)),
+                        "keys": [key_info["legend"]],
+                        "x": case_x,
+                        "y": case_y,
+                    }
+                )
+
+        return violation_list
+
+    def get_inner_case_bounds(self):
+        wall_thickness = self.parameters.case_wall_thickness
+
+        return (
+            wall_thickness,
+            wall_thickness,
+            self.parameters.real_case_width - wall_thickness,
+            self.parameters.real_case_height - wall_thickness,
+        )
+
+    def bounds_inside(self, bounds, outer_bounds):
+        return (
+            bounds[0] >= outer_bounds[0] - self.TOLERANCE
+            and bounds[1] >= outer_bounds[1] - self.TOLERANCE
+            and bounds[2] <= outer_bounds[2] + self.TOLERANCE
+            and bounds[3] <= outer_bounds[3] + self.TOLERANCE
+        )
+
+    def check_custom_polygons(self):
+        violation_list = []
+
+        if self.parameters.custom_polygons is None:
+            return violation_list
+
+        inner_bounds = self.get_inner_case_bounds()
+
+        for shape in self.parameters.custom_polygons:
+            shape_type = shape["type"]
+            for x, y in shape["coordinates"]:
+                # Shape coordinates are already in case coordinates
+                if shape_type == "circle":
+                    radius = shape["r"] if "r" in shape.keys() else shape["d"] / 2
+                    bounds = (x - radius, y - radius, x + radius, y + radius)
+                elif shape_type == "rectangle":
+                    width = shape.get("width", shape.get("height"))
+                    height = shape.get("height", width)
+                    bounds = (x, y, x + width, y + height)
+                else:
+                    bounds = self.get_bounds(
+                        [(x + point[0], y + point[1]) for point in shape["points"]]
+                    )
+
+                if not self.bounds_inside(bounds, inner_bounds):
+                    violation_list.append(
+                        {
+                            "check": "custom_polygon_outside_plate",
+                            "message": "Custom %s at x: %g mm, y: %g mm reaches outside the plate (%g, %g) to (%g, %g)"
+                            % ((shape_type, x, y) + inner_bounds),
+                            "keys": [],
+                            "x": x,
+                            "y": y,
+                        }
+                    )
+
+        return violation_list
+
+    def check_pcb(self):
+        violation_list = []
+
+        if not self.parameters.custom_pcb:
+            return violation_list
+
+        wall_thickness = self.parameters.case_wall_thickness
+        pcb_x = wall_thickness + self.parameters.pcb_case_left_margin
+        pcb_y = wall_thickness + self.parameters.pcb_case_bottom_margin
+        pcb_bounds = (
+            pcb_x,
+            pcb_y,
+            pcb_x + self.parameters.pcb_width,
+            pcb_y + self.parameters.pcb_height,
+        )
+
+        if not self.bounds_inside(pcb_bounds, self.get_inner_case_bounds()):
+            violation_list.append(
+                {
+                    "check": "pcb_outside_case",
+                    "message": "PCB (%g, %g) to (%g, %g) does not fit inside the case walls (%g, %g) to (%g, %g)"
+                    % (pcb_bounds + self.get_inner_case_bounds()),
+                    "keys": [],
+                    "x": pcb_x,
+                    "y": pcb_y,
+                }
+            )
+
+        for key_info in self.key_info_list:
+            if not self.bounds_inside(self.get_bounds(key_info["outline"]), pcb_bounds):
+                violation_list.append(
+                    {
+                        "check": "key_outside_pcb",
+                        "message": "Key %s is not over the PCB (%g, %g) to (%g, %g)"
+                        % ((self.get_key_name(key_info),) + pcb_bounds),
+                        "keys": [key_info["legend"]],
+                        "x": key_info["x"],
+                        "y": key_info["y"],
+                    }
+                )
+
+        return violation_list
+
+    def get_violation_list(self):
+        """
+        Run every check and get a list of the violations that were found
+
+        Returns
+        -------
+        list
+            List of dicts with the name of the check, a message, the legends of the keys involved and the x and
+            y coordinates of the problem. Key coordinates are in keyboard layout units and other coordinates
+            are in mm from the bottom left of the case
+        """
+        violation_list = []
+        violation_list += self.check_key_overlap()
+        violation_list += self.check_cutout_overlap()
+        violation_list += self.check_stabilizers()
+        violation_list += self.check_screw_holes()
+        violation_list += self.check_custom_polygons()
+        violation_list += self.check_pcb()
+
+        self.logger.debug("Found %d layout violations", len(violation_list))
+
+        return violation_list
+
+    @staticmethod
+    def format_violation(violation):
+        return "%s: %s" % (violation["check"], violation["message"])
@@ -0,0 +1,359 @@
+import logging
+import math
+
+from body import Body
+from keyboard import Keyboard
+from layout_checker import LayoutChecker
+
+
+class MirrorSymmetry:
+    """
+    Finds the sections of a keyboard that are mirror images of another section across the center of the
+    case, so split layouts only need one half built and rendered. The other half is made by mirroring
+    the rendered mesh
+
+    The whole board has to be symmetric before any section is mirrored. Every key outline and switch and
+    stabilizer cutout, the screw holes and their supports, the plate support lattice, the PCB and the
+    cable hole are compared with their mirror image. Custom polygons and the test block are never treated
+    as symmetric. A section is then mirrored from its partner on the other side when the material both
+    sections keep, for the top and the bottom, mirrors across the center as well
+
+    Keys are placed in a grid of switch_spacing sized cells by their center so each mirrored key is only
+    compared with the keys around it
+
+    ...
+
+    Attributes
+    ----------
+    keyboard : Keyboard
+        The keyboard to check. process_keyboard_layout() and process_custom_shapes() must already have been
+        called
+
+    tolerance : float, default 0.01
+        Distance in mm under which a coordinate and its mirror image are considered the same
+
+    mirror_x : float
+        The x coordinate of the mirror plane in mm from the left of the case
+
+    asymmetry_list : list
+        Names of the features that keep the board from being symmetric. Empty if it is symmetric
+
+    Methods
+    -------
+    is_symmetric()
+        Check if the whole board is a mirror image of itself
+    get_mirror_section_dict()
+        Get the sections that can be made by mirroring another section
+    """
+
+    def __init__(self, keyboard: Keyboard, tolerance=0.01):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.keyboard = keyboard
+        self.parameters = keyboard.parameters
+        self.tolerance = tolerance
+
+        self.mirror_x = self.parameters.real_case_width / 2
+
+        # The bottom section split depends on the screw hole supports
+        self.body = Body(self.parameters)
+        if self.parameters.screw_count > 0:
+            self.body.set_screw_hole_support_directions()
+
+        self.asymmetry_list = self.get_asymmetry_list()
+
+        self.logger.info(
+            "mirror_x: %f, asymmetry_list: %s", self.mirror_x, self.asymmetry_list
+        )
+
+    def mirror(self, x):
+        return (self.mirror_x * 2) - x
+
+    def values_match(self, value_list, other_value_list):
+        return len(value_list) == len(other_value_list) and all(
+            [
+                abs(value - other_value) <= self.tolerance
+                for value, other_value in zip(value_list, other_value_list)
+            ]
+        )
+
+    def items_match(self, item_list, other_item_list, item_match):
+        # Every item has to be paired with a different item of the other list that item_match accepts
+        if len(item_list) != len(other_item_list):
+            return False
+
+        unmatched_item_list = list(other_item_list)
+        for item in item_list:
+            for index, other_item in enumerate(unmatched_item_list):
+                if item_match(item, other_item):
+                    del unmatched_item_list[index]
+                    break
+            else:
+                return False
+
+        return True
+
+    def polygons_match(self, polygon, other_polygon):
+        # Point order is not compared since a mirrored polygon runs the other way around
+        return self.items_match(polygon, other_polygon, self.values_match)
+
+    def key_shapes_match(self, key_shape, other_key_shape):
+        return self.items_match(key_shape, other_key_shape, self.polygons_match)
+
+    def get_grid_cell(self, polygon):
+        cell_size = self.parameters.switch_spacing
+        center_x = sum([x for x, _ in polygon]) / len(polygon)
+        center_y = sum([y for _, y in polygon]) / len(polygon)
+
+        return (math.floor(center_x / cell_size), math.floor(center_y / cell_size))
+
+    def check_keys(self):
+        # Each key is its outline followed by its cutout polygons in mm from the bottom left of the case
+        key_shape_list = [
+            [key_info["outline"]] + key_info["cutout_list"]
+            for key_info in LayoutChecker(self.keyboard).key_info_list
+        ]
+
+        # Grid cell of the key center -> indexes of the keys that are not paired yet
+        grid_dict = {}
+        for index, key_shape in enumerate(key_shape_list):
+            grid_dict.setdefault(self.get_grid_cell(key_shape[0]), []).append(index)
+
+        for key_shape in key_shape_list:
+            mirrored_key_shape = [
+                [(self.mirror(x), y) for x, y in polygon] for polygon in key_shape
+            ]
+
+            # The mirrored center can land on the edge of a cell so the cells around it are checked too
+            (cell_x, cell_y) = self.get_grid_cell(mirrored_key_shape[0])
+            match_cell = None
+            for grid_cell in [
+                (cell_x + offset_x, cell_y + offset_y)
+                for offset_x in [-1, 0, 1]
+                for offset_y in [-1, 0, 1]
+            ]:
+                for index in grid_dict.get(grid_cell, []):
+                    if self.key_shapes_match(mirrored_key_shape, key_shape_list[index]):
+                        match_cell = grid_cell
+                        grid_dict[grid_cell].remove(index)
+                        break
+
+                if match_cell is not None:
+                    break
+
+            if match_cell is None:
+                return ["keys"]
+
+        return []
+
+    def check_screw_holes(self):
+        if self.parameters.screw_count <= 0:
+            return []
+
+        screw_hole_table = self.body.screw_hole_table
+
+        screw_hole_list = []
+        mirrored_screw_hole_list = []
+        for row in range(screw_hole_table.get_count()):
+            if screw_hole_table.skip_list[row]:
+                continue
+
+            x = screw_hole_table.inset_x_list[row]
+            y = screw_hole_table.inset_y_list[row]
+            (right, left, forward, back) = [
+                screw_hole_table.get_support(row, direction)
+                for direction in ["right", "left", "forward", "back"]
+            ]
+
+            screw_hole_list.append((x, y, right, left, forward, back))
+
+            # The left and right supports swap places in the mirror image
+            mirrored_screw_hole_list.append(
+                (self.mirror(x), y, left, right, forward, back)
+            )
+
+        if not self.items_match(
+            screw_hole_list, mirrored_screw_hole_list, self.values_match
+        ):
+            return ["screw holes"]
+
+        return []
+
+    def check_plate_supports(self):
+        if not self.parameters.plate_supports:
+            return []
+
+        # The support lattice starts at the left of the switches with one cell per U and the last cell is
+        # cut off at max_x, so its bars only mirror when the cell edges do
+        max_x = self.parameters.max_x
+        edge_list = [float(x) for x in range(math.ceil(max_x))] + [max_x]
+        edge_x_list = [
+            self.parameters.left_margin + self.parameters.U(x) for x in edge_list
+        ]
+        mirrored_edge_x_list = [self.mirror(x) for x in edge_x_list]
+
+        if not self.items_match(
+            edge_x_list,
+            mirrored_edge_x_list,
+            lambda x, other_x: abs(x - other_x) <= self.tolerance,
+        ):
+            return ["plate supports"]
+
+        return []
+
+    def is_centered(self, x):
+        return abs(x - self.mirror_x) <= self.tolerance
+
+    def get_asymmetry_list(self):
+        asymmetry_list = []
+
+        asymmetry_list += self.check_keys()
+        asymmetry_list += self.check_screw_holes()
+        asymmetry_list += self.check_plate_supports()
+
+        if self.parameters.custom_polygons is not None:
+            asymmetry_list.append("custom polygons")
+
+        if self.parameters.test_block:
+            asymmetry_list.append("test block")
+
+        if self.parameters.cable_hole and not self.is_centered(
+            self.parameters.left_margin + (self.parameters.real_max_x / 2)
+        ):
+            asymmetry_list.append("cable hole")
+
+        if self.parameters.custom_pcb and not self.is_centered(
+            self.parameters.case_wall_thickness
+            + self.parameters.pcb_case_left_margin
+            + (self.parameters.pcb_width / 2)
+        ):
+            asymmetry_list.append("PCB")
+
+        return asymmetry_list
+
+    def is_symmetric(self):
+        return len(self.asymmetry_list) == 0
+
+    def intervals_mirror(self, interval_list, other_interval_list):
+        mirrored_interval_list = [
+            (self.mirror(end_x), self.mirror(start_x))
+            for start_x, end_x in other_interval_list
+        ]
+
+        return self.items_match(
+            interval_list, mirrored_interval_list, self.values_match
+        )
+
+    def get_top_kept_interval_list(self, section_outline, y_min, y_max):
+        # x intervals, in mm from the left of the case, of the case material the top of a section keeps
+        # between y_min and y_max
+        case_min_x = -self.parameters.left_margin
+        case_max_x = self.parameters.real_max_x + self.parameters.right_margin
+
+        kept_interval_list = []
+        current_x = case_min_x
+        for start_x, end_x in section_outline.get_merged_interval_list(
+            y_min, y_max
+        ) + [(case_max_x, case_max_x)]:
+            start_x = min(max(start_x, case_min_x), case_max_x)
+            end_x = min(max(end_x, case_min_x), case_max_x)
+
+            if start_x - current_x > section_outline.tolerance:
+                kept_interval_list.append(
+                    (
+                        current_x + self.parameters.left_margin,
+                        start_x + self.parameters.left_margin,
+                    )
+                )
+
+            current_x = max(current_x, end_x)
+
+        return kept_interval_list
+
+    def is_top_mirror(self, section, other_section):
+        section_outline = self.keyboard.get_top_section_outline(section)
+        other_section_outline = self.keyboard.get_top_section_outline(other_section)
+
+        # The kept material only changes where a bar of either outline starts or ends
+        case_max_y = self.parameters.top_margin
+        case_min_y = -(self.parameters.real_max_y + self.parameters.bottom_margin)
+        y_list = sorted(
+            set(
+                section_outline.get_y_list(case_min_y, case_max_y)
+                + other_section_outline.get_y_list(case_min_y, case_max_y)
+            )
+        )
+
+        for y_min, y_max in zip(y_list, y_list[1:]):
+            if y_max - y_min <= section_outline.tolerance:
+                continue
+
+            if not self.intervals_mirror(
+                self.get_top_kept_interval_list(section_outline, y_min, y_max),
+                self.get_top_kept_interval_list(other_section_outline, y_min, y_max),
+            ):
+                return False
+
+        return True
+
+    def get_bottom_kept_interval(self, section):
+        # The bottom section inclusion block is offset by the right margin before it is moved with the rest
+        # of the case
+        (start_x, end_x) = self.keyboard.get_bottom_section_x_range(section)
+        offset = self.parameters.left_margin - self.parameters.right_margin
+
+        return (start_x + offset, end_x + offset)
+
+    def is_bottom_mirror(self, section, other_section):
+        bottom_section_count = self.keyboard.get_bottom_section_count()
+        has_bottom = section < bottom_section_count
+        other_has_bottom = other_section < bottom_section_count
+
+        if not has_bottom or not other_has_bottom:
+            return has_bottom == other_has_bottom
+
+        return self.intervals_mirror(
+            [self.get_bottom_kept_interval(section)],
+            [self.get_bottom_kept_interval(other_section)],
+        )
+
+    def get_mirror_section_dict(self):
+        """
+        Get the sections that are the mirror image of the section in the same place on the other side of
+        the board. Always empty if the whole board is not symmetric
+
+        Returns
+        -------
+        dict
+            Mirrored section number -> number of the section it is mirrored from. The section it is
+            mirrored from is always the lower number so it is built first
+        """
+        mirror_section_dict = {}
+
+        if not self.is_symmetric():
+            return mirror_section_dict
+
+        # The bottom section split looks up the screw hole supports through the keyboard body
+        previous_body = self.keyboard.body
+        self.keyboard.body = self.body
+
+        try:
+            section_count = self.keyboard.get_top_section_count()
+            for section in range(section_count // 2):
+                mirror_section = section_count - 1 - section
+
+                if self.is_top_mirror(
+                    section, mirror_section
+                ) and self.is_bottom_mirror(section, mirror_section):
+                    mirror_section_dict[mirror_section] = section
+                else:
+                    self.logger.info(
+                        "Section %d is not a mirror image of section %d",
+                        mirror_section,
+                        section,
+                    )
+        finally:
+            self.keyboard.body = previous_body
+
+        return mirror_section_dict
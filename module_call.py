@@ -0,0 +1,39 @@
+from solid import OpenSCADObject, scad_render
+from solid.solidpython import IncludedOpenSCADObject
+
+
+class ModuleCall(IncludedOpenSCADObject):
+    """
+    Call to an OpenSCAD module that is defined in the same file
+
+    The module definitions are attached to the call the same way SolidPython attaches include statements,
+    so every SCAD file that uses the module gets the definitions at the top of the file once no matter how
+    many times the module is called. Every call that shares a set of definitions must use the same
+    definition string so it is only written once
+
+    ...
+
+    Attributes
+    ----------
+    name : str
+        The name of the module to call
+
+    include_string : str
+        The OpenSCAD source for the module definitions used by this call
+    """
+
+    def __init__(self, name, definition_string):
+        self.include_file_path = None
+        self.include_string = definition_string
+
+        OpenSCADObject.__init__(self, name, {})
+
+
+def get_module_definition(name, solid_object):
+    """
+    Get the OpenSCAD source for a module named name that builds solid_object
+    """
+    body = scad_render(solid_object).strip()
+    body = "\n".join(["\t" + line for line in body.splitlines()])
+
+    return "module %s() {\n%s\n}\n" % (name, body)
@@ -0,0 +1,129 @@
+from array import array
+import logging
+
+
+class NeighborGraph:
+    """
+    Neighbor relations between the keys of a layout stored as flat arrays indexed by key id
+
+    Every key added to the graph gets an integer id and its index in item_list. Each key has one slot for
+    every neighbor group and direction. A slot holds the id of the neighbor, or NO_NEIGHBOR if the key has
+    no neighbor in that direction, and the offset and perpendicular offset to the neighbor. Slots that
+    have not been set hold UNSET. Keys only reference each other by id, so the graph pickles as a few
+    arrays and a list of keys instead of a chain of keys that reference each other
+
+    ...
+
+    Attributes
+    ----------
+    item_list : list
+        The key for every id
+
+    neighbor_id_array : array
+        The neighbor id for every slot
+
+    offset_array : array
+        The offset to the neighbor in keyboard layout U units for every slot
+
+    perp_offset_array : array
+        The perpendicular offset to the neighbor in keyboard layout U units for every slot
+
+    Methods
+    -------
+    add_item(item)
+        Add a key to the graph and get its id
+    get_slot(item_id, neighbor_name, neighbor_group)
+        Get the index of the slot for a key, direction and group in the arrays
+    set_neighbor(item_id, neighbor_name, neighbor_group, neighbor_id, offset=0.0, perp_offset=0.0)
+        Set the neighbor of a key for a direction and group
+    get_neighbor_id(item_id, neighbor_name, neighbor_group)
+        Get the id of the neighbor of a key. Negative if there is no neighbor
+    is_complete(item_id, neighbor_group)
+        Check if every direction of a key has been set for a group
+    """
+
+    DIRECTION_LIST = ["right", "left", "top", "bottom"]
+    GROUP_LIST = ["local", "global"]
+
+    # Direction and group name -> index used in the slot of a key
+    DIRECTION_INDEX_DICT = {name: index for index, name in enumerate(DIRECTION_LIST)}
+    GROUP_INDEX_DICT = {name: index for index, name in enumerate(GROUP_LIST)}
+
+    SLOT_COUNT = len(DIRECTION_LIST) * len(GROUP_LIST)
+
+    UNSET = -2
+    NO_NEIGHBOR = -1
+
+    def __init__(self):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.item_list = []
+
+        self.neighbor_id_array = array("i")
+        self.offset_array = array("d")
+        self.perp_offset_array = array("d")
+
+    def add_item(self, item):
+        item_id = len(self.item_list)
+        self.item_list.append(item)
+
+        self.neighbor_id_array.extend([self.UNSET] * self.SLOT_COUNT)
+        self.offset_array.extend([0.0] * self.SLOT_COUNT)
+        self.perp_offset_array.extend([0.0] * self.SLOT_COUNT)
+
+        return item_id
+
+    def get_slot(self, item_id, neighbor_name, neighbor_group):
+        return (
+            (item_id * self.SLOT_COUNT)
+            + (self.GROUP_INDEX_DICT[neighbor_group] * len(self.DIRECTION_LIST))
+            + self.DIRECTION_INDEX_DICT[neighbor_name]
+        )
+
+    def set_neighbor(
+        self,
+        item_id,
+        neighbor_name,
+        neighbor_group,
+        neighbor_id,
+        offset=0.0,
+        perp_offset=0.0,
+    ):
+        slot = self.get_slot(item_id, neighbor_name, neighbor_group)
+
+        self.neighbor_id_array[slot] = neighbor_id
+        self.offset_array[slot] = offset
+        self.perp_offset_array[slot] = perp_offset
+
+    def get_neighbor_id(self, item_id, neighbor_name, neighbor_group):
+        return self.neighbor_id_array[
+            self.get_slot(item_id, neighbor_name, neighbor_group)
+        ]
+
+    def get_neighbor(self, item_id, neighbor_name, neighbor_group):
+        neighbor_id = self.get_neighbor_id(item_id, neighbor_name, neighbor_group)
+        if neighbor_id < 0:
+            return None
+
+        return self.item_list[neighbor_id]
+
+    def get_offset(self, item_id, neighbor_name, neighbor_group):
+        return self.offset_array[self.get_slot(item_id, neighbor_name, neighbor_group)]
+
+    def get_perp_offset(self, item_id, neighbor_name, neighbor_group):
+        return self.perp_offset_array[
+            self.get_slot(item_id, neighbor_name, neighbor_group)
+        ]
+
+    def is_complete(self, item_id, neighbor_group):
+        first_slot = self.get_slot(item_id, self.DIRECTION_LIST[0], neighbor_group)
+
+        return all(
+            [
+                neighbor_id != self.UNSET
+                for neighbor_id in self.neighbor_id_array[
+                    first_slot : first_slot + len(self.DIRECTION_LIST)
+                ]
+            ]
+        )
@@ -0,0 +1,575 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import itertools
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import time
+
+from file_io import (
+    config_logger,
+    get_stl_volume,
+    load_keyboard_layout,
+    make_output_folder,
+)
+from parameters import Parameters, ParameterSnapshot, PARAMETER_DEFAULT_DICT
+from keyboard import Keyboard
+from keyboard_stl_generator import (
+    CheckExt,
+    build_solid_object_dict,
+    write_scad_files,
+)
+from render_pool import RenderPool
+
+# Set logger level variables
+console_logging_level = logging.WARN
+file_logging_level = logging.DEBUG
+
+
+logger = logging.getLogger().getChild(__name__)
+
+# Parameters that are only read while the parts are assembled. Points that only differ in these parameters
+# reuse the processed layout, switch neighbors and section plan of an earlier point
+ASSEMBLY_PARAMETER_NAME_LIST = [
+    "case_height",
+    "case_height_extra",
+    "tilt",
+    "bottom_cover_thickness",
+    "case_wall_thickness",
+    "plate_corner_radius",
+    "plate_supports",
+    "top_margin",
+    "bottom_margin",
+    "right_margin",
+    "screw_count",
+    "screw_diameter",
+    "screw_edge_inset",
+    "screw_edge_x_inset",
+    "screw_edge_y_inset",
+    "screw_hole_body_wall_width",
+    "screw_hole_body_support_x_factor",
+    "custom_screw_hole_coordinates",
+    "custom_screw_hole_coordinates_origin",
+    "simple_test",
+    "test_block",
+    "test_block_x_start",
+    "test_block_x_end",
+    "test_block_y_start",
+    "test_block_y_end",
+    "test_block_z_start",
+    "test_block_z_end",
+]
+
+# Parts that the STL volume is reported for
+VOLUME_PART_NAME_LIST = ["top", "bottom", "plate"]
+
+# Result columns that follow the swept parameters
+RESULT_COLUMN_LIST = (
+    [
+        "content_hash",
+        "keyboard_reused",
+        "real_case_width",
+        "real_case_height",
+        "top_section_count",
+        "bottom_section_count",
+        "scad_file_count",
+        "scad_size",
+        "generate_seconds",
+        "render_seconds",
+    ]
+    + ["%s_volume" % (part_name) for part_name in VOLUME_PART_NAME_LIST]
+    + [
+        "scad_folder",
+        "error",
+    ]
+)
+
+
+class ParameterSweep:
+    """
+    Builds a keyboard for each point of a parameter sweep and collects metrics for every point
+
+    A processed keyboard is kept for each set of parameters that changes the layout processing. Points that
+    only change parameters read while assembling the parts reuse it instead of processing the layout again
+
+    ...
+
+    Attributes
+    ----------
+    keyboard_layout_dict : list
+        The parsed keyboard layout used for every point
+
+    layout_name : str
+        The name used for the output files
+
+    output_folder : Path
+        Folder that each point writes its files to. Every point gets a folder named after its parameter hash
+
+    all_sections : bool, default False
+        Build every section instead of the whole keyboard
+
+    fragments : int, default 8
+        The number of fragments used for curves in the SCAD files
+
+    render : bool, default False
+        Render the SCAD files of each point to STL and report the render time and STL volumes
+
+    cache_size : int, default 4
+        The number of processed keyboards to keep
+
+    Methods
+    -------
+    get_keyboard_key(snapshot)
+        Get the hash of the parameters that change the layout processing
+    get_keyboard(snapshot)
+        Get a processed keyboard for the parameters, reusing a cached one if possible
+    run_point(point_number, snapshot)
+        Build one point and return its result row
+    render_file_list(file_name_list)
+        Render a list of (scad_file_name, stl_file_name) tuples one at a time
+    """
+
+    def __init__(
+        self,
+        keyboard_layout_dict,
+        layout_name,
+        output_folder,
+        all_sections=False,
+        fragments=8,
+        render=False,
+        cache_size=4,
+    ):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.keyboard_layout_dict = keyboard_layout_dict
+        self.layout_name = layout_name
+        self.output_folder = Path(output_folder)
+        self.all_sections = all_sections
+        self.fragments = fragments
+        self.render = render
+        self.cache_size = cache_size
+
+        # Keyboard key -> processed keyboard
+        self.keyboard_cache = OrderedDict()
+
+    @staticmethod
+    def get_keyboard_key(snapshot: ParameterSnapshot):
+        return snapshot.replace(
+            **{
+                parameter_name: PARAMETER_DEFAULT_DICT[parameter_name]
+                for parameter_name in ASSEMBLY_PARAMETER_NAME_LIST
+            }
+        ).content_hash
+
+    def get_keyboard(self, snapshot: ParameterSnapshot):
+        keyboard_key = self.get_keyboard_key(snapshot)
+
+        if keyboard_key in self.keyboard_cache:
+            self.keyboard_cache.move_to_end(keyboard_key)
+            keyboard = self.keyboard_cache[keyboard_key]
+
+            # Every part shares the keyboard parameters so updating them in place updates every part
+            keyboard.parameters.set_parameter_dict(snapshot.to_dict())
+
+            # New parameters start without the layout dimensions so set them before the section counts are read
+            keyboard.update_dimensions()
+
+            return keyboard, True
+
+        keyboard = Keyboard(Parameters.from_snapshot(snapshot))
+        keyboard.process_keyboard_layout(self.keyboard_layout_dict)
+        keyboard.process_custom_shapes()
+
+        self.keyboard_cache[keyboard_key] = keyboard
+        while len(self.keyboard_cache) > self.cache_size:
+            self.keyboard_cache.popitem(last=False)
+
+        return keyboard, False
+
+    def run_point(self, point_number, snapshot: ParameterSnapshot):
+        row = {
+            "point": point_number,
+            "content_hash": snapshot.content_hash,
+            "error": "",
+        }
+
+        try:
+            start_time = time.perf_counter()
+
+            keyboard, keyboard_reused = self.get_keyboard(snapshot)
+            parameters = keyboard.parameters
+
+            scad_folder_path, stl_folder_path = make_output_folder(
+                self.output_folder / self.layout_name, snapshot.content_hash[:16]
+            )
+
+            solid_object_dict = build_solid_object_dict(
+                keyboard, parameters, all_sections=self.all_sections
+            )
+
+            written_file_dict = {}
+            file_name_list = write_scad_files(
+                solid_object_dict,
+                parameters,
+                self.layout_name,
+                scad_folder_path,
+                stl_folder_path,
+                fragments=self.fragments,
+                written_file_dict=written_file_dict,
+            )
+
+            row.update(
+                {
+                    "keyboard_reused": keyboard_reused,
+                    "real_case_width": parameters.real_case_width,
+                    "real_case_height": parameters.real_case_height,
+                    "top_section_count": keyboard.get_top_section_count(),
+                    "bottom_section_count": keyboard.get_bottom_section_count(),
+                    "scad_file_count": len(file_name_list),
+                    "scad_size": sum(
+                        [
+                            scad_file_name.stat().st_size
+                            for scad_file_name, _ in file_name_list
+                        ]
+                    ),
+                    "generate_seconds": time.perf_counter() - start_time,
+                    "scad_folder": str(scad_folder_path),
+                }
+            )
+
+            if self.render:
+                # The all part only includes the top and bottom files so it is not rendered again
+                all_scad_file_name_list = [
+                    scad_file_name
+                    for (_, part_name), scad_file_name in written_file_dict.items()
+                    if part_name == "all"
+                ]
+                render_file_name_list = [
+                    (scad_file_name, stl_file_name)
+                    for scad_file_name, stl_file_name in file_name_list
+                    if scad_file_name not in all_scad_file_name_list
+                ]
+
+                # Global parts like the cable holder are the same for most points so their renders are
+                # shared through the render cache
+                global_scad_file_name_list = [
+                    scad_file_name
+                    for (section, _), scad_file_name in written_file_dict.items()
+                    if section == "global"
+                ]
+
+                render_start_time = time.perf_counter()
+                asyncio.run(
+                    self.render_file_list(
+                        render_file_name_list, global_scad_file_name_list
+                    )
+                )
+                row["render_seconds"] = time.perf_counter() - render_start_time
+
+                stl_file_name_dict = dict(file_name_list)
+                for part_name in VOLUME_PART_NAME_LIST:
+                    row["%s_volume" % (part_name)] = sum(
+                        [
+                            get_stl_volume(stl_file_name_dict[scad_file_name])
+                            for (_, written_part_name), scad_file_name in (
+                                written_file_dict.items()
+                            )
+                            if written_part_name == part_name
+                            and scad_file_name in stl_file_name_dict
+                        ]
+                    )
+
+        except Exception as e:
+            self.logger.exception("Sweep point %d failed", point_number)
+            row["error"] = str(e)
+
+        return row
+
+    async def render_file_list(self, file_name_list, cache_scad_file_name_list):
+        # Each sweep worker is its own process so renders inside a worker run one at a time
+        render_pool = RenderPool(
+            concurrency=1, render_cache_path=self.output_folder / "render_cache"
+        )
+        await asyncio.gather(
+            *[
+                render_pool.render(
+                    scad_file_name,
+                    stl_file_name,
+                    cache=scad_file_name in cache_scad_file_name_list,
+                )
+                for scad_file_name, stl_file_name in file_name_list
+            ]
+        )
+
+
+def get_sweep_value_list(value):
+    # A dict with start, stop and step is an inclusive range, a list is used as is
+    if isinstance(value, dict):
+        start = value["start"]
+        stop = value["stop"]
+        step = value.get("step", 1)
+        if step <= 0:
+            raise ValueError("Sweep step must be greater than 0")
+
+        step_count = math.floor(((stop - start) / step) + 1e-9)
+
+        return [round(start + (step * index), 10) for index in range(step_count + 1)]
+
+    if isinstance(value, list):
+        return value
+
+    return [value]
+
+
+def get_point_list(base_parameter_dict, sweep_spec):
+    """
+    Get a parameter dict for each point of a sweep
+
+    The sweep spec is either a dict of parameter name to a list of values or a range dict with start, stop
+    and step that is expanded to every combination of values, or a list of parameter dicts that are each
+    used as a point
+
+    Returns
+    -------
+    tuple
+        List of the swept parameter names and list of parameter dicts with the base parameters applied
+    """
+    if isinstance(sweep_spec, list):
+        point_change_list = sweep_spec
+        swept_name_list = []
+        for point_change_dict in point_change_list:
+            for parameter_name in point_change_dict.keys():
+                if parameter_name not in swept_name_list:
+                    swept_name_list.append(parameter_name)
+    else:
+        swept_name_list = list(sweep_spec.keys())
+        point_change_list = [
+            dict(zip(swept_name_list, value_tuple))
+            for value_tuple in itertools.product(
+                *[get_sweep_value_list(sweep_spec[name]) for name in swept_name_list]
+            )
+        ]
+
+    point_list = []
+    for point_change_dict in point_change_list:
+        point_parameter_dict = dict(base_parameter_dict)
+        point_parameter_dict.update(point_change_dict)
+        point_list.append(point_parameter_dict)
+
+    return swept_name_list, point_list
+
+
+# Sweep used by the worker processes. Each worker builds it once and reuses its keyboard cache
+worker_sweep = None
+
+
+def init_worker(sweep_kwargs):
+    global worker_sweep
+    worker_sweep = ParameterSweep(**sweep_kwargs)
+
+
+def run_point_chunk(point_chunk):
+    return [
+        worker_sweep.run_point(point_number, snapshot)
+        for point_number, snapshot in point_chunk
+    ]
+
+
+def run_sweep(snapshot_list, sweep_kwargs, worker_count=None):
+    """
+    Run every point and return the result rows in point order
+
+    Points that share a processed keyboard are grouped into chunks so a worker can reuse the keyboard for
+    the whole chunk. Chunks are split so every worker gets work
+    """
+    if worker_count is None or worker_count < 1:
+        worker_count = os.cpu_count() or 1
+
+    point_list = sorted(
+        enumerate(snapshot_list),
+        key=lambda point: ParameterSweep.get_keyboard_key(point[1]),
+    )
+
+    chunk_size = max(1, math.ceil(len(point_list) / worker_count))
+    chunk_list = []
+    for _, group in itertools.groupby(
+        point_list, key=lambda point: ParameterSweep.get_keyboard_key(point[1])
+    ):
+        group = list(group)
+        for index in range(0, len(group), chunk_size):
+            chunk_list.append(group[index : index + chunk_size])
+
+    row_list = []
+    if worker_count == 1:
+        init_worker(sweep_kwargs)
+        for chunk in chunk_list:
+            row_list += run_point_chunk(chunk)
+    else:
+        with ProcessPoolExecutor(
+            max_workers=worker_count,
+            initializer=init_worker,
+            initargs=(sweep_kwargs,),
+        ) as executor:
+            for chunk_row_list in executor.map(run_point_chunk, chunk_list):
+                row_list += chunk_row_list
+
+    return sorted(row_list, key=lambda row: row["point"])
+
+
+def write_results(results_file_path, swept_name_list, snapshot_list, row_list):
+    column_list = ["point"] + swept_name_list + RESULT_COLUMN_LIST
+
+    with open(results_file_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=column_list, extrasaction="ignore")
+        writer.writeheader()
+        for row in row_list:
+            snapshot_dict = snapshot_list[row["point"]].to_dict()
+            row = dict(row)
+            for parameter_name in swept_name_list:
+                value = snapshot_dict.get(parameter_name)
+                if isinstance(value, (list, dict)):
+                    value = json.dumps(value)
+                row[parameter_name] = value
+            writer.writerow(row)
+
+
+def main():
+
+    config_logger(console_logging_level, file_logging_level)
+
+    parser = argparse.ArgumentParser(
+        description="Build a keyboard for every point of a parameter sweep and write a table of metrics"
+    )
+    parser.add_argument(
+        "-i",
+        "--input-file",
+        metavar="layout_json_file_name.json",
+        help="A path to a keyboard layout editor json file",
+        required=True,
+        action=CheckExt({"json"}),
+    )
+    parser.add_argument(
+        "-p",
+        "--parameter-file",
+        metavar="parameters.json",
+        help="The base parameters that every sweep point starts from",
+        action=CheckExt({"json"}),
+    )
+    parser.add_argument(
+        "-w",
+        "--sweep-file",
+        metavar="sweep.json",
+        help="A JSON file with the parameter values to sweep",
+        required=True,
+        action=CheckExt({"json"}),
+    )
+    parser.add_argument(
+        "-o",
+        "--output-folder",
+        default="output",
+        help="A path to a folder to store the generated files for every point",
+    )
+    parser.add_argument(
+        "--results",
+        metavar="results.csv",
+        help="The CSV file to write the results to. Defaults to <layout>_sweep.csv in the output folder",
+        default=None,
+    )
+    parser.add_argument(
+        "-a",
+        "--all-sections",
+        help="Build every section for every point instead of the whole keyboard",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "-f",
+        "--fragments",
+        metavar="num_fragments",
+        help="The number of fragments to be used when creating curves",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "-r",
+        "--render",
+        help="Render every point to STL and report the render time and STL volumes",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--workers",
+        metavar="num_workers",
+        help="The number of worker processes. Defaults to the number of CPUs",
+        type=int,
+        default=None,
+    )
+
+    args = parser.parse_args()
+    logger.debug(vars(args))
+
+    input_file_path = Path(args.input_file)
+    layout_name = input_file_path.stem
+
+    keyboard_layout_dict = load_keyboard_layout(input_file_path)
+
+    base_parameter_dict = {}
+    if args.parameter_file is not None:
+        with open(args.parameter_file) as f:
+            base_parameter_dict = json.load(f)
+
+    with open(args.sweep_file) as f:
+        sweep_spec = json.load(f)
+
+    swept_name_list, point_list = get_point_list(base_parameter_dict, sweep_spec)
+
+    # Every point is validated before any point is built so a bad value stops the sweep right away
+    snapshot_list = [
+        Parameters(point_parameter_dict).get_snapshot()
+        for point_parameter_dict in point_list
+    ]
+    print("Sweep points: %d" % (len(snapshot_list)))
+
+    sweep_kwargs = {
+        "keyboard_layout_dict": keyboard_layout_dict,
+        "layout_name": layout_name,
+        "output_folder": args.output_folder,
+        "all_sections": args.all_sections,
+        "fragments": args.fragments,
+        "render": args.render,
+    }
+
+    start_time = time.perf_counter()
+    row_list = run_sweep(snapshot_list, sweep_kwargs, worker_count=args.workers)
+    elapsed = time.perf_counter() - start_time
+
+    results_file_path = args.results
+    if results_file_path is None:
+        results_file_path = Path(args.output_folder) / (layout_name + "_sweep.csv")
+
+    write_results(results_file_path, swept_name_list, snapshot_list, row_list)
+
+    failed_count = len([row for row in row_list if row["error"]])
+    reused_count = len([row for row in row_list if row.get("keyboard_reused")])
+
+    print(
+        "Sweep complete: %d points in %.1f seconds, %d reused a processed layout, %d failed"
+        % (len(row_list), elapsed, reused_count, failed_count)
+    )
+    print("Results written to", results_file_path)
+    logger.info("Sweep complete, results written to %s", results_file_path)
+
+    if failed_count > 0:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
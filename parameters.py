@@ -1,3 +1,5 @@
+import hashlib
+import json
 import logging
 import math
 
@@ -10,6 +12,36 @@ class Parameters:
 
     # SWITCH_SPACING = 19.05
 
+    # Attributes that are not user parameters. They are set from the user parameters and the layout
+    # dimensions and are left out of the parameter snapshot
+    STATE_ATTR_NAME_LIST = [
+        "logger",
+        "parameter_dict",
+        "paramater_alternate_dict",
+        "switch_config",
+        "snapshot",
+        "derived",
+        "min_x",
+        "max_x",
+        "min_y",
+        "max_y",
+        "real_max_x",
+        "real_max_y",
+        "real_case_width",
+        "real_case_height",
+        "case_height_base_removed",
+        "case_height_extra_fill",
+        "side_margin_diff",
+        "top_margin_diff",
+        "screw_tap_hole_diameter",
+        "screw_hole_body_diameter",
+        "screw_hole_body_radius",
+        "x_screw_width",
+        "y_screw_width",
+        "bottom_section_count",
+        "screw_hole_body_support_end_x",
+    ]
+
     def __init__(self, parameter_dict: dict = None):
 
         self.logger = logging.getLogger(__name__)
@@ -133,6 +165,10 @@ class Parameters:
 
         self.switch_config = None
 
+        # Frozen copy of the user parameters and the values derived from it and the layout dimensions
+        self.snapshot = None
+        self.derived = None
+
         self.min_x = 0.0
         self.max_x = 0.0
         self.min_y = 0.0
@@ -169,6 +205,8 @@ class Parameters:
             "logger",
             "parameter_dict",
             "switch_config",
+            "snapshot",
+            "derived",
             "min_x",
             "max_x",
             "min_y",
@@ -206,135 +244,52 @@ class Parameters:
         return u_value * self.switch_spacing
 
     def update_calculated_attributes(self):
-        # Calculated attributes
-        if self.screw_edge_x_inset is None:
-            self.screw_edge_x_inset = self.screw_edge_inset
-        if self.screw_edge_y_inset is None:
-            self.screw_edge_y_inset = self.screw_edge_inset
-
-        self.case_height_base_removed = self.case_height - self.bottom_cover_thickness
-        self.case_height_extra_fill = self.case_height + self.case_height_extra
-        self.side_margin_diff = self.right_margin - self.left_margin
-        self.top_margin_diff = self.bottom_margin - self.top_margin
-        self.screw_tap_hole_diameter = self.screw_diameter - 0.35
-        self.screw_hole_body_diameter = self.screw_diameter + (
-            self.screw_hole_body_wall_width * 2
-        )
-        self.screw_hole_body_radius = self.screw_hole_body_diameter / 2
-        self.x_screw_width = self.real_case_width - (
-            (self.screw_edge_x_inset * 2)
-        )  # + self.screw_diameter)
-        self.y_screw_width = self.real_case_height - (
-            (self.screw_edge_y_inset * 2)
-        )  # + self.screw_diameter)
-        self.bottom_section_count = math.ceil(self.real_case_width / self.x_build_size)
-        self.screw_hole_body_support_end_x = (
-            self.case_height_extra_fill / self.screw_hole_body_support_x_factor
-        ) + self.screw_hole_body_radius
+        # Calculated attributes before the layout dimensions are known
+        self.derived = DerivedParameters(self.get_snapshot())
+        self.apply_derived(self.derived)
 
     def set_dimensions(self, max_x, min_y, min_x, max_y):
-
-        self.max_x = max_x
-        self.max_x = max_x
-        self.min_y = min_y
-        self.max_y = max_y
-        self.logger.debug(
-            "min_x: %f, max_x: %f, max_y: %f, min_y: %f",
-            self.min_x,
-            self.max_x,
-            self.max_y,
-            self.min_y,
-        )
-
-        # Get rhe calculated real max and y sizes of the board
-        self.real_max_x = self.U(self.max_x)
-        self.real_max_y = self.U(abs(self.min_y))
-
-        self.real_case_width = self.real_max_x + self.left_margin + self.right_margin
-        self.real_case_height = self.real_max_y + self.top_margin + self.bottom_margin
-
-        if self.custom_screw_hole_coordinates is not None:
-            self.screw_edge_x_inset = 0
-            self.screw_edge_y_inset = 0
-            self.logger.debug(
-                "Custom Screw Default: screw_edge_x_inset: %f, screw_edge_y_inset: %f",
-                self.screw_edge_x_inset,
-                self.screw_edge_y_inset,
-            )
-
-        if self.custom_pcb:
-            half_u = self.U(1) / 2
-
-            # Get the top left coordinates for the PCB itself.
-            pcb_x_coordinate = 0
-            pcb_y_coordinate = 0
-            if self.pcb_top_left_coordinates is not None:
-                pcb_x_coordinate = self.pcb_top_left_coordinates[0]
-                pcb_y_coordinate = self.pcb_top_left_coordinates[1]
-
-            # Get the x any y coordinates of the top reference switch and left reference switch
-            left_switch_left_x_coordinate = (
-                self.pcb_left_switch_center_x_coordinate - half_u
-            )
-            top_switch_top_y_coordinate = (
-                self.pcb_top_switch_center_y_coordinate - half_u
+        snapshot = self.get_snapshot()
+
+        # The derived values only change when the parameters or the layout bounds change so repeated
+        # calls with the same bounds do not touch the parameters
+        key = DerivedParameters.get_key(snapshot, max_x, min_y, max_y)
+        if self.derived is not None and self.derived.key == key:
+            return
+
+        self.derived = DerivedParameters(snapshot, max_x, min_y, max_y)
+        self.apply_derived(self.derived)
+
+    def apply_derived(self, derived):
+        # Copy the derived values onto the parameters so every part can keep reading them as attributes
+        for attr_name in DerivedParameters.FIELD_NAME_LIST:
+            setattr(self, attr_name, getattr(derived, attr_name))
+
+    def get_snapshot(self):
+        # The snapshot is taken from the user parameters before any derived value is copied over them
+        if self.snapshot is None:
+            self.snapshot = ParameterSnapshot(
+                {
+                    attr_name: getattr(self, attr_name)
+                    for attr_name in ParameterSnapshot.FIELD_NAME_LIST
+                }
             )
 
-            # Get the margin built into the left and top of the PCB
-            pcb_left_margin = left_switch_left_x_coordinate - pcb_x_coordinate
-            pcb_top_margin = top_switch_top_y_coordinate - pcb_y_coordinate
+        return self.snapshot
 
-            pcb_right_margin = self.pcb_width - (pcb_left_margin + self.real_max_x)
-            pcb_bottom_margin = self.pcb_height - (pcb_top_margin + self.real_max_y)
-
-            self.left_margin = (
-                self.case_wall_thickness + self.pcb_case_left_margin + pcb_left_margin
-            )
-            self.right_margin = (
-                self.case_wall_thickness + self.pcb_case_right_margin + pcb_right_margin
-            )
-            self.top_margin = (
-                self.case_wall_thickness + self.pcb_case_top_margin + pcb_top_margin
-            )
-            self.bottom_margin = (
-                self.case_wall_thickness
-                + self.pcb_case_bottom_margin
-                + pcb_bottom_margin
-            )
-
-            if self.custom_screw_hole_coordinates is not None:
-                screw_hole_origin_x = self.custom_screw_hole_coordinates_origin[0]
-                screw_hole_origin_y = self.custom_screw_hole_coordinates_origin[1]
-
-                screw_hole_pcb_origin_x_offset = screw_hole_origin_x - pcb_x_coordinate
-                screw_hole_pcb_origin_y_offset = (
-                    pcb_y_coordinate + self.pcb_height
-                ) - screw_hole_origin_y
-
-                self.screw_edge_x_inset = (
-                    self.case_wall_thickness
-                    + self.pcb_case_left_margin
-                    + screw_hole_pcb_origin_x_offset
-                )
-                self.screw_edge_y_inset = (
-                    self.case_wall_thickness
-                    + self.pcb_case_bottom_margin
-                    + screw_hole_pcb_origin_y_offset
-                )
-                self.logger.debug(
-                    "PCB settings: screw_edge_x_inset: %f, screw_edge_y_inset: %f",
-                    self.screw_edge_x_inset,
-                    self.screw_edge_y_inset,
-                )
-
-        self.logger.debug(
-            "real_max_x: %d, real_max_y: %s", self.real_max_x, self.real_max_y
-        )
-
-        self.update_calculated_attributes()
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        return cls(snapshot.to_dict())
 
     def build_attr_from_dict(self, parameter_dict):
 
+        # Put back the user parameters that set_dimensions replaced so the new snapshot only holds user values
+        if self.snapshot is not None:
+            for attr_name, value in self.snapshot.to_dict().items():
+                setattr(self, attr_name, value)
+        self.snapshot = None
+        self.derived = None
+
         for param in parameter_dict.keys():
             ignore_deprecated = False
             value = parameter_dict[param]
@@ -371,6 +326,10 @@ class Parameters:
             if not ignore_deprecated:
                 setattr(self, param, value)
 
+        # Validate before anything is built from the parameters so a bad value fails at load time with a
+        # clear message
+        self.validate_parameter_types()
+
         self.switch_config = SwitchConfig(
             kerf=self.kerf,
             switch_type=self.switch_type,
@@ -380,14 +339,33 @@ class Parameters:
             custom_shape_path=self.custom_shape_path,
         )
 
-        self.update_calculated_attributes()
-
         self.validate_parameters()
 
+        self.update_calculated_attributes()
+
     def set_parameter_dict(self, parameter_dict):
         self.parameter_dict = parameter_dict
         self.build_attr_from_dict(self.parameter_dict)
 
+    def set_switch_variant(self, switch_type, stabilizer_type):
+        # Only the switch cutout depends on the switch and stabilizer type so every other parameter is kept
+        self.snapshot = self.get_snapshot().replace(
+            switch_type=switch_type, stabilizer_type=stabilizer_type
+        )
+        self.switch_type = switch_type
+        self.stabilizer_type = stabilizer_type
+
+        self.switch_config = SwitchConfig(
+            kerf=self.kerf,
+            switch_type=self.switch_type,
+            stabilizer_type=self.stabilizer_type,
+            custom_shape=self.custom_shape,
+            custom_shape_points=self.custom_shape_points,
+            custom_shape_path=self.custom_shape_path,
+        )
+
+        self.validate_parameters()
+
     # def get_param(self, paramaeter_name):
 
     #     if self.parameter_dict is not None and paramaeter_name in self.parameter_dict.keys():
@@ -397,6 +375,30 @@ class Parameters:
     #     else:
     #         raise ValueError('No paramter exists with name %s' % (paramaeter_name))
 
+    def validate_parameter_types(self):
+        parameter_error = False
+        error_message = ""
+
+        # Check every parameter with a number, bool or string default has a value of the same kind
+        for attr_name, default_value in PARAMETER_DEFAULT_DICT.items():
+            value = getattr(self, attr_name)
+            if isinstance(default_value, bool):
+                if not isinstance(value, bool):
+                    parameter_error = True
+                    error_message += "%s must be true or false\n" % (attr_name)
+            elif isinstance(default_value, (int, float)):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    parameter_error = True
+                    error_message += "%s must be a number\n" % (attr_name)
+            elif isinstance(default_value, str):
+                if not isinstance(value, str):
+                    parameter_error = True
+                    error_message += "%s must be a string\n" % (attr_name)
+
+        if parameter_error:
+            print("ERROR:", error_message)
+            exit(1)
+
     def validate_parameters(self):
         parameter_error = False
         error_message = ""
@@ -432,3 +434,333 @@ class Parameters:
         if parameter_error:
             print("ERROR:", error_message)
             exit(1)
+
+
+# Default value of every user parameter
+PARAMETER_DEFAULT_DICT = {
+    attr_name: value
+    for attr_name, value in vars(Parameters()).items()
+    if attr_name not in Parameters.STATE_ATTR_NAME_LIST
+}
+
+
+class ParameterSnapshot:
+    """
+    Immutable copy of the user parameters with a stable content hash
+
+    The snapshot is hashable so it can be used directly as a cache key and it pickles as a single JSON
+    string so it is cheap to send to worker processes. List values are stored as tuples and dict values
+    as tuples of key, value pairs sorted by key
+
+    ...
+
+    Attributes
+    ----------
+    FIELD_NAME_LIST : list
+        The name of every user parameter. Each one is an attribute of the snapshot
+
+    canonical_json : str
+        The parameters as JSON with sorted keys and no whitespace
+
+    content_hash : str
+        The sha256 hex digest of canonical_json
+
+    Methods
+    -------
+    to_dict()
+        Get the parameters as a new dict of JSON values that can be used to build Parameters
+    replace(**changes)
+        Get a new snapshot with some parameters changed
+    from_json(canonical_json)
+        Build a snapshot from the canonical JSON of another snapshot
+    freeze_value(value)
+        Convert lists and dicts in a value to tuples so the value is hashable
+    """
+
+    FIELD_NAME_LIST = list(PARAMETER_DEFAULT_DICT.keys())
+
+    __slots__ = tuple(FIELD_NAME_LIST) + ("canonical_json", "content_hash")
+
+    def __init__(self, value_dict: dict):
+        # Parameters that are not set use the default and names that are not parameters are ignored
+        value_dict = {
+            attr_name: value_dict.get(attr_name, default_value)
+            for attr_name, default_value in PARAMETER_DEFAULT_DICT.items()
+        }
+
+        canonical_json = json.dumps(value_dict, sort_keys=True, separators=(",", ":"))
+
+        for attr_name, value in value_dict.items():
+            object.__setattr__(self, attr_name, self.freeze_value(value))
+
+        object.__setattr__(self, "canonical_json", canonical_json)
+        object.__setattr__(
+            self,
+            "content_hash",
+            hashlib.sha256(canonical_json.encode("utf-8")).hexdigest(),
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ParameterSnapshot is immutable, use replace()")
+
+    def __delattr__(self, name):
+        raise AttributeError("ParameterSnapshot is immutable, use replace()")
+
+    def __eq__(self, other):
+        if not isinstance(other, ParameterSnapshot):
+            return NotImplemented
+
+        return self.content_hash == other.content_hash
+
+    def __hash__(self):
+        return hash(self.content_hash)
+
+    def __reduce__(self):
+        return (ParameterSnapshot.from_json, (self.canonical_json,))
+
+    def __repr__(self):
+        return "ParameterSnapshot(%s)" % (self.content_hash[:16])
+
+    def to_dict(self):
+        return json.loads(self.canonical_json)
+
+    def replace(self, **changes):
+        value_dict = self.to_dict()
+        value_dict.update(changes)
+
+        return ParameterSnapshot(value_dict)
+
+    @classmethod
+    def from_json(cls, canonical_json):
+        return cls(json.loads(canonical_json))
+
+    @staticmethod
+    def freeze_value(value):
+        if isinstance(value, dict):
+            return tuple(
+                sorted(
+                    [
+                        (key, ParameterSnapshot.freeze_value(item))
+                        for key, item in value.items()
+                    ],
+                    key=lambda pair: pair[0],
+                )
+            )
+
+        if isinstance(value, (list, tuple)):
+            return tuple([ParameterSnapshot.freeze_value(item) for item in value])
+
+        return value
+
+
+class DerivedParameters:
+    """
+    Immutable values calculated once from a parameter snapshot and the layout dimensions
+
+    ...
+
+    Attributes
+    ----------
+    FIELD_NAME_LIST : list
+        The name of every derived value. Each one is an attribute and is copied onto Parameters
+
+    key : tuple
+        The snapshot content hash and layout dimensions the values were calculated from
+
+    Methods
+    -------
+    get_key(snapshot, max_x = None, min_y = None, max_y = None)
+        Get the key for a snapshot and set of layout dimensions
+    """
+
+    FIELD_NAME_LIST = [
+        "top_margin",
+        "bottom_margin",
+        "left_margin",
+        "right_margin",
+        "screw_edge_x_inset",
+        "screw_edge_y_inset",
+        "max_x",
+        "min_y",
+        "max_y",
+        "real_max_x",
+        "real_max_y",
+        "real_case_width",
+        "real_case_height",
+        "case_height_base_removed",
+        "case_height_extra_fill",
+        "side_margin_diff",
+        "top_margin_diff",
+        "screw_tap_hole_diameter",
+        "screw_hole_body_diameter",
+        "screw_hole_body_radius",
+        "x_screw_width",
+        "y_screw_width",
+        "bottom_section_count",
+        "screw_hole_body_support_end_x",
+    ]
+
+    __slots__ = tuple(FIELD_NAME_LIST) + ("key",)
+
+    def __init__(
+        self,
+        snapshot: ParameterSnapshot,
+        max_x: float = None,
+        min_y: float = None,
+        max_y: float = None,
+    ):
+
+        logger = logging.getLogger().getChild(__name__)
+
+        p = snapshot
+
+        top_margin = p.top_margin
+        bottom_margin = p.bottom_margin
+        left_margin = p.left_margin
+        right_margin = p.right_margin
+
+        screw_edge_x_inset = p.screw_edge_x_inset
+        if screw_edge_x_inset is None:
+            screw_edge_x_inset = p.screw_edge_inset
+        screw_edge_y_inset = p.screw_edge_y_inset
+        if screw_edge_y_inset is None:
+            screw_edge_y_inset = p.screw_edge_inset
+
+        # Values that need the layout dimensions stay at 0 until they are known
+        real_max_x = 0.0
+        real_max_y = 0.0
+        real_case_width = 0.0
+        real_case_height = 0.0
+
+        if max_x is not None:
+            logger.debug("max_x: %f, max_y: %f, min_y: %f", max_x, max_y, min_y)
+
+            # Get rhe calculated real max and y sizes of the board
+            real_max_x = max_x * p.switch_spacing
+            real_max_y = abs(min_y) * p.switch_spacing
+
+            if p.custom_screw_hole_coordinates is not None:
+                screw_edge_x_inset = 0
+                screw_edge_y_inset = 0
+                logger.debug(
+                    "Custom Screw Default: screw_edge_x_inset: %f, screw_edge_y_inset: %f",
+                    screw_edge_x_inset,
+                    screw_edge_y_inset,
+                )
+
+            if p.custom_pcb:
+                half_u = p.switch_spacing / 2
+
+                # Get the top left coordinates for the PCB itself.
+                pcb_x_coordinate = 0
+                pcb_y_coordinate = 0
+                if p.pcb_top_left_coordinates is not None:
+                    pcb_x_coordinate = p.pcb_top_left_coordinates[0]
+                    pcb_y_coordinate = p.pcb_top_left_coordinates[1]
+
+                # Get the x any y coordinates of the top reference switch and left reference switch
+                left_switch_left_x_coordinate = (
+                    p.pcb_left_switch_center_x_coordinate - half_u
+                )
+                top_switch_top_y_coordinate = (
+                    p.pcb_top_switch_center_y_coordinate - half_u
+                )
+
+                # Get the margin built into the left and top of the PCB
+                pcb_left_margin = left_switch_left_x_coordinate - pcb_x_coordinate
+                pcb_top_margin = top_switch_top_y_coordinate - pcb_y_coordinate
+
+                pcb_right_margin = p.pcb_width - (pcb_left_margin + real_max_x)
+                pcb_bottom_margin = p.pcb_height - (pcb_top_margin + real_max_y)
+
+                left_margin = (
+                    p.case_wall_thickness + p.pcb_case_left_margin + pcb_left_margin
+                )
+                right_margin = (
+                    p.case_wall_thickness + p.pcb_case_right_margin + pcb_right_margin
+                )
+                top_margin = (
+                    p.case_wall_thickness + p.pcb_case_top_margin + pcb_top_margin
+                )
+                bottom_margin = (
+                    p.case_wall_thickness + p.pcb_case_bottom_margin + pcb_bottom_margin
+                )
+
+                if p.custom_screw_hole_coordinates is not None:
+                    screw_hole_origin_x = p.custom_screw_hole_coordinates_origin[0]
+                    screw_hole_origin_y = p.custom_screw_hole_coordinates_origin[1]
+
+                    screw_hole_pcb_origin_x_offset = (
+                        screw_hole_origin_x - pcb_x_coordinate
+                    )
+                    screw_hole_pcb_origin_y_offset = (
+                        pcb_y_coordinate + p.pcb_height
+                    ) - screw_hole_origin_y
+
+                    screw_edge_x_inset = (
+                        p.case_wall_thickness
+                        + p.pcb_case_left_margin
+                        + screw_hole_pcb_origin_x_offset
+                    )
+                    screw_edge_y_inset = (
+                        p.case_wall_thickness
+                        + p.pcb_case_bottom_margin
+                        + screw_hole_pcb_origin_y_offset
+                    )
+                    logger.debug(
+                        "PCB settings: screw_edge_x_inset: %f, screw_edge_y_inset: %f",
+                        screw_edge_x_inset,
+                        screw_edge_y_inset,
+                    )
+
+            # The case size uses the final margins so it matches the PCB when a custom PCB is used
+            real_case_width = real_max_x + left_margin + right_margin
+            real_case_height = real_max_y + top_margin + bottom_margin
+
+            logger.debug("real_max_x: %d, real_max_y: %s", real_max_x, real_max_y)
+
+        case_height_extra_fill = p.case_height + p.case_height_extra
+        screw_hole_body_diameter = p.screw_diameter + (p.screw_hole_body_wall_width * 2)
+        screw_hole_body_radius = screw_hole_body_diameter / 2
+
+        value_dict = {
+            "top_margin": top_margin,
+            "bottom_margin": bottom_margin,
+            "left_margin": left_margin,
+            "right_margin": right_margin,
+            "screw_edge_x_inset": screw_edge_x_inset,
+            "screw_edge_y_inset": screw_edge_y_inset,
+            "max_x": 0.0 if max_x is None else max_x,
+            "min_y": 0.0 if min_y is None else min_y,
+            "max_y": 0.0 if max_y is None else max_y,
+            "real_max_x": real_max_x,
+            "real_max_y": real_max_y,
+            "real_case_width": real_case_width,
+            "real_case_height": real_case_height,
+            "case_height_base_removed": p.case_height - p.bottom_cover_thickness,
+            "case_height_extra_fill": case_height_extra_fill,
+            "side_margin_diff": right_margin - left_margin,
+            "top_margin_diff": bottom_margin - top_margin,
+            "screw_tap_hole_diameter": p.screw_diameter - 0.35,
+            "screw_hole_body_diameter": screw_hole_body_diameter,
+            "screw_hole_body_radius": screw_hole_body_radius,
+            "x_screw_width": real_case_width - (screw_edge_x_inset * 2),
+            "y_screw_width": real_case_height - (screw_edge_y_inset * 2),
+            "bottom_section_count": math.ceil(real_case_width / p.x_build_size),
+            "screw_hole_body_support_end_x": (
+                case_height_extra_fill / p.screw_hole_body_support_x_factor
+            )
+            + screw_hole_body_radius,
+        }
+
+        for attr_name, value in value_dict.items():
+            object.__setattr__(self, attr_name, value)
+
+        object.__setattr__(self, "key", self.get_key(snapshot, max_x, min_y, max_y))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DerivedParameters is immutable")
+
+    @staticmethod
+    def get_key(snapshot, max_x=None, min_y=None, max_y=None):
+        return (snapshot.content_hash, max_x, min_y, max_y)
@@ -0,0 +1,289 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import time
+
+from file_io import get_scad_hash, write_mirrored_stl
+
+
+class RenderPool:
+    """
+    Runs OpenSCAD renders as asyncio subprocesses with a limit on how many run at once and reports
+    the progress of every render as structured events
+
+    ...
+
+    Attributes
+    ----------
+    concurrency : int, default os.cpu_count()
+        The maximum number of OpenSCAD processes that can run at once
+
+    openscad_command : str, default "openscad"
+        The OpenSCAD executable to run
+
+    event_stream : file, default None
+        Open text stream that progress events are written to as JSON lines. Events are only logged
+        if no stream is set
+
+    post_processor : StlPostProcessor, default None
+        Post-render stage run on every rendered STL file once its OpenSCAD worker is free again
+
+    render_cache_path : Path, default None
+        Folder of STL files named by the hash of the SCAD geometry they were rendered from. Renders
+        submitted with cache set reuse these files so parts that are the same for every layout are only
+        rendered once
+
+    active_count : int
+        The number of renders currently running
+
+    waiting_count : int
+        The number of renders waiting for a free worker
+
+    Methods
+    -------
+    emit_event(event, scad_file_name, stl_file_name, **fields)
+        Log a progress event and write it to the event stream as a single JSON line
+    render(scad_file_name, stl_file_name, cache=False)
+        Render a SCAD file to STL once a worker is free. Raises RuntimeError if OpenSCAD fails
+    submit(scad_file_name, stl_file_name, cache=False)
+        Start render() as a task and return it. Must be called from the event loop thread
+    mirror(source_task, scad_file_name, stl_file_name, mirror_x)
+        Write the mirror image of the STL file rendered by source_task across the plane x = mirror_x
+    submit_mirror(source_task, scad_file_name, stl_file_name, mirror_x)
+        Start mirror() as a task and return it. Must be called from the event loop thread
+    """
+
+    def __init__(
+        self,
+        concurrency=None,
+        openscad_command="openscad",
+        event_stream=None,
+        post_processor=None,
+        render_cache_path=None,
+    ):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        if concurrency is None or concurrency < 1:
+            concurrency = os.cpu_count() or 1
+
+        self.concurrency = concurrency
+        self.openscad_command = openscad_command
+        self.event_stream = event_stream
+        self.post_processor = post_processor
+
+        # Mirrored meshes are written from a source mesh that is already post-processed, so the vertices are
+        # not snapped and welded a second time
+        self.mirror_post_processor = None
+        if post_processor is not None:
+            self.mirror_post_processor = copy.copy(post_processor)
+            self.mirror_post_processor.merge_tolerance = None
+
+        self.render_cache_path = render_cache_path
+        if render_cache_path is not None:
+            self.render_cache_path = Path(render_cache_path)
+            self.render_cache_path.mkdir(parents=True, exist_ok=True)
+
+        # The semaphore is created on first use so it belongs to the running event loop
+        self.semaphore = None
+
+        self.active_count = 0
+        self.waiting_count = 0
+
+    def emit_event(self, event, scad_file_name, stl_file_name, **fields):
+        event_dict = {
+            "event": event,
+            "time": time.time(),
+            "scad": str(scad_file_name),
+            "stl": str(stl_file_name),
+            "active": self.active_count,
+            "waiting": self.waiting_count,
+        }
+        event_dict.update(fields)
+
+        self.logger.info("Render %s: %s", event, json.dumps(event_dict))
+
+        if self.event_stream is not None:
+            self.event_stream.write(json.dumps(event_dict) + "\n")
+            self.event_stream.flush()
+
+        return event_dict
+
+    async def run_openscad(self, scad_file_name, stl_file_name):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        queued_time = time.perf_counter()
+
+        self.waiting_count += 1
+        self.emit_event("queued", scad_file_name, stl_file_name)
+
+        async with self.semaphore:
+            self.waiting_count -= 1
+            self.active_count += 1
+
+            start_time = time.perf_counter()
+            self.emit_event(
+                "started",
+                scad_file_name,
+                stl_file_name,
+                queued_seconds=start_time - queued_time,
+            )
+
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    self.openscad_command,
+                    "-o",
+                    str(stl_file_name),
+                    str(scad_file_name),
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                _, stderr = await process.communicate()
+                return_code = process.returncode
+                error = stderr.decode("utf-8", "replace").strip()
+            except OSError as e:
+                return_code = None
+                error = str(e)
+            finally:
+                self.active_count -= 1
+
+            elapsed = time.perf_counter() - start_time
+
+            if return_code != 0:
+                self.emit_event(
+                    "failed",
+                    scad_file_name,
+                    stl_file_name,
+                    elapsed_seconds=elapsed,
+                    return_code=return_code,
+                    error=error,
+                )
+                raise RuntimeError(
+                    "OpenSCAD failed for %s: %s" % (scad_file_name, error)
+                )
+
+            stl_size = None
+            if Path(stl_file_name).exists():
+                stl_size = Path(stl_file_name).stat().st_size
+
+            self.emit_event(
+                "finished",
+                scad_file_name,
+                stl_file_name,
+                elapsed_seconds=elapsed,
+                size=stl_size,
+            )
+
+    async def render_cached(self, scad_file_name, stl_file_name):
+        cached_stl_file_name = self.render_cache_path / (
+            get_scad_hash(scad_file_name) + ".stl"
+        )
+
+        if cached_stl_file_name.exists():
+            self.emit_event(
+                "cached",
+                scad_file_name,
+                stl_file_name,
+                cached_stl=str(cached_stl_file_name),
+            )
+        else:
+            # Render to a temporary file so a failed render never leaves a partial file in the cache. Every
+            # render gets its own file so renders of the same SCAD file in this or another process never
+            # write the same file
+            with tempfile.NamedTemporaryFile(
+                dir=self.render_cache_path, suffix=".tmp.stl", delete=False
+            ) as temp_stl_file:
+                temp_stl_file_name = Path(temp_stl_file.name)
+            try:
+                await self.run_openscad(scad_file_name, temp_stl_file_name)
+                temp_stl_file_name.replace(cached_stl_file_name)
+            finally:
+                if temp_stl_file_name.exists():
+                    temp_stl_file_name.unlink()
+
+        shutil.copyfile(cached_stl_file_name, stl_file_name)
+
+    async def post_process(self, scad_file_name, stl_file_name, post_processor=None):
+        # Post-processing runs outside the semaphore so the next render can start
+        if post_processor is None:
+            post_processor = self.post_processor
+
+        start_time = time.perf_counter()
+        try:
+            post_process_result = await asyncio.get_running_loop().run_in_executor(
+                None, post_processor.process, stl_file_name
+            )
+        except Exception as e:
+            self.emit_event(
+                "failed",
+                scad_file_name,
+                stl_file_name,
+                elapsed_seconds=time.perf_counter() - start_time,
+                error="Post-processing failed: %s" % (str(e)),
+            )
+            raise RuntimeError(
+                "Post-processing failed for %s: %s" % (stl_file_name, str(e))
+            )
+
+        self.emit_event(
+            "processed",
+            scad_file_name,
+            stl_file_name,
+            elapsed_seconds=time.perf_counter() - start_time,
+            size=post_process_result["size"],
+            triangle_count=post_process_result.get("triangle_count"),
+        )
+
+    async def render(self, scad_file_name, stl_file_name, cache=False):
+        if cache and self.render_cache_path is not None:
+            await self.render_cached(scad_file_name, stl_file_name)
+        else:
+            await self.run_openscad(scad_file_name, stl_file_name)
+
+        if self.post_processor is not None:
+            await self.post_process(scad_file_name, stl_file_name)
+
+        return stl_file_name
+
+    async def mirror(self, source_task, scad_file_name, stl_file_name, mirror_x):
+        # The mirrored mesh is written from the source STL once it is rendered instead of running OpenSCAD
+        source_stl_file_name = await source_task
+
+        start_time = time.perf_counter()
+        triangle_count = await asyncio.get_running_loop().run_in_executor(
+            None, write_mirrored_stl, source_stl_file_name, stl_file_name, mirror_x
+        )
+
+        self.emit_event(
+            "mirrored",
+            scad_file_name,
+            stl_file_name,
+            elapsed_seconds=time.perf_counter() - start_time,
+            source_stl=str(source_stl_file_name),
+            triangle_count=triangle_count,
+        )
+
+        if self.mirror_post_processor is not None:
+            await self.post_process(
+                scad_file_name,
+                stl_file_name,
+                post_processor=self.mirror_post_processor,
+            )
+
+        return stl_file_name
+
+    def submit(self, scad_file_name, stl_file_name, cache=False):
+        return asyncio.ensure_future(
+            self.render(scad_file_name, stl_file_name, cache=cache)
+        )
+
+    def submit_mirror(self, source_task, scad_file_name, stl_file_name, mirror_x):
+        return asyncio.ensure_future(
+            self.mirror(source_task, scad_file_name, stl_file_name, mirror_x)
+        )
@@ -38,6 +38,13 @@ class RotationCollection:
             rotation, x_offset, y_offset, rx, ry
         )
 
+    def get_item_list(self):
+        item_list = []
+        for rotation in self.get_rotation_list():
+            item_list += self.rotation_collection[rotation].get_item_list()
+
+        return item_list
+
     def get_rx_list(self, rotation):
         return self.rotation_collection[rotation].get_rx_list()
 
@@ -119,17 +126,29 @@ class RotationCollection:
                 solid = rotate(a=-(rotation), v=(0, 0, 1))(solid)
                 return solid
 
-    def get_rotated_moved_union(self, rotation):
+    def get_rotated_moved_union(self, rotation, min_x=None, max_x=None):
+        # Items whose rotated bounds are completely outside of the min_x to max_x range in mm are skipped.
+        # Returns an empty union if every item is skipped
         solid = union()
 
         for rx in self.get_rx_list(rotation):
             for ry in self.get_ry_list_in_rx(rotation, rx):
                 # for x in self.get_x_list_in_rx_ry(rotation, rx, ry)
                 #     for y in self.get_y_list_in_rx_ry_x(rotation, x, rx, ry)
-                solid += self.rotation_collection[rotation].get_moved_union(rx, ry)
-
-                solid = rotate(a=-(rotation), v=(0, 0, 1))(solid)
-                solid = right(self.parameters.U(rx))(back(self.parameters.U(ry))(solid))
+                item_collection = self.rotation_collection[rotation]
+                rotation_point_solid = item_collection.get_moved_union(
+                    rx, ry, min_x=min_x, max_x=max_x
+                )
+                if len(rotation_point_solid.children) == 0:
+                    continue
+
+                # Each rotation point is rotated and moved on its own
+                rotation_point_solid = rotate(a=-(rotation), v=(0, 0, 1))(
+                    rotation_point_solid
+                )
+                solid += right(self.parameters.U(rx))(
+                    back(self.parameters.U(ry))(rotation_point_solid)
+                )
 
         return solid
 
@@ -0,0 +1,115 @@
+import logging
+
+
+class ScrewHoleTable:
+    """
+    Column based table with one row per screw hole. Each column is a list indexed by the row number
+
+    ...
+
+    Attributes
+    ----------
+    x_list : list
+        The x coordinate of each screw hole relative to the first screw hole
+
+    y_list : list
+        The y coordinate of each screw hole relative to the first screw hole
+
+    inset_x_list : list
+        The x coordinate of each screw hole including the screw edge inset
+
+    inset_y_list : list
+        The y coordinate of each screw hole including the screw edge inset
+
+    custom_support_direction_list : list
+        The custom support direction ("h", "v" or None) for each screw hole
+
+    skip_list : list
+        True for each screw hole that should not be built
+
+    support_dict : dict
+        Direction name -> list of the distance the support in that direction extends from the center of each
+        screw hole. 0.0 if there is no support in that direction
+
+    Methods
+    -------
+    add_screw_hole(x, y, inset_x, inset_y, custom_support_direction = None)
+        Add a screw hole row and return its row number. A screw hole at an existing coordinate replaces that row
+    get_count()
+        Get the number of screw holes
+    get_name(row)
+        Get the coordinate string name of a screw hole
+    get_support(row, direction)
+        Get the distance the support in a direction extends from the center of a screw hole
+    set_support(row, direction, support_end_x)
+        Set the distance the support in a direction extends from the center of a screw hole
+    get_support_key(row)
+        Get a tuple of the directions that have a support. Screw holes with the same key share a body
+    """
+
+    DIRECTION_LIST = ["right", "left", "forward", "back"]
+
+    def __init__(self):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.x_list = []
+        self.y_list = []
+        self.inset_x_list = []
+        self.inset_y_list = []
+        self.custom_support_direction_list = []
+        self.skip_list = []
+        self.support_dict = {direction: [] for direction in self.DIRECTION_LIST}
+
+        # Coordinate name -> row number
+        self.row_dict = {}
+
+    def add_screw_hole(self, x, y, inset_x, inset_y, custom_support_direction=None):
+        name = str(x) + "," + str(y)
+
+        if name in self.row_dict.keys():
+            row = self.row_dict[name]
+        else:
+            row = len(self.x_list)
+            self.row_dict[name] = row
+
+            self.x_list.append(None)
+            self.y_list.append(None)
+            self.inset_x_list.append(None)
+            self.inset_y_list.append(None)
+            self.custom_support_direction_list.append(None)
+            self.skip_list.append(False)
+            for direction in self.DIRECTION_LIST:
+                self.support_dict[direction].append(0.0)
+
+        self.x_list[row] = x
+        self.y_list[row] = y
+        self.inset_x_list[row] = inset_x
+        self.inset_y_list[row] = inset_y
+        self.custom_support_direction_list[row] = custom_support_direction
+        self.skip_list[row] = False
+        for direction in self.DIRECTION_LIST:
+            self.support_dict[direction][row] = 0.0
+
+        return row
+
+    def get_count(self):
+        return len(self.x_list)
+
+    def get_name(self, row):
+        return str(self.x_list[row]) + "," + str(self.y_list[row])
+
+    def get_support(self, row, direction):
+        return self.support_dict[direction][row]
+
+    def set_support(self, row, direction, support_end_x):
+        self.support_dict[direction][row] = support_end_x
+
+    def get_support_key(self, row):
+        return tuple(
+            [
+                direction
+                for direction in self.DIRECTION_LIST
+                if self.support_dict[direction][row]
+            ]
+        )
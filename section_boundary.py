@@ -0,0 +1,121 @@
+import logging
+
+from item_collection import ItemCollection
+
+
+class SectionBoundaryIndex:
+    """
+    Which sections of a split keyboard border each other, and the keys and rows along their left and right
+    boundaries. The index is found once after the keyboard is split so building a section reads the
+    boundaries instead of scanning every key of the section again
+
+    A key is on the left or right boundary of its section when it has no local neighbor in that direction.
+    A boundary key that has a global neighbor in that direction faces another section across a seam
+
+    ...
+
+    Attributes
+    ----------
+    section_count : int
+        The number of sections in the index
+
+    boundary_item_dict : dict
+        (section number, side) -> the keys on that boundary of the section in the order of the section
+
+    seam_item_dict : dict
+        (section number, side) -> the boundary keys that have a global neighbor on that side
+
+    neighbor_section_dict : dict
+        (section number, side) -> sorted numbers of the sections across the seam on that side
+
+    row_extent_dict : dict
+        Section number -> {row y: (start_x, end_x)} in keyboard layout U units for every row of keys
+
+    Methods
+    -------
+    get_boundary_item_list(section_number, side)
+        Get the keys on the left or right boundary of a section
+    get_seam_item_list(section_number, side)
+        Get the boundary keys that face another section
+    get_neighbor_section_list(section_number, side)
+        Get the sections across the seam on the left or right of a section
+    has_neighbor_section(section_number, side)
+        Check if any key of a section faces another section on the left or right
+    get_row_extent_dict(section_number)
+        Get the x extent of every row of keys in a section
+    """
+
+    SIDE_LIST = ["left", "right"]
+
+    def __init__(self, section_list):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.section_count = len(section_list)
+
+        self.boundary_item_dict = {}
+        self.seam_item_dict = {}
+        self.neighbor_section_dict = {}
+        self.row_extent_dict = {}
+
+        # Neighbor id of a key -> number of the section the key is in
+        section_number_dict = {}
+        for section_number, section in enumerate(section_list):
+            for item in section.get_item_list():
+                section_number_dict[item.neighbor_id] = section_number
+
+        for section_number, section in enumerate(section_list):
+            self.add_section(section_number, section, section_number_dict)
+
+    def add_section(self, section_number, section: ItemCollection, section_number_dict):
+        row_extent_dict = {}
+
+        for side in self.SIDE_LIST:
+            self.boundary_item_dict[(section_number, side)] = []
+            self.seam_item_dict[(section_number, side)] = []
+            neighbor_section_set = set()
+
+            for item in section.get_item_list():
+                if item.has_neighbor(side):
+                    continue
+
+                self.boundary_item_dict[(section_number, side)].append(item)
+
+                neighbor = item.get_neighbor(side, "global")
+                if neighbor is not None:
+                    self.seam_item_dict[(section_number, side)].append(item)
+                    neighbor_section = section_number_dict.get(neighbor.neighbor_id)
+                    if neighbor_section is not None:
+                        neighbor_section_set.add(neighbor_section)
+
+            self.neighbor_section_dict[(section_number, side)] = sorted(
+                neighbor_section_set
+            )
+
+        for item in section.get_item_list():
+            (start_x, end_x) = row_extent_dict.get(item.y, (item.x, item.end_x))
+            row_extent_dict[item.y] = (min(start_x, item.x), max(end_x, item.end_x))
+
+        self.row_extent_dict[section_number] = row_extent_dict
+
+        self.logger.debug(
+            "Section %d neighbor sections, left: %s, right: %s",
+            section_number,
+            self.neighbor_section_dict[(section_number, "left")],
+            self.neighbor_section_dict[(section_number, "right")],
+        )
+
+    def get_boundary_item_list(self, section_number, side):
+        return self.boundary_item_dict[(section_number, side)]
+
+    def get_seam_item_list(self, section_number, side):
+        return self.seam_item_dict[(section_number, side)]
+
+    def get_neighbor_section_list(self, section_number, side):
+        return self.neighbor_section_dict[(section_number, side)]
+
+    def has_neighbor_section(self, section_number, side):
+        return len(self.seam_item_dict[(section_number, side)]) > 0
+
+    def get_row_extent_dict(self, section_number):
+        return self.row_extent_dict[section_number]
@@ -0,0 +1,246 @@
+from solid import union, polygon, linear_extrude
+
+from solid.utils import down
+
+import logging
+
+
+class SectionOutline:
+    """
+    Collects the rectangular separator bars that make up a section remove block and merges them into
+    staircase polygon outlines so the remove block can be built from a single extrusion
+
+    ...
+
+    Attributes
+    ----------
+    bar_list : list
+        List of (x_min, x_max, y_min, y_max) tuples in mm for every separator bar added
+
+    tolerance : float, default 1e-6
+        Distance under which two coordinates are considered the same
+
+    Methods
+    -------
+    add_bar(x, y, width, height)
+        Add a separator bar with its bottom left corner at (x, y)
+    get_uncovered_x_bounds(x_min, x_max, y_min, y_max)
+        Get the x extent of the area inside a rectangle that is not covered by any bar
+    get_outline_list()
+        Get a list of point lists. Each point list is one closed staircase outline
+    get_solid(height, z_offset = 0.0)
+        Get the extruded outlines moved down by z_offset
+    """
+
+    def __init__(self, tolerance=1e-6):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.bar_list = []
+
+        self.tolerance = tolerance
+
+    def add_bar(self, x, y, width, height):
+        if width <= self.tolerance or height <= self.tolerance:
+            return
+
+        self.bar_list.append((x, x + width, y, y + height))
+
+    def get_bar_count(self):
+        return len(self.bar_list)
+
+    def get_merged_interval_list(self, y_min, y_max):
+        interval_list = sorted(
+            [
+                (bar[0], bar[1])
+                for bar in self.bar_list
+                if bar[2] < y_max - self.tolerance and bar[3] > y_min + self.tolerance
+            ]
+        )
+
+        # Merge overlapping or touching x intervals
+        merged_list = []
+        for start_x, end_x in interval_list:
+            if len(merged_list) > 0 and start_x <= merged_list[-1][1] + self.tolerance:
+                if end_x > merged_list[-1][1]:
+                    merged_list[-1] = (merged_list[-1][0], end_x)
+            else:
+                merged_list.append((start_x, end_x))
+
+        return merged_list
+
+    def get_y_list(self, y_min=None, y_max=None):
+        # Get every y value where a bar starts or ends. Between each pair of these values the set of bars
+        # covering the slab does not change
+        y_list = [bar[2] for bar in self.bar_list] + [bar[3] for bar in self.bar_list]
+
+        if y_min is not None and y_max is not None:
+            y_list = [y for y in y_list if y > y_min and y < y_max] + [y_min, y_max]
+
+        return sorted(set(y_list))
+
+    def get_slab_list(self):
+        slab_list = []
+
+        y_list = self.get_y_list()
+        for y_min, y_max in zip(y_list, y_list[1:]):
+            if y_max - y_min <= self.tolerance:
+                continue
+
+            slab_list.append(
+                (y_min, y_max, self.get_merged_interval_list(y_min, y_max))
+            )
+
+        return slab_list
+
+    def get_uncovered_x_bounds(self, x_min, x_max, y_min, y_max):
+        """
+        Get the x extent of the area inside the passed in rectangle that is not covered by any bar
+
+        Returns
+        -------
+        tuple
+            (min_x, max_x) of the uncovered area or None if the whole rectangle is covered
+        """
+        uncovered_min_x = None
+        uncovered_max_x = None
+
+        y_list = self.get_y_list(y_min, y_max)
+        for slab_y_min, slab_y_max in zip(y_list, y_list[1:]):
+            if slab_y_max - slab_y_min <= self.tolerance:
+                continue
+
+            current_x = x_min
+            for start_x, end_x in self.get_merged_interval_list(
+                slab_y_min, slab_y_max
+            ) + [(x_max, x_max)]:
+                start_x = min(max(start_x, x_min), x_max)
+                end_x = min(max(end_x, x_min), x_max)
+
+                if start_x - current_x > self.tolerance:
+                    if uncovered_min_x is None or current_x < uncovered_min_x:
+                        uncovered_min_x = current_x
+                    if uncovered_max_x is None or start_x > uncovered_max_x:
+                        uncovered_max_x = start_x
+
+                current_x = max(current_x, end_x)
+
+        if uncovered_min_x is None:
+            return None
+
+        return (uncovered_min_x, uncovered_max_x)
+
+    def overlaps(self, interval_a, interval_b):
+        return (
+            min(interval_a[1], interval_b[1]) - max(interval_a[0], interval_b[0])
+            > self.tolerance
+        )
+
+    def get_run_list(self):
+        # A run is a vertical stack of slabs with exactly one interval each where every interval overlaps
+        # the one bellow it. A run can be drawn as a single simple staircase polygon
+        closed_run_list = []
+        open_run_list = []
+        previous_y_max = None
+
+        for y_min, y_max, interval_list in self.get_slab_list():
+            # Runs can only continue across slabs that touch
+            if previous_y_max is None or abs(y_min - previous_y_max) > self.tolerance:
+                closed_run_list += open_run_list
+                open_run_list = []
+
+            next_open_run_list = []
+            extended_run_list = []
+
+            for interval in interval_list:
+                run_match_list = [
+                    run for run in open_run_list if self.overlaps(run[-1][2], interval)
+                ]
+
+                run = None
+                if len(run_match_list) == 1:
+                    interval_match_list = [
+                        other
+                        for other in interval_list
+                        if self.overlaps(run_match_list[0][-1][2], other)
+                    ]
+                    if len(interval_match_list) == 1:
+                        run = run_match_list[0]
+
+                if run is not None:
+                    extended_run_list.append(run)
+                else:
+                    run = []
+
+                # Extend the previous slab instead of adding a new one if the interval did not change
+                if (
+                    len(run) > 0
+                    and abs(run[-1][2][0] - interval[0]) <= self.tolerance
+                    and abs(run[-1][2][1] - interval[1]) <= self.tolerance
+                ):
+                    run[-1] = (run[-1][0], y_max, run[-1][2])
+                else:
+                    run.append((y_min, y_max, interval))
+
+                next_open_run_list.append(run)
+
+            extended_id_set = set([id(run) for run in extended_run_list])
+            closed_run_list += [
+                run for run in open_run_list if id(run) not in extended_id_set
+            ]
+            open_run_list = next_open_run_list
+            previous_y_max = y_max
+
+        closed_run_list += open_run_list
+
+        return closed_run_list
+
+    def get_outline_list(self):
+        outline_list = []
+
+        for run in self.get_run_list():
+            points = []
+
+            # Walk up the right side of the run
+            for y_min, y_max, interval in run:
+                points.append([interval[1], y_min])
+                points.append([interval[1], y_max])
+
+            # Walk back down the left side of the run
+            for y_min, y_max, interval in reversed(run):
+                points.append([interval[0], y_max])
+                points.append([interval[0], y_min])
+
+            # Remove repeated points where the steps did not change x
+            outline = []
+            for point in points:
+                if (
+                    len(outline) == 0
+                    or abs(outline[-1][0] - point[0]) > self.tolerance
+                    or abs(outline[-1][1] - point[1]) > self.tolerance
+                ):
+                    outline.append(point)
+
+            outline_list.append(outline)
+
+        self.logger.debug(
+            "Merged %d separator bars into %d outlines",
+            len(self.bar_list),
+            len(outline_list),
+        )
+
+        return outline_list
+
+    def get_solid(self, height, z_offset=0.0):
+        outline_list = self.get_outline_list()
+
+        if len(outline_list) == 0:
+            return union()
+
+        points = []
+        paths = []
+        for outline in outline_list:
+            paths.append(list(range(len(points), len(points) + len(outline))))
+            points += outline
+
+        return down(z_offset)(linear_extrude(height=height)(polygon(points, paths)))
@@ -55,6 +55,10 @@ class ShapeCutout(Cell):
             "polygon": self.polygon_cutout,
         }
 
+        # x extent of the shape relative to its coordinates. Set when the shape is created
+        self.shape_min_x = 0.0
+        self.shape_max_x = 0.0
+
         self.solid = self.get_shape_cutout()
 
     def __str__(self):
@@ -84,6 +88,10 @@ class ShapeCutout(Cell):
     def get_moved(self):
         return right(self.x)(forward(self.y)(self.solid))
 
+    def get_x_bounds_mm(self):
+        # Shape coordinates are already in mm
+        return (self.x + self.shape_min_x, self.x + self.shape_max_x)
+
     def circle_cutout(self):
         this_function_name = sys._getframe().f_code.co_name
         self.logger = self.logger.getChild(this_function_name)
@@ -98,6 +106,9 @@ class ShapeCutout(Cell):
             )
             exit(1)
 
+        self.shape_min_x = -radius
+        self.shape_max_x = radius
+
         return circle(r=radius)
 
     def rectangle_cutout(self):
@@ -131,6 +142,9 @@ class ShapeCutout(Cell):
 
         self.logger.warn("height: %f, width: %f", height, width)
 
+        self.shape_min_x = 0.0
+        self.shape_max_x = width
+
         return square([width, height])
 
     def polygon_cutout(self):
@@ -156,4 +170,7 @@ class ShapeCutout(Cell):
             )
             path = [range(len(points))]
 
+        self.shape_min_x = min([point[0] for point in points])
+        self.shape_max_x = max([point[0] for point in points])
+
         return polygon(points, path)
@@ -0,0 +1,208 @@
+import gzip
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+
+from file_io import (
+    is_binary_stl,
+    iter_stl_triangles,
+    write_ascii_stl,
+    write_binary_stl,
+)
+from three_mf_writer import ThreeMfWriter
+
+
+class StlPostProcessor:
+    """
+    Post-render stage that converts rendered STL files to binary, welds duplicate vertices, writes a sidecar
+    JSON file with the mesh statistics and compresses the result for transfer
+
+    Every step streams the facets from a memory mapped file so the memory use does not grow with the size
+    of the STL file. The only exception is the unique vertex count, which has to hold every unique vertex
+    and is only found when vertex_count is enabled
+
+    ...
+
+    Attributes
+    ----------
+    binary : bool, default True
+        Rewrite ASCII STL files as binary STL files
+
+    merge_tolerance : float, default None
+        Snap vertices to a grid of this size in mm so vertices that differ by rounding become identical.
+        Facets that collapse to a line or point are removed. Vertices are not merged if None
+
+    info : bool, default True
+        Write a sidecar JSON file next to the STL file with the facet count, bounding box and volume of the
+        mesh
+
+    vertex_count : bool, default False
+        Add the unique vertex count to the sidecar JSON file. Memory use grows with the number of unique
+        vertices
+
+    compress : str, default None
+        Compress the STL file for transfer. "gzip" writes a .gz copy next to the STL and "3mf" writes a 3MF
+        archive with indexed vertices next to the STL
+
+    Methods
+    -------
+    process(stl_file_name)
+        Run every enabled step on a rendered STL file and get a summary of the results
+    """
+
+    COMPRESS_LIST = [None, "gzip", "3mf"]
+
+    def __init__(
+        self,
+        binary=True,
+        merge_tolerance=None,
+        info=True,
+        compress=None,
+        vertex_count=False,
+    ):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        if compress not in self.COMPRESS_LIST:
+            raise ValueError(
+                "compress must be one of %s, not %s" % (self.COMPRESS_LIST, compress)
+            )
+
+        self.binary = binary
+        self.merge_tolerance = merge_tolerance
+        self.info = info
+        self.compress = compress
+        self.vertex_count = vertex_count
+
+    def snap_vertex(self, vertex):
+        tolerance = self.merge_tolerance
+
+        return tuple([round(value / tolerance) * tolerance for value in vertex])
+
+    def iter_triangles(self, stl_file_name, stats):
+        # Yield the facets that will be written while collecting the mesh statistics in stats
+        vertex_set = set()
+        bounds_min = [float("inf")] * 3
+        bounds_max = [float("-inf")] * 3
+        volume = 0.0
+        triangle_count = 0
+        removed_count = 0
+
+        for triangle in iter_stl_triangles(stl_file_name):
+            if self.merge_tolerance is not None:
+                triangle = tuple([self.snap_vertex(vertex) for vertex in triangle])
+
+                # Welding can collapse thin facets into lines or points
+                if len(set(triangle)) < 3:
+                    removed_count += 1
+                    continue
+
+            if self.info:
+                for vertex in triangle:
+                    if self.vertex_count:
+                        vertex_set.add(vertex)
+                    for axis in range(3):
+                        bounds_min[axis] = min(bounds_min[axis], vertex[axis])
+                        bounds_max[axis] = max(bounds_max[axis], vertex[axis])
+
+                ((x1, y1, z1), (x2, y2, z2), (x3, y3, z3)) = triangle
+                volume += (
+                    x1 * (y2 * z3 - z2 * y3)
+                    - y1 * (x2 * z3 - z2 * x3)
+                    + z1 * (x2 * y3 - y2 * x3)
+                )
+
+            triangle_count += 1
+            yield triangle
+
+        stats["triangle_count"] = triangle_count
+        stats["removed_triangle_count"] = removed_count
+        if self.info:
+            if self.vertex_count:
+                stats["vertex_count"] = len(vertex_set)
+            stats["bounding_box"] = None
+            if triangle_count > 0:
+                stats["bounding_box"] = {
+                    "min": bounds_min,
+                    "max": bounds_max,
+                    "size": [bounds_max[axis] - bounds_min[axis] for axis in range(3)],
+                }
+            stats["volume"] = abs(volume) / 6.0
+
+    def process(self, stl_file_name):
+        """
+        Run every enabled step on a rendered STL file
+
+        Returns
+        -------
+        dict
+            The STL file, sidecar and compressed file names, the original and final STL sizes and the mesh
+            statistics when info is enabled
+        """
+        stl_file_name = Path(stl_file_name)
+
+        result = {
+            "stl": str(stl_file_name),
+            "original_size": stl_file_name.stat().st_size,
+        }
+
+        stats = {}
+        rewrite = self.merge_tolerance is not None or (
+            self.binary and not is_binary_stl(stl_file_name)
+        )
+
+        if rewrite:
+            # Write next to the original and swap it in so a failure never leaves a partial STL
+            temp_stl_file_name = stl_file_name.with_suffix(".post.tmp")
+            triangle_iter = self.iter_triangles(stl_file_name, stats)
+            try:
+                if self.binary or is_binary_stl(stl_file_name):
+                    write_binary_stl(temp_stl_file_name, triangle_iter)
+                else:
+                    write_ascii_stl(
+                        temp_stl_file_name, triangle_iter, name=stl_file_name.stem
+                    )
+                os.replace(temp_stl_file_name, stl_file_name)
+            finally:
+                if temp_stl_file_name.exists():
+                    temp_stl_file_name.unlink()
+        elif self.info:
+            # Nothing to rewrite so only read the file for the statistics
+            for _ in self.iter_triangles(stl_file_name, stats):
+                pass
+
+        result["binary"] = is_binary_stl(stl_file_name)
+        result["size"] = stl_file_name.stat().st_size
+        result.update(stats)
+
+        if self.compress == "gzip":
+            compressed_file_name = stl_file_name.with_name(stl_file_name.name + ".gz")
+            with open(stl_file_name, "rb") as f_in:
+                with gzip.open(compressed_file_name, "wb") as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+        elif self.compress == "3mf":
+            compressed_file_name = stl_file_name.with_suffix(".3mf")
+            three_mf_writer = ThreeMfWriter()
+            three_mf_writer.add_stl(stl_file_name)
+            three_mf_writer.write(compressed_file_name)
+
+        if self.compress is not None:
+            result["compressed"] = str(compressed_file_name)
+            result["compressed_size"] = compressed_file_name.stat().st_size
+
+        if self.info:
+            info_file_name = stl_file_name.with_suffix(".json")
+            result["info"] = str(info_file_name)
+            with open(info_file_name, "w") as f:
+                json.dump(result, f, indent=2)
+
+        self.logger.info(
+            "Post processed %s: %d bytes -> %d bytes",
+            stl_file_name,
+            result["original_size"],
+            result["size"],
+        )
+
+        return result
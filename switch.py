@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from solid import polygon, linear_extrude, rotate, mirror
 
 from solid.utils import right, back, down
@@ -6,6 +7,7 @@ from solid.utils import right, back, down
 import logging
 
 from cell import Cell
+from neighbor_graph import NeighborGraph
 from parameters import Parameters
 from switch_config import SwitchConfig
 
@@ -52,10 +54,16 @@ class Switch(Cell):
     -------
     switch_cutout()
         Get a switch soild that matches the attribute settings
-    update_all_neighbors_set(neighbor_group = 'local')
-        Check if all neighbors are defined where they exist and set the neighbor_check_complete value to match
+    set_switch_config(switch_config)
+        Set the switch config and swap the switch cutout to match it
+    set_preview(preview)
+        Swap the switch cutout between the full cutout and the low detail preview cutout
+    get_cutout_cache_key()
+        Get the key used to share identical switch cutouts between switches
+    set_neighbor_graph(neighbor_graph)
+        Add the switch to the neighbor graph that holds its neighbors
     get_all_neighbors_set(neighbor_group = 'local')
-        Get the value of neighbor_check_complete for the passed in neughbor group
+        Check if the neighbors in every direction have been set for the passed in neughbor group
     get_neighbor(neighbor_name, neighbor_group = 'local')
         Get the neighbor Switch object for the name and group passed in
     set_neighbor(neighbor = None, neighbor_name = '', offset = 0.0, has_neighbor = True, neighbor_group = 'local',
@@ -78,6 +86,13 @@ class Switch(Cell):
         "bottom": "top",
     }
 
+    # Switch cutout solids shared by all switches with the same shape. The cutout is only moved into place
+    # when it is used so identical keys can reference the same object. The least recently used cutouts are
+    # dropped once the cache holds CUTOUT_CACHE_SIZE cutouts so a long running service does not keep one for
+    # every switch config it has ever seen
+    cutout_cache = OrderedDict()
+    CUTOUT_CACHE_SIZE = 256
+
     def __init__(
         self,
         x,
@@ -111,7 +126,10 @@ class Switch(Cell):
 
         self.parameters: Parameters = parameters
 
-        self.solid = self.switch_cutout()
+        # Preview cutouts replace every polygon with its bounding box
+        self.preview = False
+
+        self.set_switch_config(self.switch_config)
 
         self.logger.debug(
             "x: %f, y: %f, w: %f, h: %f, end_x: %f, end_y: %f",
@@ -123,21 +141,9 @@ class Switch(Cell):
             self.end_y,
         )
 
-        self.global_neighbors = {
-            "right": {},
-            "left": {},
-            "top": {},
-            "bottom": {},
-            "neighbor_check_complete": False,
-        }
-
-        self.local_neighbors = {
-            "right": {},
-            "left": {},
-            "top": {},
-            "bottom": {},
-            "neighbor_check_complete": False,
-        }
+        # Neighbors are stored in the neighbor graph of the layout under the id of the switch
+        self.neighbor_graph = None
+        self.neighbor_id = None
 
         # self.right = None
         # self.left_in_section = None
@@ -177,12 +183,38 @@ class Switch(Cell):
     def __str__(self):
         return "Switch: " + super().__str__()
 
+    def get_neighbor_dict(self, neighbor_group="local"):
+        # Neighbors of the group as nested dicts for printing
+        neighbor_dict = {}
+        for direction in self.get_neighbor_direction_list():
+            neighbor_dict[direction] = {}
+            if (
+                self.neighbor_graph is not None
+                and self.neighbor_graph.get_neighbor_id(
+                    self.neighbor_id, direction, neighbor_group
+                )
+                != NeighborGraph.UNSET
+            ):
+                neighbor_dict[direction] = {
+                    "has_neighbor": self.has_neighbor(direction, neighbor_group),
+                    "neighbor": self.get_neighbor(direction, neighbor_group),
+                    "offset": self.get_neighbor_offset(direction, neighbor_group),
+                    "perp_offset": self.get_neighbor_perp_offset(
+                        direction, neighbor_group
+                    ),
+                }
+        neighbor_dict["neighbor_check_complete"] = self.get_all_neighbors_set(
+            neighbor_group
+        )
+
+        return neighbor_dict
+
     def __repr__(self):
         global_neighbors_json = self.neighbors_formatted(
-            self.global_neighbors, indent=4, current_indent=10
+            self.get_neighbor_dict("global"), indent=4, current_indent=10
         )
         local_neighbors_json = self.neighbors_formatted(
-            self.local_neighbors, indent=4, current_indent=10
+            self.get_neighbor_dict("local"), indent=4, current_indent=10
         )
         return (
             "Switch: "
@@ -193,6 +225,52 @@ class Switch(Cell):
             + local_neighbors_json
         )
 
+    def set_switch_config(self, switch_config: SwitchConfig):
+        """
+        Set the switch config and replace the switch cutout solid with the one for the new config
+        """
+        self.switch_config = switch_config
+
+        cutout_cache_key = self.get_cutout_cache_key()
+        if cutout_cache_key not in Switch.cutout_cache:
+            Switch.cutout_cache[cutout_cache_key] = self.switch_cutout()
+            while len(Switch.cutout_cache) > Switch.CUTOUT_CACHE_SIZE:
+                Switch.cutout_cache.popitem(last=False)
+        Switch.cutout_cache.move_to_end(cutout_cache_key)
+        self.solid = Switch.cutout_cache[cutout_cache_key]
+
+    def set_preview(self, preview):
+        """
+        Set preview mode and replace the switch cutout solid with the one for the mode
+        """
+        self.preview = preview
+
+        self.set_switch_config(self.switch_config)
+
+    def get_cutout_cache_key(self):
+        """
+        Return a key that identifies every value that changes the shape of the switch cutout
+
+        Returns
+        -------
+        tuple
+            The cache key for the cutout
+        """
+
+        return (
+            self.switch_config.switch_type,
+            self.switch_config.stabilizer_type,
+            self.switch_config.kerf,
+            str(self.switch_config.custom_shape_points),
+            str(self.switch_config.custom_shape_path),
+            self.switch_length,
+            self.vertical,
+            self.w_mm,
+            self.h_mm,
+            self.parameters.plate_thickness,
+            self.preview,
+        )
+
     def switch_cutout(self):
         """
         Return the polygon that will be used to cutout a place in the plate for a switch
@@ -226,6 +304,14 @@ class Switch(Cell):
             len(switch_poly_path),
         )
 
+        # Preview cutouts use the bounding box of each polygon and skip the cutouts below the plate
+        if self.preview:
+            switch_poly_points = self.get_bounding_box_points(switch_poly_points)
+            switch_poly_path = [range(len(switch_poly_points))]
+            if stab_poly_points is not None:
+                stab_poly_points = self.get_bounding_box_points(stab_poly_points)
+            support_cutout_poly_points = None
+
         # Create swtch cutout polygon
         cutout_polygon = polygon(switch_poly_points, switch_poly_path)
 
@@ -270,40 +356,32 @@ class Switch(Cell):
 
         return offset_cutout
 
-    def update_all_neighbors_set(self, neighbor_group="local"):
-
-        if neighbor_group == "local":
-            neighbor_dict = self.local_neighbors
-        elif neighbor_group == "global":
-            neighbor_dict = self.global_neighbors
+    @staticmethod
+    def get_bounding_box_points(poly_points):
+        min_x = min([point[0] for point in poly_points])
+        max_x = max([point[0] for point in poly_points])
+        min_y = min([point[1] for point in poly_points])
+        max_y = max([point[1] for point in poly_points])
 
-        all_neighbors_set = True
-        for direction in neighbor_dict.keys():
-            if direction != "neighbor_check_complete":
-                if len(neighbor_dict[direction].keys()) == 0:
-                    all_neighbors_set = False
+        return [[min_x, min_y], [max_x, min_y], [max_x, max_y], [min_x, max_y]]
 
-        neighbor_dict["neighbor_check_complete"] = all_neighbors_set
+    def set_neighbor_graph(self, neighbor_graph: NeighborGraph):
+        self.neighbor_graph = neighbor_graph
+        self.neighbor_id = neighbor_graph.add_item(self)
 
     def get_all_neighbors_set(self, neighbor_group="local"):
+        if self.neighbor_graph is None:
+            return False
 
-        if neighbor_group == "local":
-            neighbor_dict = self.local_neighbors
-        elif neighbor_group == "global":
-            neighbor_dict = self.global_neighbors
-
-        return neighbor_dict["neighbor_check_complete"]
+        return self.neighbor_graph.is_complete(self.neighbor_id, neighbor_group)
 
     def get_neighbor(self, neighbor_name, neighbor_group="local"):
+        if self.neighbor_graph is None:
+            return None
 
-        neighbor = None
-
-        if neighbor_group == "local":
-            neighbor = self.local_neighbors[neighbor_name]["neighbor"]
-        elif neighbor_group == "global":
-            neighbor = self.global_neighbors[neighbor_name]["neighbor"]
-
-        return neighbor
+        return self.neighbor_graph.get_neighbor(
+            self.neighbor_id, neighbor_name, neighbor_group
+        )
 
     def set_neighbor(
         self,
@@ -314,18 +392,24 @@ class Switch(Cell):
         neighbor_group="local",
         perp_offset=0.0,
     ):
-
-        temp_dict = {
-            "has_neighbor": has_neighbor,
-            "neighbor": neighbor,
-            "offset": offset,
-            "perp_offset": perp_offset,
-        }
-
-        if neighbor_group == "local":
-            self.local_neighbors[neighbor_name] = temp_dict
-        elif neighbor_group == "global":
-            self.global_neighbors[neighbor_name] = temp_dict
+        if self.neighbor_graph is None:
+            self.set_neighbor_graph(NeighborGraph())
+
+        neighbor_id = NeighborGraph.NO_NEIGHBOR
+        if has_neighbor and neighbor is not None:
+            # Neighbors have to be in the same graph to be referenced by id
+            if neighbor.neighbor_graph is None:
+                neighbor.set_neighbor_graph(self.neighbor_graph)
+            neighbor_id = neighbor.neighbor_id
+
+        self.neighbor_graph.set_neighbor(
+            self.neighbor_id,
+            neighbor_name,
+            neighbor_group,
+            neighbor_id,
+            offset=offset,
+            perp_offset=perp_offset,
+        )
 
     # def set_right_neighbor(self, neighbor = None, offset = 0.0, has_neighbor = True,
     # neighbor_group = 'local', perp_offset = 0.0):
@@ -344,29 +428,31 @@ class Switch(Cell):
     #     self.set_neighbor(neighbor, 'bottom', offset, has_neighbor, neighbor_group, perp_offset)
 
     def has_neighbor(self, neighbor_name="", neighbor_group="local"):
-        if neighbor_group == "local":
-            return self.local_neighbors[neighbor_name]["has_neighbor"]
-        elif neighbor_group == "global":
-            return self.global_neighbors[neighbor_name]["has_neighbor"]
+        if self.neighbor_graph is None:
+            return False
 
-    def get_neighbor_offset(self, neighbor_name="", neighbor_group="local"):
-        if neighbor_group == "local":
-            return self.local_neighbors[neighbor_name]["offset"]
-        elif neighbor_group == "global":
-            return self.global_neighbors[neighbor_name]["offset"]
+        return (
+            self.neighbor_graph.get_neighbor_id(
+                self.neighbor_id, neighbor_name, neighbor_group
+            )
+            >= 0
+        )
 
-    def get_neighbor_perp_offset(self, neighbor_name="", neighbor_group="local"):
-        if neighbor_group == "local":
-            return self.local_neighbors[neighbor_name]["perp_offset"]
-        elif neighbor_group == "global":
-            return self.global_neighbors[neighbor_name]["perp_offset"]
+    def get_neighbor_offset(self, neighbor_name="", neighbor_group="local"):
+        if self.neighbor_graph is None:
+            return 0.0
 
-    def get_neighbor_direction_list(self):
+        return self.neighbor_graph.get_offset(
+            self.neighbor_id, neighbor_name, neighbor_group
+        )
 
-        name_list = []
+    def get_neighbor_perp_offset(self, neighbor_name="", neighbor_group="local"):
+        if self.neighbor_graph is None:
+            return 0.0
 
-        for neighbor_name in self.local_neighbors.keys():
-            if isinstance(self.local_neighbors[neighbor_name], dict):
-                name_list.append(neighbor_name)
+        return self.neighbor_graph.get_perp_offset(
+            self.neighbor_id, neighbor_name, neighbor_group
+        )
 
-        return name_list
+    def get_neighbor_direction_list(self):
+        return list(NeighborGraph.DIRECTION_LIST)
@@ -0,0 +1,254 @@
+import io
+import logging
+from pathlib import Path
+import shutil
+import tempfile
+from xml.sax.saxutils import escape
+import zipfile
+
+from file_io import iter_stl_triangles
+
+CONTENT_TYPES_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+ <Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+ <Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>
+</Types>
+"""
+
+RELS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+ <Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>
+</Relationships>
+"""
+
+MODEL_NAMESPACE = "http://schemas.microsoft.com/3dmanufacturing/core/2015/02"
+
+
+class ThreeMfWriter:
+    """
+    Package rendered STL files into a single 3MF archive with every part placed on a build plate
+
+    Parts are grouped by the section they were built for and every group starts on a new plate. Parts are
+    placed in rows from the bounding box of their mesh and a group moves on to another plate when a plate
+    is full. Plates are laid out next to each other along the x axis of the build
+
+    The mesh of each part is streamed from its STL file into the archive so only the unique vertex index of
+    the part being written is held in memory
+
+    ...
+
+    Attributes
+    ----------
+    bed_size : tuple
+        The (x, y) size of the build plate in mm
+
+    part_spacing : float
+        The gap between parts on a plate in mm
+
+    plate_spacing : float
+        The gap between plates in the build in mm
+
+    part_list : list
+        List of (stl_file_name, group) tuples in the order they were added
+
+    Methods
+    -------
+    add_stl(stl_file_name, group=None)
+        Add an STL file to the archive. Parts with the same group share plates
+    write(three_mf_file_name)
+        Write every added part to a 3MF archive and get the placement of each part
+    """
+
+    def __init__(self, bed_size=(220.0, 220.0), part_spacing=5.0, plate_spacing=20.0):
+
+        self.logger = logging.getLogger().getChild(__name__)
+
+        self.bed_size = tuple(bed_size)
+        self.part_spacing = part_spacing
+        self.plate_spacing = plate_spacing
+
+        self.part_list = []
+
+    def add_stl(self, stl_file_name, group=None):
+        self.part_list.append((Path(stl_file_name), group))
+
+    def write_object(self, model_file, object_id, stl_file_name):
+        # Write one mesh object and get its bounding box. The triangle indices are spooled to a temporary
+        # file because 3MF needs every vertex before the first triangle
+        vertex_index_dict = {}
+        bounds_min = [float("inf")] * 3
+        bounds_max = [float("-inf")] * 3
+        triangle_count = 0
+
+        model_file.write(
+            '  <object id="%d" name="%s" type="model">\n'
+            % (object_id, escape(stl_file_name.stem, {'"': "&quot;"}))
+        )
+        model_file.write("   <mesh>\n    <vertices>\n")
+
+        with tempfile.TemporaryFile("w+") as triangle_file:
+            for triangle in iter_stl_triangles(stl_file_name):
+                index_list = []
+                for vertex in triangle:
+                    index = vertex_index_dict.get(vertex)
+                    if index is None:
+                        index = len(vertex_index_dict)
+                        vertex_index_dict[vertex] = index
+                        model_file.write(
+                            '     <vertex x="%.7g" y="%.7g" z="%.7g"/>\n' % vertex
+                        )
+                        for axis in range(3):
+                            bounds_min[axis] = min(bounds_min[axis], vertex[axis])
+                            bounds_max[axis] = max(bounds_max[axis], vertex[axis])
+                    index_list.append(index)
+
+                # 3MF does not allow a triangle to use the same vertex twice
+                if len(set(index_list)) < 3:
+                    continue
+
+                triangle_file.write(
+                    '     <triangle v1="%d" v2="%d" v3="%d"/>\n' % tuple(index_list)
+                )
+                triangle_count += 1
+
+            model_file.write("    </vertices>\n    <triangles>\n")
+            triangle_file.seek(0)
+            shutil.copyfileobj(triangle_file, model_file)
+
+        model_file.write("    </triangles>\n   </mesh>\n  </object>\n")
+
+        return (bounds_min, bounds_max, triangle_count)
+
+    def get_placement_list(self, object_list):
+        """
+        Place every object on a plate in rows. Each group starts on a new plate
+
+        Returns
+        -------
+        list
+            List of (object_id, plate, x_offset, y_offset, z_offset) tuples that move each object from its
+            STL position to its plate position
+        """
+        (bed_x, bed_y) = self.bed_size
+        spacing = self.part_spacing
+
+        placement_list = []
+        plate = -1
+        previous_group = None
+        (cursor_x, cursor_y, row_height) = (0.0, 0.0, 0.0)
+
+        for object_id, group, bounds_min, bounds_max in object_list:
+            size_x = bounds_max[0] - bounds_min[0]
+            size_y = bounds_max[1] - bounds_min[1]
+
+            if size_x > bed_x or size_y > bed_y:
+                self.logger.warning(
+                    "Part %d is %.1f x %.1f mm which is larger than the %.1f x %.1f mm build plate",
+                    object_id,
+                    size_x,
+                    size_y,
+                    bed_x,
+                    bed_y,
+                )
+
+            new_plate = plate == -1 or group != previous_group
+
+            # Start a new row when the part does not fit next to the last part
+            if not new_plate and cursor_x > 0 and cursor_x + size_x > bed_x:
+                cursor_x = 0.0
+                cursor_y += row_height + spacing
+                row_height = 0.0
+
+            # Start a new plate when the part does not fit above the last row
+            if new_plate or (cursor_y > 0 and cursor_y + size_y > bed_y):
+                plate += 1
+                (cursor_x, cursor_y, row_height) = (0.0, 0.0, 0.0)
+
+            plate_x = plate * (bed_x + self.plate_spacing)
+            placement_list.append(
+                (
+                    object_id,
+                    plate,
+                    plate_x + cursor_x - bounds_min[0],
+                    cursor_y - bounds_min[1],
+                    -bounds_min[2],
+                )
+            )
+
+            cursor_x += size_x + spacing
+            row_height = max(row_height, size_y)
+            previous_group = group
+
+        return placement_list
+
+    def write(self, three_mf_file_name):
+        """
+        Write every added part to a 3MF archive. Empty STL files are skipped
+
+        Returns
+        -------
+        list
+            List of dicts with the STL file name, plate number, offset and triangle count of every part
+        """
+        three_mf_file_name = Path(three_mf_file_name)
+
+        object_list = []
+        part_info_dict = {}
+
+        with zipfile.ZipFile(
+            three_mf_file_name, "w", compression=zipfile.ZIP_DEFLATED
+        ) as archive:
+            archive.writestr("[Content_Types].xml", CONTENT_TYPES_XML)
+            archive.writestr("_rels/.rels", RELS_XML)
+
+            with archive.open(
+                "3D/3dmodel.model", "w", force_zip64=True
+            ) as model_stream:
+                model_file = io.TextIOWrapper(model_stream, encoding="utf-8")
+
+                model_file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+                model_file.write(
+                    '<model unit="millimeter" xml:lang="en-US" xmlns="%s">\n'
+                    % (MODEL_NAMESPACE)
+                )
+                model_file.write(" <resources>\n")
+
+                for object_id, (stl_file_name, group) in enumerate(
+                    self.part_list, start=1
+                ):
+                    # An object without triangles is not valid 3MF
+                    if next(iter_stl_triangles(stl_file_name), None) is None:
+                        self.logger.warning("Skip empty STL file %s", stl_file_name)
+                        continue
+
+                    (bounds_min, bounds_max, triangle_count) = self.write_object(
+                        model_file, object_id, stl_file_name
+                    )
+
+                    object_list.append((object_id, group, bounds_min, bounds_max))
+                    part_info_dict[object_id] = {
+                        "stl": str(stl_file_name),
+                        "triangle_count": triangle_count,
+                    }
+
+                model_file.write(" </resources>\n <build>\n")
+
+                placement_list = self.get_placement_list(object_list)
+                for object_id, plate, x_offset, y_offset, z_offset in placement_list:
+                    model_file.write(
+                        '  <item objectid="%d" transform="1 0 0 0 1 0 0 0 1 %.7g %.7g %.7g"/>\n'
+                        % (object_id, x_offset, y_offset, z_offset)
+                    )
+                    part_info_dict[object_id]["plate"] = plate
+                    part_info_dict[object_id]["offset"] = [x_offset, y_offset, z_offset]
+
+                model_file.write(" </build>\n</model>\n")
+
+                # Flush the text buffer without closing the zip entry twice
+                model_file.detach()
+
+        self.logger.info(
+            "Wrote %d parts to %s", len(placement_list), three_mf_file_name
+        )
+
+        return [part_info_dict[object_id] for object_id, *_ in placement_list]